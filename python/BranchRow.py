@@ -0,0 +1,124 @@
+import logging
+import sys
+from array import array
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+# array typecodes of the scalar leaf types
+leafTypes = {
+    'Float_t'   : 'f',
+    'Double_t'  : 'd',
+    'Int_t'     : 'i',
+    'UInt_t'    : 'I',
+    'Long64_t'  : 'l',
+    'ULong64_t' : 'L',
+    'Short_t'   : 'h',
+    'UShort_t'  : 'H',
+    'Char_t'    : 'b',
+    'UChar_t'   : 'B',
+    'Bool_t'    : 'B',
+}
+
+class BranchRow(object):
+    '''
+    Row of a tree read into preallocated buffers, for row by row loops.
+
+    Branches are bound with SetBranchAddress the first time they are used and all other branches
+    are switched off, so only the branches an analysis reads are read from the files. For a chain
+    ROOT binds the buffers again for each file. Scalar branches are plain attributes
+    (row.z1_pt, getattr(row,'{0}_pt'.format(lep))), per object values are also available by
+    slot without building the name (row.get('z1','pt'), row.getSlots('pt')).
+    Branches that can not be bound (vectors, strings, arrays) are read through the tree.
+
+        for row in BranchRow(tree,slots=['z1','z2','w1']):
+            perRowAction(row)
+    '''
+
+    def __init__(self,tree,slots=[]):
+        self.__dict__['tree'] = tree
+        self.__dict__['slots'] = list(slots)
+        self.__dict__['buffers'] = {}
+        self.__dict__['slotBuffers'] = {}
+        self.__dict__['proxied'] = set()
+        self.__dict__['missing'] = set()
+        self.__dict__['entry'] = -1
+        self.__dict__['treeNumber'] = -1
+
+    def __iter__(self):
+        tree = self.tree
+        tree.SetBranchStatus('*',0)
+        try:
+            for i in xrange(tree.GetEntries()):
+                if tree.LoadTree(i)<0: break
+                if tree.GetTreeNumber()!=self.treeNumber:
+                    # branches missing from one file may be in the next
+                    self.__dict__['treeNumber'] = tree.GetTreeNumber()
+                    self.missing.clear()
+                self.__dict__['entry'] = i
+                tree.GetEntry(i)
+                yield self
+        finally:
+            # the tree must not keep pointers to the buffers of this row
+            tree.ResetBranchAddresses()
+            tree.SetBranchStatus('*',1)
+            self.buffers.clear()
+            self.slotBuffers.clear()
+            self.proxied.clear()
+
+    def __bind(self,name):
+        '''Bind a branch to a buffer, False if it does not exist or is not a scalar'''
+        branch = self.tree.GetBranch(name)
+        if not branch: return False
+        leaves = branch.GetListOfLeaves()
+        if branch.IsA()!=ROOT.TBranch.Class() or leaves.GetEntries()!=1: return False
+        leaf = leaves.At(0)
+        typecode = leafTypes.get(leaf.GetTypeName(),None)
+        if typecode is None or leaf.GetLeafCount() or leaf.GetLen()!=1: return False
+        buf = array(typecode,[0])
+        self.tree.SetBranchStatus(name,1)
+        self.tree.SetBranchAddress(name,buf)
+        self.buffers[name] = buf
+        return True
+
+    def __read(self,name):
+        '''Start reading a branch and read it for the current entry'''
+        if name in self.missing: raise AttributeError(name)
+        if not self.tree.GetBranch(name):
+            self.missing.add(name)
+            raise AttributeError(name)
+        if not self.__bind(name):
+            logging.debug('Reading branch {0} through the tree'.format(name))
+            self.tree.SetBranchStatus(name,1)
+            self.proxied.add(name)
+        if self.entry>=0: self.tree.GetEntry(self.entry)
+
+    def __getattr__(self,name):
+        buf = self.buffers.get(name,None)
+        if buf is not None: return buf[0]
+        if name.startswith('__'): raise AttributeError(name)
+        if name not in self.proxied: self.__read(name)
+        buf = self.buffers.get(name,None)
+        if buf is not None: return buf[0]
+        return getattr(self.tree,name)
+
+    def __setattr__(self,name,value):
+        raise AttributeError('BranchRow is read only')
+
+    def get(self,slot,var):
+        '''Value of a variable of an object slot, e.g. get('z1','pt') for z1_pt'''
+        buf = self.slotBuffers.get((slot,var),None)
+        if buf is None:
+            name = '{0}_{1}'.format(slot,var)
+            value = getattr(self,name)
+            if name not in self.buffers: return value
+            buf = self.slotBuffers[(slot,var)] = self.buffers[name]
+        return buf[0]
+
+    def getSlots(self,var,slots=None):
+        '''Values of a variable for each slot (by default the slots of the row)'''
+        if slots is None: slots = self.slots
+        return [self.get(slot,var) for slot in slots]
@@ -0,0 +1,54 @@
+import logging
+import os
+import sys
+
+try:
+    import numpy as np
+    import root_numpy
+    hasColumnar = True
+except:
+    hasColumnar = False
+
+class ColumnReader(object):
+    '''Read branches of a list of files in chunks of numpy arrays'''
+
+    def __init__(self,files,treeName,columns=None,**kwargs):
+        self.files = files
+        self.treeName = treeName
+        self.columns = columns
+        self.chunkSize = int(kwargs.pop('chunkSize',100000))
+
+    def __getColumns(self,filename):
+        '''Only read the requested columns that exist in the file'''
+        if self.columns is None: return None
+        available = set(root_numpy.list_branches(filename,self.treeName))
+        missing = [c for c in self.columns if c not in available]
+        if missing: logging.debug('Columns not found in {0}: {1}'.format(filename,' '.join(missing)))
+        return [c for c in self.columns if c in available]
+
+    def __iter__(self):
+        for filename in self.files:
+            columns = self.__getColumns(filename)
+            start = 0
+            while True:
+                chunk = root_numpy.root2array(filename,self.treeName,branches=columns,start=start,stop=start+self.chunkSize)
+                if len(chunk)==0: break
+                yield chunk
+                start += len(chunk)
+                if len(chunk)<self.chunkSize: break
+
+def hasColumn(chunk,column):
+    '''Check if a column was read'''
+    return column in chunk.dtype.names
+
+def mapColumn(values,func):
+    '''Apply a python function once per unique value of a column'''
+    unique, inverse = np.unique(values,return_inverse=True)
+    mapped = np.array([func(v) for v in unique])
+    return mapped[inverse]
+
+def groupColumn(values,n):
+    '''Split events by the value of a column, a single value applies to all events'''
+    if isinstance(values,basestring): return [(values,np.ones(n,dtype=bool))]
+    values = np.asarray(values)
+    return [(v,values==v) for v in np.unique(values)]
@@ -0,0 +1,95 @@
+import logging
+import os
+import mmap
+import struct
+
+import numpy as np
+
+# layout of a count store file (little endian):
+#   magic (8 bytes), number of keys n, size of the key table (uint64)
+#   key offsets (n+1 uint64) into the key table, keys sorted bytewise
+#   key table, padded to 8 bytes
+#   val, count, err2 (n float64 each)
+MAGIC = 'DTCNT001'
+HEADER = struct.Struct('<8sQQ')
+
+def _encode(key):
+    return key.encode('utf-8') if isinstance(key,unicode) else key
+
+def writeCountStore(filename,counts):
+    '''Write a dictionary of {key: {'val','count','err2'}} to a count store'''
+    keys = sorted([_encode(key) for key in counts])
+    values = dict([(_encode(key),counts[key]) for key in counts])
+    offsets = np.zeros(len(keys)+1,dtype='<u8')
+    if keys: offsets[1:] = np.cumsum([len(key) for key in keys])
+    table = ''.join(keys)
+    padding = '\0'*(-len(table)%8)
+    tmpFile = '{0}.{1}.tmp'.format(filename,os.getpid())
+    with open(tmpFile,'wb') as f:
+        f.write(HEADER.pack(MAGIC,len(keys),len(table)))
+        f.write(offsets.tostring())
+        f.write(table+padding)
+        for name in ['val','count','err2']:
+            f.write(np.array([values[key][name] for key in keys],dtype='<f8').tostring())
+    os.rename(tmpFile,filename)
+
+class CountStore(object):
+    '''Read only, memory mapped count store, keys are found by binary search'''
+
+    def __init__(self,filename):
+        self.filename = filename
+        with open(filename,'rb') as f:
+            self.mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        magic, self.n, tableSize = HEADER.unpack(self.mm[:HEADER.size])
+        if magic!=MAGIC: raise ValueError('{0} is not a count store'.format(filename))
+        pos = HEADER.size
+        self.offsets = np.frombuffer(self.mm,dtype='<u8',count=self.n+1,offset=pos)
+        pos += 8*(self.n+1)
+        self.tableStart = pos
+        pos += tableSize+(-tableSize%8)
+        self.vals = np.frombuffer(self.mm,dtype='<f8',count=self.n,offset=pos)
+        self.counts = np.frombuffer(self.mm,dtype='<f8',count=self.n,offset=pos+8*self.n)
+        self.err2s = np.frombuffer(self.mm,dtype='<f8',count=self.n,offset=pos+16*self.n)
+        logging.debug('Opened count store {0} with {1} keys'.format(filename,self.n))
+
+    def __key(self,i):
+        return self.mm[self.tableStart+int(self.offsets[i]):self.tableStart+int(self.offsets[i+1])]
+
+    def find(self,key):
+        '''Index of a key, -1 if it is not in the store'''
+        key = _encode(key)
+        lo, hi = 0, self.n
+        while lo<hi:
+            mid = (lo+hi)//2
+            if self.__key(mid)<key:
+                lo = mid+1
+            else:
+                hi = mid
+        if lo<self.n and self.__key(lo)==key: return lo
+        return -1
+
+    def __len__(self):
+        return self.n
+
+    def __contains__(self,key):
+        return self.find(key)>=0
+
+    def __entry(self,i):
+        return {'val': float(self.vals[i]), 'count': int(self.counts[i]), 'err2': float(self.err2s[i])}
+
+    def __getitem__(self,key):
+        i = self.find(key)
+        if i<0: raise KeyError(key)
+        return self.__entry(i)
+
+    def get(self,key,default=None):
+        i = self.find(key)
+        if i<0: return default
+        return self.__entry(i)
+
+    def keys(self):
+        return [self.__key(i) for i in range(self.n)]
+
+    def toDict(self):
+        '''Full copy of the store as a dictionary, e.g. for a json export'''
+        return dict([(self.__key(i),self.__entry(i)) for i in range(self.n)])
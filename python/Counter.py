@@ -31,6 +31,7 @@ class Counter(object):
         self.processSampleCuts = {}
         self.signals = []
         self.scales = {}
+        self.tempCounts = {}
         self.j = 0
         self.poisson = kwargs.pop('poisson',False) # return poisson errors
 
@@ -66,6 +67,7 @@ class Counter(object):
         self.signals = []
         self.scales = {}
         self.processSampleCuts = {}
+        self.tempCounts = {}
 
     def _readSampleCount(self,sampleName,directory,**kwargs):
         '''Read the count from file'''
@@ -82,11 +84,51 @@ class Counter(object):
     def _getTempCount(self,sampleName,selection,scalefactor,**kwargs):
         '''Get a temporary count'''
         analysis = kwargs.pop('analysis',self.analysis)
+        key = (analysis,sampleName,selection,scalefactor)
+        if key in self.tempCounts: return self.tempCounts[key]
         hist = self.sampleFiles[analysis][sampleName].getTempCount(selection,scalefactor)
         val = hist.GetBinContent(1) if hist else 0.
         err = hist.GetBinError(1) if hist else 0.
+        self.tempCounts[key] = (val,err)
         return val,err
 
+    def _getTempCounts(self,cuts):
+        '''Fill the temporary counts for a list of (analysis, sampleName, selection, scalefactor) with one pass per sample'''
+        sampleCuts = OrderedDict()
+        for key in cuts:
+            if key in self.tempCounts: continue
+            analysis, sampleName, selection, scalefactor = key
+            if (analysis,sampleName) not in sampleCuts: sampleCuts[(analysis,sampleName)] = []
+            if (selection,scalefactor) not in sampleCuts[(analysis,sampleName)]: sampleCuts[(analysis,sampleName)] += [(selection,scalefactor)]
+        for (analysis,sampleName), sels in sampleCuts.iteritems():
+            counts = self.sampleFiles[analysis][sampleName].getTempCounts(sels)
+            for (selection,scalefactor), count in zip(sels,counts):
+                self.tempCounts[(analysis,sampleName,selection,scalefactor)] = count
+
+    def _getSampleCuts(self,processName,**kwargs):
+        '''Get the (sampleName, selection, scalefactor) of a process for a custom selection'''
+        scalefactor = kwargs.pop('scalefactor','1')
+        mcscalefactor = kwargs.pop('mcscalefactor','1')
+        datascalefactor = kwargs.pop('datascalefactor','1')
+        selection = kwargs.pop('selection','')
+        mccut = kwargs.pop('mccut','')
+        cuts = []
+        for sampleName in self.processDict[processName]:
+            sf = '*'.join([scalefactor,datascalefactor if isData(sampleName) else mcscalefactor])
+            fullcut = ' && '.join([selection,mccut]) if mccut and not isData(sampleName) else selection
+            if processName in self.processSampleCuts:
+                if sampleName in self.processSampleCuts[processName]:
+                    fullcut += ' && {0}'.format(self.processSampleCuts[processName][sampleName])
+            # scale a sample via a cut
+            if processName in self.scales and sampleName in self.scales[processName]:
+                for cut in self.scales[processName][sampleName]:
+                    thissf = '{0}*{1}'.format(sf,self.scales[processName][sampleName][cut])
+                    thisFullCut = '{0} && {1}'.format(fullcut, cut)
+                    cuts += [(sampleName,thisFullCut,thissf)]
+            else:
+                cuts += [(sampleName,fullcut,sf)]
+        return cuts
+
     def _getPoisson(self,count):
         entries = count[0]
         if entries<0: entries = 0
@@ -99,11 +141,7 @@ class Counter(object):
     def _getCount(self,processName,directory,**kwargs):
         '''Get count for process'''
         analysis = self.analysisDict[processName]
-        scalefactor = kwargs.pop('scalefactor','1')
-        mcscalefactor = kwargs.pop('mcscalefactor','1')
-        datascalefactor = kwargs.pop('datascalefactor','1')
-        selection = kwargs.pop('selection','')
-        mccut = kwargs.pop('mccut','')
+        selection = kwargs.get('selection','')
         # check if it is a map, list, or directory
         if isinstance(directory,dict):       # its a map
             directory = directory[processName]
@@ -114,28 +152,18 @@ class Counter(object):
             counts = []
             for dirName in directory:
                 logging.debug('Directory: {0}'.format(dirName))
-                for sampleName in self.processDict[processName]:
-                    logging.debug('Sample: {0}'.format(sampleName))
-                    if selection:
-                        logging.debug('Custom selection')
-                        sf = '*'.join([scalefactor,datascalefactor if isData(sampleName) else mcscalefactor])
-                        fullcut = ' && '.join([selection,mccut]) if mccut and not isData(sampleName) else selection
-                        if processName in self.processSampleCuts:
-                            if sampleName in self.processSampleCuts[processName]:
-                                fullcut += ' && {0}'.format(self.processSampleCuts[processName][sampleName])
-                        # scale a sample via a cut
-                        if processName in self.scales and sampleName in self.scales[processName]:
-                            for cut in self.scales[processName][sampleName]:
-                                thissf = '{0}*{1}'.format(sf,self.scales[processName][sampleName][cut])
-                                thisFullCut = '{0} && {1}'.format(fullcut, cut)
-                                count = self._getTempCount(sampleName,thisFullCut,thissf,analysis=analysis)
-                                logging.debug('Count: {0} +/- {1}'.format(*count))
-                                if count: counts += [count]
-                        else:
-                            count = self._getTempCount(sampleName,fullcut,sf,analysis=analysis)
-                            logging.debug('Count: {0} +/- {1}'.format(*count))
-                            if count: counts += [count]
-                    else:
+                if selection:
+                    logging.debug('Custom selection')
+                    sampleCuts = self._getSampleCuts(processName,**kwargs)
+                    self._getTempCounts([(analysis,sampleName,cut,sf) for sampleName,cut,sf in sampleCuts])
+                    for sampleName,cut,sf in sampleCuts:
+                        logging.debug('Sample: {0}'.format(sampleName))
+                        count = self._getTempCount(sampleName,cut,sf,analysis=analysis)
+                        logging.debug('Count: {0} +/- {1}'.format(*count))
+                        if count: counts += [count]
+                else:
+                    for sampleName in self.processDict[processName]:
+                        logging.debug('Sample: {0}'.format(sampleName))
                         count = self._readSampleCount(sampleName,dirName,analysis=analysis)
                         logging.debug('Count: {0} +/- {1}'.format(*count))
                         if count: counts += [count]
@@ -166,9 +194,20 @@ class Counter(object):
         '''Get a single count'''
         return self._getCount(processName,directory,**kwargs)
 
+    def prefetchCounts(self,selections,**kwargs):
+        '''Count a list of custom selections for all processes with one pass per sample'''
+        cuts = []
+        for selection in selections:
+            kwargs['selection'] = selection
+            for processName in self.processOrder:
+                analysis = self.analysisDict[processName]
+                cuts += [(analysis,sampleName,cut,sf) for sampleName,cut,sf in self._getSampleCuts(processName,**kwargs)]
+        self._getTempCounts(cuts)
+
     def getCounts(self,directory,**kwargs):
         '''Get a map for the counts'''
         counts = {}
+        if kwargs.get('selection',''): self.prefetchCounts([kwargs['selection']],**kwargs)
         for processName in self.processOrder:
             counts[processName] = self.getCount(processName,directory,**kwargs)
         return counts
@@ -0,0 +1,185 @@
+import logging
+
+import numpy as np
+
+class CutOptimizer(object):
+    '''
+    Collect the discriminating variables of events and scan cut thresholds after the event loop.
+
+    Each cut is (variable, thresholds, direction), keeping events with the variable above ('>')
+    or below ('<') the threshold. Events are stored in categories, the name of a category is
+    formatted with the variable and threshold to name the counts, e.g. 'optimize/{var}/{cut}/500/hpp0'.
+    '''
+
+    def __init__(self,cuts,columns=[]):
+        self.cuts = [(var,np.array(thresholds,dtype=np.float64),direction) for var,thresholds,direction in cuts]
+        # keep the thresholds as given for the names of the counts
+        self.cutValues = dict([(var,list(thresholds)) for var,thresholds,direction in cuts])
+        self.cutVars = [var for var,thresholds,direction in self.cuts]
+        self.columns = self.cutVars + [c for c in columns if c not in self.cutVars]
+        self.labelNames = ['category','chan','genChan']
+        self.labels = dict([(l,[]) for l in self.labelNames])
+        self.labelIds = dict([(l,{}) for l in self.labelNames])
+        self.__reset()
+
+    def __reset(self):
+        self.data = dict([(c,[]) for c in self.columns+['weight']+['pass_'+v for v in self.cutVars]+self.labelNames])
+
+    def __intern(self,label,value):
+        ids = self.labelIds[label]
+        if value not in ids:
+            ids[value] = len(self.labels[label])
+            self.labels[label] += [value]
+        return ids[value]
+
+    def add(self,category,values,weight,passes,chan,genChan='all'):
+        '''
+        Add an event to a category. values holds the columns, passes whether each cut variable
+        passes its nominal cut (used for the N-1 scans).
+        '''
+        for c in self.columns: self.data[c] += [values[c]]
+        for v in self.cutVars: self.data['pass_'+v] += [passes[v]]
+        self.data['weight'] += [weight]
+        self.data['category'] += [self.__intern('category',category)]
+        self.data['chan'] += [self.__intern('chan',chan)]
+        self.data['genChan'] += [self.__intern('genChan',genChan)]
+
+    def getArrays(self):
+        '''Columns of all events as numpy arrays'''
+        arrays = {}
+        for c in self.columns+['weight']:
+            arrays[c] = np.array(self.data[c],dtype=np.float64)
+        for v in self.cutVars:
+            arrays['pass_'+v] = np.array(self.data['pass_'+v],dtype=bool)
+        for l in self.labelNames:
+            arrays[l] = np.array(self.data[l],dtype=np.int64)
+        return arrays
+
+    def getLabels(self):
+        return dict([(l,list(self.labels[l])) for l in self.labelNames])
+
+    def merge(self,arrays,labels):
+        '''Add the events of another optimizer (e.g. from a worker process)'''
+        for c in self.columns+['weight']+['pass_'+v for v in self.cutVars]:
+            self.data[c] += arrays[c].tolist()
+        for l in self.labelNames:
+            remap = [self.__intern(l,value) for value in labels[l]]
+            self.data[l] += [remap[i] for i in arrays[l]]
+
+    def save(self,filename):
+        '''Save the events and cuts to a npz file, to scan again without the event loop'''
+        arrays = self.getArrays()
+        for l in self.labelNames:
+            arrays['labels_'+l] = np.array(self.labels[l])
+        for var,thresholds,direction in self.cuts:
+            arrays['thresholds_'+var] = thresholds
+        arrays['cutVars'] = np.array(self.cutVars)
+        arrays['directions'] = np.array([direction for var,thresholds,direction in self.cuts])
+        with open(filename,'wb') as f:
+            np.savez_compressed(f,**arrays)
+        logging.debug('Saved {0} events for optimization to {1}'.format(len(arrays['weight']),filename))
+
+    @classmethod
+    def load(cls,filename,columns=[]):
+        '''Load an optimizer saved with save'''
+        npz = np.load(filename)
+        cutVars = npz['cutVars'].tolist()
+        directions = npz['directions'].tolist()
+        cuts = [(var,npz['thresholds_'+var].tolist(),direction) for var,direction in zip(cutVars,directions)]
+        optimizer = cls(cuts,columns=columns)
+        labels = dict([(l,npz['labels_'+l].tolist()) for l in optimizer.labelNames])
+        optimizer.merge(dict([(key,npz[key]) for key in npz.files]),labels)
+        return optimizer
+
+    def __passIndex(self,var,values):
+        '''
+        Index of the first threshold an event fails for '>' cuts (it passes thresholds before it),
+        or of the first threshold it passes for '<' cuts (it passes thresholds from it on).
+        '''
+        thresholds, direction = [(t,d) for v,t,d in self.cuts if v==var][0]
+        if direction=='>': return np.searchsorted(thresholds,values,side='left')
+        return np.searchsorted(thresholds,values,side='right')
+
+    def __cumulate(self,hist,axis,direction):
+        '''Turn a histogram of pass indices into yields at each threshold along an axis'''
+        if direction=='>':
+            reverse = [slice(None)]*hist.ndim
+            reverse[axis] = slice(None,None,-1)
+            suffix = np.cumsum(hist[tuple(reverse)],axis=axis)[tuple(reverse)]
+            return np.take(suffix,range(1,hist.shape[axis]),axis=axis)
+        prefix = np.cumsum(hist,axis=axis)
+        return np.take(prefix,range(hist.shape[axis]-1),axis=axis)
+
+    def scan1D(self,arrays=None):
+        '''
+        N-1 scans of each cut, the other cuts at their nominal values.
+        Returns {(var, category, chan, genChan): (thresholds, val, count, err2)}, with chan and genChan
+        None for the sum over channels.
+        '''
+        if arrays is None: arrays = self.getArrays()
+        results = {}
+        nCat = len(self.labels['category'])
+        nChan = len(self.labels['chan'])
+        nGen = len(self.labels['genChan'])
+        for var,thresholds,direction in self.cuts:
+            mask = np.ones(len(arrays['weight']),dtype=bool)
+            for other in self.cutVars:
+                if other!=var: mask &= arrays['pass_'+other]
+            if not mask.any(): continue
+            index = self.__passIndex(var,arrays[var][mask])
+            weight = arrays['weight'][mask]
+            nBins = len(thresholds)+1
+            levels = [
+                (arrays['category'][mask], nCat, lambda g: (g,None,None)),
+                (arrays['category'][mask]*nChan+arrays['chan'][mask], nCat*nChan, lambda g: (g//nChan,g%nChan,None)),
+                ((arrays['category'][mask]*nChan+arrays['chan'][mask])*nGen+arrays['genChan'][mask], nCat*nChan*nGen, lambda g: (g//(nChan*nGen),g//nGen%nChan,g%nGen)),
+            ]
+            for group, nGroups, unravel in levels:
+                flat = group*nBins+index
+                yields = []
+                for w in [weight,np.ones_like(weight),weight**2]:
+                    hist = np.bincount(flat,weights=w,minlength=nGroups*nBins).reshape((nGroups,nBins))
+                    yields += [self.__cumulate(hist,1,direction)]
+                val, count, err2 = yields
+                for g in np.flatnonzero(count.sum(axis=1)):
+                    cat, chan, gen = unravel(g)
+                    chan = self.labels['chan'][chan] if chan is not None else None
+                    gen = self.labels['genChan'][gen] if gen is not None else None
+                    if gen=='all': continue
+                    results[(var,self.labels['category'][cat],chan,gen)] = (thresholds,val[g],count[g],err2[g])
+        return results
+
+    def fillCounts(self,skimmer):
+        '''Add the N-1 scans to the counts of a skimmer, as if each threshold had been incremented in the loop'''
+        names, vals, entries, err2s = [], [], [], []
+        for (var,category,chan,gen), (thresholds,val,count,err2) in self.scan1D().iteritems():
+            for i in np.flatnonzero(count):
+                name = category.format(var=var,cut=self.cutValues[var][i])
+                if chan is not None: name = '/'.join([name,chan])
+                if gen is not None: name = '/'.join([name,'gen_'+gen])
+                names += [name]
+                vals += [val[i]]
+                entries += [count[i]]
+                err2s += [err2[i]]
+        skimmer.addCounts(names,vals,entries,err2s)
+
+    def scanGrid(self,category,chan=None,genChan=None,arrays=None):
+        '''
+        Yields of the full grid of thresholds of all cuts for a category (optionally one channel).
+        Returns the thresholds of each cut and the val, count and err2 grids, indexed by threshold.
+        '''
+        if arrays is None: arrays = self.getArrays()
+        mask = arrays['category']==self.labelIds['category'].get(category,-1)
+        if chan is not None: mask &= arrays['chan']==self.labelIds['chan'].get(chan,-1)
+        if genChan is not None: mask &= arrays['genChan']==self.labelIds['genChan'].get(genChan,-1)
+        shape = tuple([len(thresholds)+1 for var,thresholds,direction in self.cuts])
+        index = np.ravel_multi_index([self.__passIndex(var,arrays[var][mask]) for var in self.cutVars],shape)
+        weight = arrays['weight'][mask]
+        grids = []
+        for w in [weight,np.ones_like(weight),weight**2]:
+            grid = np.bincount(index,weights=w,minlength=int(np.prod(shape))).reshape(shape)
+            for axis,(var,thresholds,direction) in enumerate(self.cuts):
+                grid = self.__cumulate(grid,axis,direction)
+            grids += [grid]
+        val, count, err2 = grids
+        return [thresholds for var,thresholds,direction in self.cuts], val, count, err2
@@ -11,6 +11,10 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from NtupleFlattener import NtupleFlattener
 from DevTools.Utilities.utilities import prod, ZMASS
+from DevTools.Plotter.ColumnReader import hasColumnar, hasColumn, mapColumn
+
+if hasColumnar:
+    import numpy as np
 
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -25,9 +29,11 @@ class DYFlattener(NtupleFlattener):
         # setup properties
         self.leps = ['z1','z2']
         self.channels = ['ee','mm']
-        self.selections = {
-            'default': lambda row: row.z_deltaR>0.02 and row.z_mass>60. and row.z1_pt>25. and row.z2_pt>20.,
+        # selections as lists of (variable, comparison, value), used by the row and the columnar loops
+        self.selectionCuts = {
+            'default': [('z_deltaR',operator.gt,0.02), ('z_mass',operator.gt,60.), ('z1_pt',operator.gt,25.), ('z2_pt',operator.gt,20.)],
         }
+        self.selections = dict([(sel,lambda row, cuts=cuts: all([op(getattr(row,var),val) for var,op,val in cuts])) for sel,cuts in self.selectionCuts.iteritems()])
 
         # setup histogram parameters
         self.histParams = {
@@ -92,28 +98,65 @@ class DYFlattener(NtupleFlattener):
             'nJets'                       : {'x': lambda row: row.numJetsTight30, 'xBinning': [11, -0.5, 10.5],        },
         }
 
+        # columns and vector expressions for the columnar loop
+        pileupScenarios = range(60000,81000,1000)
+        self.columns = ['isData','channel','numVertices','rho','met_pt','met_phi','z_mass','z_pt','z_deltaR','numJetsTight30','qqZZkfactor']
+        self.columns += ['genWeight','pileupWeight','pileupWeightUp','pileupWeightDown','triggerEfficiency','triggerEfficiencyUp','triggerEfficiencyDown']
+        self.columns += ['pileupWeight_{0}'.format(pu) for pu in pileupScenarios]
+        for lep in self.leps:
+            self.columns += ['{0}_{1}'.format(lep,v) for v in ['pt','eta','isolation','passMedium','mediumScale','mediumScaleUp','mediumScaleDown']]
+        self.vectorSelections = dict([(sel,lambda a, cuts=cuts: np.logical_and.reduce([op(a[var],val) for var,op,val in cuts])) for sel,cuts in self.selectionCuts.iteritems()])
+        vectorParams = {
+            'count'                       : {'vx': lambda a: 1,                      },
+            'numVertices'                 : {'vx': lambda a: a['numVertices'],       },
+            'numVertices_noreweight'      : {'vx': lambda a: a['numVertices'],       'vmcscale': lambda a: 1./a['pileupWeight']},
+            'rho'                         : {'vx': lambda a: a['rho'],               },
+            'rho_noreweight'              : {'vx': lambda a: a['rho'],               'vmcscale': lambda a: 1./a['pileupWeight']},
+            'met'                         : {'vx': lambda a: a['met_pt'],            },
+            'metPhi'                      : {'vx': lambda a: a['met_phi'],           },
+            'zMass'                       : {'vx': lambda a: a['z_mass'],            },
+            'zPt'                         : {'vx': lambda a: a['z_pt'],              },
+            'zDeltaR'                     : {'vx': lambda a: a['z_deltaR'],          },
+            'zLeadingLeptonPt'            : {'vx': lambda a: a['z1_pt'],             },
+            'zLeadingLeptonEta'           : {'vx': lambda a: a['z1_eta'],            },
+            'zLeadingLeptonIso'           : {'vx': lambda a: a['z1_isolation'],      },
+            'zSubLeadingLeptonPt'         : {'vx': lambda a: a['z2_pt'],             },
+            'zSubLeadingLeptonEta'        : {'vx': lambda a: a['z2_eta'],            },
+            'zSubLeadingLeptonIso'        : {'vx': lambda a: a['z2_isolation'],      },
+            'nJets'                       : {'vx': lambda a: a['numJetsTight30'],    },
+        }
+        for pu in pileupScenarios:
+            vectorParams['numVertices_{0}'.format(pu)] = {'vx': lambda a: a['numVertices'], 'vmcscale': lambda a, pu=pu: a['pileupWeight_{0}'.format(pu)]/a['pileupWeight']}
+            vectorParams['rho_{0}'.format(pu)] = {'vx': lambda a: a['rho'], 'vmcscale': lambda a, pu=pu: a['pileupWeight_{0}'.format(pu)]/a['pileupWeight']}
+        for hist in vectorParams:
+            self.histParams[hist].update(vectorParams[hist])
+
         # initialize flattener
         super(DYFlattener, self).__init__('DY',sample,**kwargs)
 
 
+    def getScaleNames(self):
+        cut = 'medium'
+        # per event weights
+        base = ['genWeight','pileupWeight','triggerEfficiency']
+        if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
+        if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
+        if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
+        if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
+        for lep in self.leps:
+            if self.shift == 'lepUp':
+                base += ['{0}_{1}ScaleUp'.format(lep,cut)]
+            elif self.shift == 'lepDown':
+                base += ['{0}_{1}ScaleDown'.format(lep,cut)]
+            else:
+                base += ['{0}_{1}Scale'.format(lep,cut)]
+        return base
+
     def getWeight(self,row):
         if row.isData:
             weight = 1.
         else:
-            cut = 'medium'
-            # per event weights
-            base = ['genWeight','pileupWeight','triggerEfficiency']
-            if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
-            if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
-            if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
-            if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
-            for lep in zip(self.leps):
-                if self.shift == 'lepUp':
-                    base += ['{0}_{1}ScaleUp'.format(lep,cut)]
-                elif self.shift == 'lepDown':
-                    base += ['{0}_{1}ScaleDown'.format(lep,cut)]
-                else:
-                    base += ['{0}_{1}Scale'.format(lep,cut)]
+            base = self.getScaleNames()
             vals = [getattr(row,scale) for scale in base]
             for scale,val in zip(base,vals):
                 if val != val: logging.warning('{0}: {1} is NaN'.format(row.channel,scale))
@@ -124,6 +167,31 @@ class DYFlattener(NtupleFlattener):
 
         return weight
 
+    def getWeightArrays(self,chunk):
+        weight = np.ones(len(chunk))
+        if self.isData: return weight
+        for scale in self.getScaleNames():
+            val = chunk[scale]
+            nan = np.isnan(val)
+            if nan.any(): logging.warning('{0} is NaN for {1} events'.format(scale,nan.sum()))
+            weight *= np.where(nan,1.,val)
+        # scale to lumi/xsec
+        weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+        if hasColumn(chunk,'qqZZkfactor'): weight *= chunk['qqZZkfactor']/1.1 # ZZ variable k factor
+        return weight
+
+    def perChunkAction(self,chunk):
+        # setup channels
+        passMedium = np.logical_and.reduce([chunk['{0}_passMedium'.format(lep)].astype(bool) for lep in self.leps])
+        recoChan = mapColumn(chunk['channel'],lambda chan: ''.join([x for x in chan if x in 'emt']))
+
+        # define weights
+        w = self.getWeightArrays(chunk)
+
+        # define plot regions
+        for selection in self.vectorSelections:
+            self.fillArrays(chunk,selection,passMedium & self.vectorSelections[selection](chunk),w,recoChan)
+
     def perRowAction(self,row):
         isData = row.isData
 
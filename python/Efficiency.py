@@ -56,15 +56,20 @@ class Efficiency(object):
         return val,err
 
     def getCount(self,processName,selection,scalefactor,**kwargs):
-        total = [0.,0.]
+        return self.getCounts(processName,[selection],scalefactor,**kwargs)[0]
+
+    def getCounts(self,processName,selections,scalefactor,**kwargs):
+        '''Get the counts for a list of selections with one pass over each sample'''
+        totals = [[0.,0.] for selection in selections]
         for sampleName in self.processDict[processName]:
-            sel = selection
+            sels = selections
             if processName in self.processSampleCuts:
                 if sampleName in self.processSampleCuts[processName]:
-                    sel = '{0} && {1}'.format(selection,self.processSampleCuts[processName][sampleName])
-            thisCount = self._getTempCount(sampleName,sel,scalefactor)
-            total = sumWithError(total,thisCount)
-        return total
+                    sels = ['{0} && {1}'.format(selection,self.processSampleCuts[processName][sampleName]) for selection in selections]
+            analysis = self.analysisDict[processName]
+            thisCounts = self.sampleFiles[analysis][sampleName].getTempCounts([(sel,scalefactor) for sel in sels])
+            totals = [sumWithError(total,thisCount) for total,thisCount in zip(totals,thisCounts)]
+        return totals
 
     def printEfficiency(self,selectionList,baseSelection='1',**kwargs):
         '''
@@ -75,24 +80,31 @@ class Efficiency(object):
         baseYields = {}
         fullYields = {}
         lastRow = ['Full selection']
+        selectionOnly = {}
+        allButSelection = {}
+        n = len(selectionList)
         for processName in self.processOrder:
             headers += ['{0} Eff.'.format(processName), '{0} N-1 Eff'.format(processName)]
-            baseYields[processName] = self.getCount(processName,baseSelection,'1')
-            fullYields[processName] = self.getCount(processName,' && '.join(selectionList+[baseSelection]),'1')
+            # all the selections of the table in one pass per sample
+            selections = [baseSelection,' && '.join(selectionList+[baseSelection])]
+            selections += ['{0} && {1}'.format(selection,baseSelection) for selection in selectionList]
+            selections += [' && '.join([x for x in selectionList if x!=selection]+[baseSelection]) for selection in selectionList]
+            counts = self.getCounts(processName,selections,'1')
+            baseYields[processName] = counts[0]
+            fullYields[processName] = counts[1]
+            selectionOnly[processName] = counts[2:2+n]
+            allButSelection[processName] = counts[2+n:]
             fullEff = divWithError(fullYields[processName],baseYields[processName])
             fullEffString = '{0:5.3f} +/- {1:5.3f}'.format(*fullEff)
             lastRow += [fullEffString,'---']
         table = PrettyTable(headers)
         table.align = 'r'
         table.align['Cut'] = 'l'
-        for selection in selectionList:
+        for s,selection in enumerate(selectionList):
             thisRow = [selection]
-            nMinusOneSelections = [x for x in selectionList if x!=selection]
             for processName in self.processOrder:
-                selectionOnly = self.getCount(processName,'{0} && {1}'.format(selection,baseSelection),'1')
-                allButSelection = self.getCount(processName,' && '.join(nMinusOneSelections+[baseSelection]),'1')
-                eff = divWithError(selectionOnly,baseYields[processName])
-                nMinusOneEff = divWithError(fullYields[processName],allButSelection)
+                eff = divWithError(selectionOnly[processName][s],baseYields[processName])
+                nMinusOneEff = divWithError(fullYields[processName],allButSelection[processName][s])
                 effString = '{0:5.3f} +/- {1:5.3f}'.format(*eff)
                 nMinusOneEffString = '{0:5.3f} +/- {1:5.3f}'.format(*nMinusOneEff)
                 thisRow += [effString,nMinusOneEffString]
@@ -35,7 +35,7 @@ class FlattenTree(object):
         self.__finish()
 
     def __finish(self):
-        pass
+        self.ntuple.close()
 
     def addHistogram(self,name,**kwargs):
         '''
@@ -61,6 +61,7 @@ class FlattenTree(object):
         njobs = int(kwargs.pop('njobs',1))
         job = int(kwargs.pop('job',0))
         multi = kwargs.pop('multi',False)
+        batch = kwargs.pop('batch',True)
         if hasProgress and multi:
             pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(self.sample),' ',SimpleProgress(),' histograms ',Percentage(),' ',Bar(),' ',ETA()]))
         else:
@@ -78,7 +79,10 @@ class FlattenTree(object):
         endjob = int((job+1)*nperjob)
         allJobs = sorted(allJobs)[startjob:endjob]
         # flatten
-        if hasProgress and multi:
+        if batch:
+            logging.info('Processing {0} {1}: {2} plots in a single pass.'.format(self.analysis,self.sample,len(allJobs)))
+            self.ntuple.flattenBatch(allJobs)
+        elif hasProgress and multi:
             for args in pbar(allJobs):
                 self.ntuple.flatten(*args)
         else:
@@ -86,3 +90,4 @@ class FlattenTree(object):
             for i,args in enumerate(allJobs):
                 logging.info('Processing {3} {4} plot {0} of {1}: {2}.'.format(i+1,n,' '.join(args),self.analysis,self.sample))
                 self.ntuple.flatten(*args)
+        self.ntuple.flush()
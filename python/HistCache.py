@@ -0,0 +1,94 @@
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+class HistCache(object):
+    '''LRU cache of histograms read from file, bounded by an estimate of their memory'''
+
+    def __init__(self,maxBytes=512*1024*1024):
+        self.maxBytes = maxBytes
+        self.hists = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.j = 0
+
+    def __size(self,hist):
+        '''Approximate memory of a histogram: contents and sum of weights squared in double precision'''
+        return 16*hist.GetNcells()+1024
+
+    def __evict(self):
+        while self.nbytes>self.maxBytes and self.hists:
+            key, hist = self.hists.popitem(last=False)
+            self.nbytes -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def __clone(self,hist):
+        self.j += 1
+        clone = hist.Clone('h_cache_{0}'.format(self.j))
+        clone.SetDirectory(0)
+        return clone
+
+    def get(self,key,loader):
+        '''Get a clone of the cached histogram, calling loader() to read it on a miss'''
+        if key in self.hists:
+            self.hits += 1
+            hist = self.hists.pop(key)
+            self.hists[key] = hist
+            return self.__clone(hist)
+        self.misses += 1
+        hist = loader()
+        if not hist or not hist.InheritsFrom('TH1'): return hist
+        hist = self.__clone(hist)
+        size = self.__size(hist)
+        if size<=self.maxBytes:
+            self.hists[key] = hist
+            self.sizes[key] = size
+            self.nbytes += size
+            self.__evict()
+        return self.__clone(hist)
+
+    def setBudget(self,maxBytes):
+        '''Change the memory budget, evicting as needed'''
+        self.maxBytes = maxBytes
+        self.__evict()
+
+    def clear(self):
+        self.hists = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+    def getStats(self):
+        return {
+            'hits'     : self.hits,
+            'misses'   : self.misses,
+            'evictions': self.evictions,
+            'entries'  : len(self.hists),
+            'bytes'    : self.nbytes,
+        }
+
+    def logStats(self):
+        stats = self.getStats()
+        total = stats['hits']+stats['misses']
+        rate = float(stats['hits'])/total if total else 0.
+        logging.info('Histogram cache: {0} hits, {1} misses ({2:.1%} hit rate), {3} evictions, {4} histograms in {5:.1f} MB'.format(
+            stats['hits'],stats['misses'],rate,stats['evictions'],stats['entries'],stats['bytes']/(1024.*1024.)))
+
+# shared by all plotters in a process
+histCache = HistCache()
+
+def getHistCache():
+    return histCache
+
+def getFileStamp(*filenames):
+    '''Modification times of files, 0 if they do not exist'''
+    return tuple([os.path.getmtime(f) if os.path.exists(f) else 0 for f in filenames])
@@ -0,0 +1,109 @@
+import logging
+import sys
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+class SparseHist(object):
+    '''
+    Histogram allocated on its first fill. Weighted fills are kept in a dictionary of bins
+    until more than sparseLimit bins are used, then the histogram is made from the template
+    and filled directly from then on.
+    '''
+
+    def __init__(self,name,template,sparseLimit=64):
+        self.name = name
+        self.template = template
+        self.sparseLimit = sparseLimit
+        self.hist = None
+        self.bins = {}
+        self.entries = 0
+
+    def Fill(self,*args):
+        '''Fill(x,w) or Fill(x,y,w)'''
+        if self.hist is not None: return self.hist.Fill(*args) # bound before it was made
+        coords, w = args[:-1], args[-1]
+        if any([isinstance(c,basestring) for c in coords]): return self.densify().Fill(*args) # labeled axes
+        b = self.template.FindBin(*coords)
+        vals = self.bins.get(b,None)
+        if vals is None:
+            if len(self.bins)>=self.sparseLimit: return self.densify().Fill(*args)
+            vals = self.bins[b] = [0.,0.]
+        vals[0] += w
+        vals[1] += w*w
+        self.entries += 1
+        return b
+
+    def FillN(self,*args):
+        return self.densify().FillN(*args)
+
+    def Add(self,hist):
+        return self.densify().Add(hist)
+
+    def isEmpty(self):
+        return self.hist is None and not self.bins
+
+    def densify(self):
+        '''Make the histogram from the template and the sparse bins, fills then go to it directly'''
+        if self.hist is not None: return self.hist
+        hist = self.template.Clone(self.name)
+        hist.SetDirectory(0)
+        for b, (w, w2) in self.bins.iteritems():
+            hist.SetBinContent(b,w)
+            hist.SetBinError(b,w2**0.5)
+        hist.ResetStats()
+        if self.entries: hist.SetEntries(self.entries)
+        self.hist = hist
+        self.bins = None
+        self.Fill = hist.Fill
+        self.FillN = hist.FillN
+        self.Add = hist.Add
+        return hist
+
+    def getHist(self):
+        '''The histogram, None if it was never filled'''
+        if self.isEmpty(): return None
+        return self.densify()
+
+class HistStore(object):
+    '''
+    Histograms by name, declared up front with a (shared) template and allocated when first filled.
+    Only the filled histograms are returned for writing, readers treat missing ones as empty.
+    '''
+
+    def __init__(self,sparseLimit=64):
+        self.sparseLimit = sparseLimit
+        self.hists = {}
+
+    def declare(self,name,template):
+        self.hists[name] = SparseHist(name,template,self.sparseLimit)
+
+    def __contains__(self,name):
+        return name in self.hists
+
+    def __getitem__(self,name):
+        return self.hists[name]
+
+    def __iter__(self):
+        return iter(self.hists)
+
+    def __len__(self):
+        return len(self.hists)
+
+    def emptyClone(self):
+        '''A store with the same declarations and nothing filled'''
+        store = HistStore(sparseLimit=self.sparseLimit)
+        for name, hist in self.hists.iteritems():
+            store.declare(name,hist.template)
+        return store
+
+    def getFilled(self):
+        '''The histograms that were filled'''
+        filled = {}
+        for name, hist in self.hists.iteritems():
+            if not hist.isEmpty(): filled[name] = hist.getHist()
+        logging.debug('{0} of {1} histograms filled'.format(len(filled),len(self.hists)))
+        return filled
@@ -13,6 +13,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 from NtupleFlattener import NtupleFlattener
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.LookupTable import makeLookupTables
 from DevTools.Analyzer.BTagScales import BTagScales
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -23,6 +24,8 @@ class Hpp3lFlattener(NtupleFlattener):
     Hpp3l flattener
     '''
 
+    weightShiftNames = ['lepUp','lepDown','trigUp','trigDown','puUp','puDown','btagUp','btagDown']
+
     def __init__(self,sample,**kwargs):
         # controls
         self.new = True # uses NewDMs for tau loose ID
@@ -246,6 +249,9 @@ class Hpp3lFlattener(NtupleFlattener):
         self.lepID = '{0}_passMedium'
         self.lepIDLoose = '{0}_passLooseNew' if self.new else '{0}_passLoose'
 
+        # fake rates are looked up for every lepton of every event, avoid going through ROOT
+        self.faketables = dict([(lep,makeLookupTables(self.fakehists[lep])) for lep in self.fakehists])
+
 
     def getFakeRate(self,lep,pt,eta,num,denom,dm=None):
         if lep=='taus' and self.doDMFakes:
@@ -256,18 +262,15 @@ class Hpp3lFlattener(NtupleFlattener):
             elif dm in [10]:
                 denom = denom + 'DM10'
         key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        val, err = hist.GetBinContent(b), hist.GetBinError(b)
-        #print key, pt, abs(eta), val, err
-        return val, err
+        return self.faketables[lep][key].lookup(pt,abs(eta))
 
-    def getBTagWeight(self,row):
+    def getBTagWeight(self,row,shift=None):
+        if shift is None: shift = self.shift
         op = 1 # medium
         s = 'central'
-        if self.shift == 'btagUp': s = 'up'
-        if self.shift == 'btagDown': s = 'down'
+        if shift == 'btagUp': s = 'up'
+        if shift == 'btagDown': s = 'down'
         w = 1
         for l in self.leps:
             pt = getattr(row,'{0}jet_pt'.format(l))
@@ -278,62 +281,83 @@ class Hpp3lFlattener(NtupleFlattener):
                 w *= 1-sf
         return w
 
+    def getEventWeight(self,row,passID,shift=None):
+        '''Per event weight of MC, with the scale factors of a shift'''
+        if shift is None: shift = self.shift
+        base = ['genWeight','pileupWeight','triggerEfficiency']
+        if shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
+        if shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
+        if shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
+        if shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
+        for l,lep in enumerate(self.leps):
+            shiftString = ''
+            if shift == 'lepUp': shiftString = 'Up'
+            if shift == 'lepDown': shiftString = 'Down'
+            base += [self.scaleMap['P' if passID[l] else 'F'].format(lep)+shiftString]
+        vals = [getattr(row,scale) for scale in base]
+        for scale,val in zip(base,vals):
+            if val != val: logging.warning('{0}: {1} is NaN'.format(row.channel,scale))
+        weight = prod([val for val in vals if val==val])
+        # scale to lumi/xsec
+        weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+        if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
+        # b taggin (veto)
+        if self.doBVeto: weight *= self.getBTagWeight(row,shift)
+        return weight
+
     def getWeight(self,row,doFake=False,fakeNum=None,fakeDenom=None):
-        if not fakeNum: fakeNum = 'HppMedium'
-        if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+        if not doFake: return self.getWeights(row)['']
+        return self.getWeights(row,{'fake': (fakeNum,fakeDenom)})['fake']
+
+    def getWeights(self,row,fakes={},shifts=None):
+        '''
+        Get the event weight ('') and the datadriven weight for each (fakeNum, fakeDenom) in fakes,
+        the per event weights are only computed once.
+        With shifts, each weight is a dictionary of the weight for the nominal ('') and each of the
+        weight shifts, the fake rates are still only looked up once.
+        '''
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
+        shiftNames = [''] + (shifts if shifts else [])
         if row.isData:
-            weight = 1.
+            eventWeights = dict([(shift,1.) for shift in shiftNames])
         else:
-            # per event weights
-            base = ['genWeight','pileupWeight','triggerEfficiency']
-            if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
-            if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
-            if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
-            if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
-            for l,lep in enumerate(self.leps):
-                shiftString = ''
-                if self.shift == 'lepUp': shiftString = 'Up'
-                if self.shift == 'lepDown': shiftString = 'Down'
-                base += [self.scaleMap['P' if passID[l] else 'F'].format(lep)+shiftString]
-            vals = [getattr(row,scale) for scale in base]
-            for scale,val in zip(base,vals):
-                if val != val: logging.warning('{0}: {1} is NaN'.format(row.channel,scale))
-            weight = prod([val for val in vals if val==val])
-            # scale to lumi/xsec
-            weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
-            if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
-            # b taggin (veto)
-            if self.doBVeto: weight *= self.getBTagWeight(row)
+            eventWeights = dict([(shift,self.getEventWeight(row,passID,shift if shift else self.shift)) for shift in shiftNames])
+        factors = {'': 1.}
         # fake scales
-        if doFake:
+        if fakes:
             chanMap = {'e': 'electrons', 'm': 'muons', 't': 'taus',}
             chan = ''.join([x for x in row.channel if x in 'emt'])
             pts = [getattr(row,'{0}_pt'.format(x)) for x in self.leps]
             etas = [getattr(row,'{0}_eta'.format(x)) for x in self.leps]
             region = ''.join(['P' if x else 'F' for x in passID])
             sign = -1 if region.count('F')%2==0 and region.count('F')>0 else 1
-            weight *= sign
-            if not row.isData and not all(passID): weight *= -1 # subtract off MC in control
-            for l,lep in enumerate(self.leps):
-                if not passID[l]:
-                    # recalculate
-                    dm = None if chan[l]!='t' else getattr(row,'{0}_decayMode'.format(lep))
-                    fn = fakeNum
-                    fd = fakeDenom
-                    if isinstance(fakeNum,dict): fn = fakeNum[chan[l]]
-                    if isinstance(fakeDenom,dict): fd = fakeDenom[chan[l]]
-                    fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fn, fd, dm=dm)[0]
-
-                    # read from tree
-                    #fake = self.fakeVal.format(lep)
-                    #if self.shift=='fakeUp': fake += 'Up'
-                    #if self.shift=='fakeDown': fake += 'Down'
-                    #fakeEff = getattr(row,fake)
-
-                    weight *= fakeEff/(1-fakeEff)
-
-        return weight
+            if not row.isData and not all(passID): sign *= -1 # subtract off MC in control
+            for name, (fakeNum, fakeDenom) in fakes.iteritems():
+                if not fakeNum: fakeNum = 'HppMedium'
+                if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+                fakeFactor = sign
+                for l,lep in enumerate(self.leps):
+                    if not passID[l]:
+                        # recalculate
+                        dm = None if chan[l]!='t' else getattr(row,'{0}_decayMode'.format(lep))
+                        fn = fakeNum
+                        fd = fakeDenom
+                        if isinstance(fakeNum,dict): fn = fakeNum[chan[l]]
+                        if isinstance(fakeDenom,dict): fd = fakeDenom[chan[l]]
+                        fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fn, fd, dm=dm)[0]
+
+                        # read from tree
+                        #fake = self.fakeVal.format(lep)
+                        #if self.shift=='fakeUp': fake += 'Up'
+                        #if self.shift=='fakeDown': fake += 'Down'
+                        #fakeEff = getattr(row,fake)
+
+                        fakeFactor *= fakeEff/(1-fakeEff)
+                factors[name] = fakeFactor
+
+        if shifts is None:
+            return dict([(name,eventWeights['']*factor) for name,factor in factors.iteritems()])
+        return dict([(name,dict([(shift,eventWeights[shift]*factor) for shift in shiftNames])) for name,factor in factors.iteritems()])
 
 
     def perRowAction(self,row):
@@ -366,15 +390,17 @@ class Hpp3lFlattener(NtupleFlattener):
 
 
         # define weights
-        w = self.getWeight(row)
-        wf = self.getWeight(row,doFake=True)
         loose = '{}loose'.format('new' if self.new else 'old')
-        wfs = {}
+        fakes = {'fake': (None,None)}
         cuts =  ['n0p2','n0p1','0p0','0p1','0p2','0p3','0p4']
         for cut in cuts:
             fn = {'e': 'HppMedium', 'm': 'HppMedium', 't': 'medium'}
             fd = {'e': 'HppLoose{0}'.format('New' if self.new else ''), 'm': 'HppLoose{0}'.format('New' if self.new else ''), 't': '{}_{}'.format(loose,cut)}
-            wfs[cut] = self.getWeight(row,doFake=True,fakeNum=fn,fakeDenom=fd)
+            fakes[cut] = (fn,fd)
+        weights = self.getWeights(row,fakes,shifts=self.weightShifts if self.weightShifts else None)
+        w = weights['']
+        wf = weights['fake']
+        wfs = dict([(cut,weights[cut]) for cut in cuts])
 
         # setup channels
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
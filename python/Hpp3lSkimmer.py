@@ -9,6 +9,8 @@ import operator
 from NtupleSkimmer import NtupleSkimmer
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.LookupTable import makeLookupTables
+from DevTools.Plotter.CutOptimizer import CutOptimizer
 from DevTools.Analyzer.BTagScales import BTagScales
 
 import ROOT
@@ -29,7 +31,6 @@ class Hpp3lSkimmer(NtupleSkimmer):
         self.tauFakeMode = 'z' # allowed: w, z
         self.doDMFakes = True
         self.optimize = False
-        self.var = 'st'
         self.doBVeto = True
         self.btag_scales = BTagScales('80X')
 
@@ -39,6 +40,14 @@ class Hpp3lSkimmer(NtupleSkimmer):
         self.masses = [200,300,400,500,600,700,800,900,1000,1100,1200,1300,1400,1500]
         if self.isSignal:
             self.masses = [mass for mass in self.masses if 'M-{0}'.format(mass) in self.sample]
+        self.cutRegions = dict([(mass,getSelectionMap('Hpp3l',mass)) for mass in self.masses])
+        # count names of the mass windows, the ids of the counts are interned on first use
+        self.windowNames = {}
+        for nTaus in range(3):
+            for mass in self.masses:
+                for window in ['sideband','massWindow','allSideband','allMassWindow']:
+                    self.windowNames[(window,mass,nTaus)] = 'new/{0}/{1}/hpp{2}'.format(window,mass,nTaus)
+        self.countIds = {}
 
         # alternative fakerates
         self.fakekey = '{num}_{denom}'
@@ -102,6 +111,51 @@ class Hpp3lSkimmer(NtupleSkimmer):
         self.lepID = '{0}_passMedium'
         self.lepIDLoose = '{0}_passLooseNew' if self.new else '{0}_passLoose'
 
+        # fake rates are looked up for every lepton of every event, avoid going through ROOT
+        self.faketables = dict([(lep,makeLookupTables(self.fakehists[lep])) for lep in self.fakehists])
+
+        # optimization ranges, events in the mass windows are kept and scanned after the loop
+        self.optimizer = CutOptimizer([
+            ('st',    [x*20 for x in range(100)],     '>'),
+            ('zveto', [x*5 for x in range(25)],       '>'),
+            ('dr',    [1.5+x*0.1 for x in range(50)], '<'),
+            ('met',   [x*5 for x in range(40)],       '>'),
+        ],columns=['hpp'])
+
+    def getOptimizationFile(self):
+        '''Events of the optimization scan, saved next to the counts'''
+        if self.outputFile: return self.outputFile.replace('.root','.opt.root')
+        return os.path.splitext(self.countStore)[0]+'_optimize.npz'
+
+    def getPartResult(self):
+        if not self.optimize: return None
+        return self.optimizer.getArrays(), self.optimizer.getLabels()
+
+    def mergePartResult(self,result):
+        if result: self.optimizer.merge(*result)
+
+    def dump(self):
+        if self.optimize:
+            self.optimizer.fillCounts(self)
+            self.optimizer.save(self.getOptimizationFile())
+        super(Hpp3lSkimmer, self).dump()
+
+    def getCountIds(self,cutName,kind,fakeChan,recoChan,genChan):
+        '''
+        Ids of the counts of a cut for the events passing the ID ('pass'), the fake prediction ('fake')
+        or all events of the fake channel ('regular'). The names are only built the first time.
+        '''
+        key = (cutName,kind,fakeChan,recoChan,genChan)
+        ids = self.countIds.get(key)
+        if ids is None:
+            if kind=='pass':
+                name = cutName
+            else:
+                prefix = fakeChan if kind=='fake' else fakeChan+'_regular'
+                name = prefix if cutName=='default' else '/'.join([prefix,cutName])
+            ids = self.countIds[key] = self.getKeyIds(name,recoChan,genChan)
+        return ids
+
     def getFakeRate(self,lep,pt,eta,num,denom,dm=None):
         if lep=='taus' and self.doDMFakes:
             if dm in [0,5]:
@@ -111,10 +165,8 @@ class Hpp3lSkimmer(NtupleSkimmer):
             elif dm in [10]:
                 denom = denom + 'DM10'
         key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return self.faketables[lep][key].lookup(pt,abs(eta))
 
     def getBTagWeight(self,row):
         op = 1 # medium
@@ -133,8 +185,14 @@ class Hpp3lSkimmer(NtupleSkimmer):
         
 
     def getWeight(self,row,doFake=False,fakeNum=None,fakeDenom=None):
-        if not fakeNum: fakeNum = 'HppMedium'
-        if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+        if not doFake: return self.getWeights(row)['']
+        return self.getWeights(row,{'fake': (fakeNum,fakeDenom)})['fake']
+
+    def getWeights(self,row,fakes={}):
+        '''
+        Get the event weight ('') and the datadriven weight for each (fakeNum, fakeDenom) in fakes,
+        the per event weights are only computed once.
+        '''
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
         if row.isData:
             weight = 1.
@@ -159,8 +217,9 @@ class Hpp3lSkimmer(NtupleSkimmer):
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
             # b tagging (veto)
             if self.doBVeto: weight *= self.getBTagWeight(row)
+        weights = {'': weight}
         # fake scales
-        if doFake:
+        if fakes:
             chanMap = {'e': 'electrons', 'm': 'muons', 't': 'taus',}
             chan = ''.join([x for x in row.channel if x in 'emt'])
             pts = [getattr(row,'{0}_pt'.format(x)) for x in self.leps]
@@ -169,25 +228,30 @@ class Hpp3lSkimmer(NtupleSkimmer):
             sign = -1 if region.count('F')%2==0 and region.count('F')>0 else 1
             weight *= sign
             if not row.isData and not all(passID): weight *= -1 # subtract off MC in control
-            for l,lep in enumerate(self.leps):
-                if not passID[l]:
-                    # recalculate
-                    dm = None if chan[l]!='taus' else getattr(row,'{0}_decayMode'.format(lep))
-                    fn = fakeNum
-                    fd = fakeDenom
-                    if isinstance(fakeNum,dict): fn = fakeNum[chan[l]]
-                    if isinstance(fakeDenom,dict): fd = fakeDenom[chan[l]]
-                    fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fn, fd, dm=dm)[0]
-
-                    # read from tree
-                    #fake = self.fakeVal.format(lep)
-                    #if self.shift=='fakeUp': fake += 'Up'
-                    #if self.shift=='fakeDown': fake += 'Down'
-                    #fakeEff = getattr(row,fake)
-
-                    weight *= fakeEff/(1-fakeEff)
-
-        return weight
+            for name, (fakeNum, fakeDenom) in fakes.iteritems():
+                if not fakeNum: fakeNum = 'HppMedium'
+                if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+                fakeWeight = weight
+                for l,lep in enumerate(self.leps):
+                    if not passID[l]:
+                        # recalculate
+                        dm = None if chan[l]!='taus' else getattr(row,'{0}_decayMode'.format(lep))
+                        fn = fakeNum
+                        fd = fakeDenom
+                        if isinstance(fakeNum,dict): fn = fakeNum[chan[l]]
+                        if isinstance(fakeDenom,dict): fd = fakeDenom[chan[l]]
+                        fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fn, fd, dm=dm)[0]
+
+                        # read from tree
+                        #fake = self.fakeVal.format(lep)
+                        #if self.shift=='fakeUp': fake += 'Up'
+                        #if self.shift=='fakeDown': fake += 'Down'
+                        #fakeEff = getattr(row,fake)
+
+                        fakeWeight *= fakeEff/(1-fakeEff)
+                weights[name] = fakeWeight
+
+        return weights
 
     def perRowAction(self,row):
         isData = row.isData
@@ -222,8 +286,9 @@ class Hpp3lSkimmer(NtupleSkimmer):
         if not keep: return
 
         # define weights
-        w = self.getWeight(row)
-        wf = self.getWeight(row,doFake=True)
+        weights = self.getWeights(row,{'fake': (None,None)})
+        w = weights['']
+        wf = weights['fake']
 
         # setup channels
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
@@ -259,30 +324,31 @@ class Hpp3lSkimmer(NtupleSkimmer):
         # cut map
         v = {
             'st': row.hpp1_pt+row.hpp2_pt+row.hm1_pt,
-            'zdiff': abs(row.z_mass-ZMASS),
+            'zveto': abs(row.z_mass-ZMASS),
             'dr': row.hpp_deltaR,
             'hpp': row.hpp_mass,
             'met': row.met_pt,
         }
-        cutRegions = {}
-        for mass in self.masses:
-            cutRegions[mass] = getSelectionMap('Hpp3l',mass)
+        cutRegions = self.cutRegions
+
+        # increment counts, all counts of the event are added together
+        passAll = all(passID)
+        passFake = isData or genCut
+        keyIds = []
+        weights = []
+        def count(cutName,kind,val):
+            ids = self.countIds.get((cutName,kind,fakeChan,recoChan,genChan))
+            if ids is None: ids = self.getCountIds(cutName,kind,fakeChan,recoChan,genChan)
+            keyIds.extend(ids)
+            weights.extend([val]*len(ids))
 
-        # optimization ranges
-        stRange = [x*20 for x in range(100)]
-        zvetoRange = [x*5 for x in range(25)]
-        drRange = [1.5+x*0.1 for x in range(50)]
-        metRange = [x*5 for x in range(40)]
-
-        # increment counts
         if default:
-            if all(passID): self.increment('default',w,recoChan,genChan)
-            if isData or genCut: self.increment(fakeChan,wf,recoChan,genChan)
-            self.increment(fakeChan+'_regular',w,recoChan,genChan)
+            if passAll: count('default','pass',w)
+            if passFake: count('default','fake',wf)
+            count('default','regular',w)
 
             for nTaus in range(3):
                 for mass in self.masses:
-                    name = '{0}/hpp{1}'.format(mass,nTaus)
                     sides = []
                     windows = []
                     sides += [cutRegions[mass][nTaus]['st'](row)]
@@ -291,68 +357,34 @@ class Hpp3lSkimmer(NtupleSkimmer):
                     sides += [cutRegions[mass][nTaus]['dr'](row)]
                     windows += [cutRegions[mass][nTaus]['mass'](row)]
                     massWindowOnly = all(windows)
-                    sideband = not all(sides) and not all(windows)
-                    massWindow = not all(sides) and all(windows)
-                    allSideband = all(sides) and not all(windows)
-                    allMassWindow = all(sides) and all(windows)
                     if not self.optimize:
-                        if sideband:
-                            if all(passID): self.increment('new/sideband/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/sideband/'+name,wf,recoChan,genChan)
-                        if massWindow:
-                            if all(passID): self.increment('new/massWindow/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/massWindow/'+name,wf,recoChan,genChan)
-                        if allSideband:
-                            if all(passID): self.increment('new/allSideband/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/allSideband/'+name,wf,recoChan,genChan)
-                        if allMassWindow:
-                            if all(passID): self.increment('new/allMassWindow/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/allMassWindow/'+name,wf,recoChan,genChan)
-                    # run the grid of values
+                        if all(sides):
+                            window = 'allMassWindow' if all(windows) else 'allSideband'
+                        else:
+                            window = 'massWindow' if all(windows) else 'sideband'
+                        cutName = self.windowNames[(window,mass,nTaus)]
+                        if passAll: count(cutName,'pass',w)
+                        if passFake: count(cutName,'fake',wf)
+                    # keep the event for the scan of the cuts
                     if self.optimize:
                         if not massWindowOnly: continue
-                        nMinusOneSt = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneZveto = all([cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneDR = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneMet = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        # 1D no cuts
-                        if self.var=='st':
-                            for stCutVal in stRange:
-                                if v['st']>stCutVal and nMinusOneSt:
-                                    if all(passID): self.increment('optimize/st/{0}/{1}'.format(stCutVal,name),w,recoChan,genChan)
-                                    if isData or genCut: self.increment(fakeChan+'/optimize/st/{0}/{1}'.format(stCutVal,name),wf,recoChan,genChan)
-                        if self.var=='zveto':
-                            for zvetoCutVal in zvetoRange:
-                                if v['zdiff']>zvetoCutVal and nMinusOneZveto:
-                                    if all(passID): self.increment('optimize/zveto/{0}/{1}'.format(zvetoCutVal,name),w,recoChan,genChan)
-                                    if isData or genCut: self.increment(fakeChan+'/optimize/zveto/{0}/{1}'.format(zvetoCutVal,name),wf,recoChan,genChan)
-                        if self.var=='dr':
-                            for drCutVal in drRange:
-                                if v['dr']<drCutVal and nMinusOneDR:
-                                    if all(passID): self.increment('optimize/dr/{0}/{1}'.format(drCutVal,name),w,recoChan,genChan)
-                                    if isData or genCut: self.increment(fakeChan+'/optimize/dr/{0}/{1}'.format(drCutVal,name),wf,recoChan,genChan)
-                        if self.var=='met':
-                            for metCutVal in metRange:
-                                if v['met']>metCutVal and nMinusOneMet:
-                                    if all(passID): self.increment('optimize/met/{0}/{1}'.format(metCutVal,name),w,recoChan,genChan)
-                                    if isData or genCut: self.increment(fakeChan+'/optimize/met/{0}/{1}'.format(metCutVal,name),wf,recoChan,genChan)
-                        # nD
-                        #for stCutVal in stRange:
-                        #    if v['st']<stCutVal: continue
-                        #    for zvetoCutVal in zvetoRange:
-                        #        if v['zdiff']<zvetoCutVal: continue
-                        #        for drCutVal in drRange:
-                        #            if v['dr']>drCutVal: continue
-                        #            for metCutVal in metRange:
-                        #                if v['met']<metCutVal: continue
-                        #                if all(passID): self.increment('optimize/st{0}/zveto{1}/dr{2}/met{3}/{4}'.format(stCutVal,zvetoCutVal,drCutVal,metCutVal,name),w,recoChan,genChan)
-                        #                if isData or genCut: self.increment(fakeChan+'optimize/st{0}/zveto{1}/dr{2}/met{3}/{4}'.format(stCutVal,zvetoCutVal,drCutVal,metCutVal,name),wf,recoChan,genChan)
+                        name = '{0}/hpp{1}'.format(mass,nTaus)
+                        passes = {
+                            'st'   : cutRegions[mass][nTaus]['st'](row),
+                            'zveto': cutRegions[mass][nTaus]['zveto'](row),
+                            'dr'   : cutRegions[mass][nTaus]['dr'](row),
+                            'met'  : cutRegions[mass][nTaus]['met'](row),
+                        }
+                        if passAll: self.optimizer.add('optimize/{var}/{cut}/'+name,v,w,passes,recoChan,genChan)
+                        if passFake: self.optimizer.add(fakeChan+'/optimize/{var}/{cut}/'+name,v,wf,passes,recoChan,genChan)
 
 
         if lowmass:
-            if all(passID): self.increment('lowmass',w,recoChan,genChan)
-            if isData or genCut: self.increment(fakeChan+'/lowmass',wf,recoChan,genChan)
-            self.increment(fakeChan+'_regular/lowmass',w,recoChan,genChan)
+            if passAll: count('lowmass','pass',w)
+            if passFake: count('lowmass','fake',wf)
+            count('lowmass','regular',w)
+
+        self.incrementBatch(keyIds,weights)
 
 
 
@@ -13,6 +13,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 from NtupleFlattener import NtupleFlattener
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.LookupTable import makeLookupTables
 from DevTools.Analyzer.BTagScales import BTagScales
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -220,6 +221,9 @@ class Hpp4lFlattener(NtupleFlattener):
         self.lepID = '{0}_passMedium'
         self.lepIDLoose = '{0}_passLooseNew' if self.new else '{0}_passLoose'
 
+        # fake rates are looked up for every lepton of every event, avoid going through ROOT
+        self.faketables = dict([(lep,makeLookupTables(self.fakehists[lep])) for lep in self.fakehists])
+
 
     def getFakeRate(self,lep,pt,eta,num,denom,dm=None):
         if lep=='taus' and self.doDMFakes:
@@ -230,10 +234,8 @@ class Hpp4lFlattener(NtupleFlattener):
             elif dm in [10]:
                 denom = denom + 'DM10'
         key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return self.faketables[lep][key].lookup(pt,abs(eta))
 
     def getBTagWeight(self,row):
         op = 1 # medium
@@ -251,8 +253,14 @@ class Hpp4lFlattener(NtupleFlattener):
         return w
 
     def getWeight(self,row,doFake=False,fakeNum=None,fakeDenom=None):
-        if not fakeNum: fakeNum = 'HppMedium'
-        if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+        if not doFake: return self.getWeights(row)['']
+        return self.getWeights(row,{'fake': (fakeNum,fakeDenom)})['fake']
+
+    def getWeights(self,row,fakes={}):
+        '''
+        Get the event weight ('') and the datadriven weight for each (fakeNum, fakeDenom) in fakes,
+        the per event weights are only computed once.
+        '''
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
         if row.isData:
             weight = 1.
@@ -277,8 +285,9 @@ class Hpp4lFlattener(NtupleFlattener):
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
             # b tagging (veto)
             if self.doBVeto: weight *= self.getBTagWeight(row)
+        weights = {'': weight}
         # fake scales
-        if doFake:
+        if fakes:
             chanMap = {'e': 'electrons', 'm': 'muons', 't': 'taus',}
             chan = ''.join([x for x in row.channel if x in 'emt'])
             pts = [getattr(row,'{0}_pt'.format(x)) for x in self.leps]
@@ -287,21 +296,26 @@ class Hpp4lFlattener(NtupleFlattener):
             sign = -1 if region.count('F')%2==0 and region.count('F')>0 else 1
             weight *= sign
             if not row.isData and not all(passID): weight *= -1 # subtract off MC in control
-            for l,lep in enumerate(self.leps):
-                if not passID[l]:
-                    # recalculate
-                    dm = None if chan[l]!='t' else getattr(row,'{0}_decayMode'.format(lep))
-                    fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fakeNum, fakeDenom, dm=dm)[0]
+            for name, (fakeNum, fakeDenom) in fakes.iteritems():
+                if not fakeNum: fakeNum = 'HppMedium'
+                if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+                fakeWeight = weight
+                for l,lep in enumerate(self.leps):
+                    if not passID[l]:
+                        # recalculate
+                        dm = None if chan[l]!='t' else getattr(row,'{0}_decayMode'.format(lep))
+                        fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fakeNum, fakeDenom, dm=dm)[0]
 
-                    # read from tree
-                    #fake = self.fakeVal.format(lep)
-                    #if self.shift=='fakeUp': fake += 'Up'
-                    #if self.shift=='fakeDown': fake += 'Down'
-                    #fakeEff = getattr(row,fake)
+                        # read from tree
+                        #fake = self.fakeVal.format(lep)
+                        #if self.shift=='fakeUp': fake += 'Up'
+                        #if self.shift=='fakeDown': fake += 'Down'
+                        #fakeEff = getattr(row,fake)
 
-                    weight *= fakeEff/(1-fakeEff)
+                        fakeWeight *= fakeEff/(1-fakeEff)
+                weights[name] = fakeWeight
 
-        return weight
+        return weights
 
 
     def perRowAction(self,row):
@@ -332,8 +346,9 @@ class Hpp4lFlattener(NtupleFlattener):
 
 
         # define weights
-        w = self.getWeight(row)
-        wf = self.getWeight(row,doFake=True)
+        weights = self.getWeights(row,{'fake': (None,None)})
+        w = weights['']
+        wf = weights['fake']
 
         # setup channels
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
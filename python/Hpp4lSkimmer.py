@@ -9,6 +9,7 @@ import operator
 from NtupleSkimmer import NtupleSkimmer
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.LookupTable import makeLookupTables
 from DevTools.Analyzer.BTagScales import BTagScales
 
 import ROOT
@@ -104,6 +105,9 @@ class Hpp4lSkimmer(NtupleSkimmer):
         self.lepID = '{0}_passMedium'
         self.lepIDLoose = '{0}_passLooseNew' if self.new else '{0}_passLoose'
 
+        # fake rates are looked up for every lepton of every event, avoid going through ROOT
+        self.faketables = dict([(lep,makeLookupTables(self.fakehists[lep])) for lep in self.fakehists])
+
     def getFakeRate(self,lep,pt,eta,num,denom,dm=None):
         if lep=='taus' and self.doDMFakes:
             if dm in [0,5]:
@@ -113,10 +117,8 @@ class Hpp4lSkimmer(NtupleSkimmer):
             elif dm in [10]:
                 denom = denom + 'DM10'
         key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return self.faketables[lep][key].lookup(pt,abs(eta))
 
     def getBTagWeight(self,row):
         op = 1 # medium
@@ -134,8 +136,14 @@ class Hpp4lSkimmer(NtupleSkimmer):
         return w
         
     def getWeight(self,row,doFake=False,fakeNum=None,fakeDenom=None):
-        if not fakeNum: fakeNum = 'HppMedium'
-        if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+        if not doFake: return self.getWeights(row)['']
+        return self.getWeights(row,{'fake': (fakeNum,fakeDenom)})['fake']
+
+    def getWeights(self,row,fakes={}):
+        '''
+        Get the event weight ('') and the datadriven weight for each (fakeNum, fakeDenom) in fakes,
+        the per event weights are only computed once.
+        '''
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
         if row.isData:
             weight = 1.
@@ -160,8 +168,9 @@ class Hpp4lSkimmer(NtupleSkimmer):
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
             # b taggin (veto)
             if self.doBVeto: weight *= self.getBTagWeight(row)
+        weights = {'': weight}
         # fake scales
-        if doFake:
+        if fakes:
             chanMap = {'e': 'electrons', 'm': 'muons', 't': 'taus',}
             chan = ''.join([x for x in row.channel if x in 'emt'])
             pts = [getattr(row,'{0}_pt'.format(x)) for x in self.leps]
@@ -170,21 +179,26 @@ class Hpp4lSkimmer(NtupleSkimmer):
             sign = -1 if region.count('F')%2==0 and region.count('F')>0 else 1
             weight *= sign
             if not row.isData and not all(passID): weight *= -1 # subtract off MC in control
-            for l,lep in enumerate(self.leps):
-                if not passID[l]:
-                    # recalculate
-                    dm = None if chan[l]!='taus' else getattr(row,'{0}_decayMode'.format(lep))
-                    fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fakeNum, fakeDenom, dm=dm)[0]
-
-                    # read from tree
-                    #fake = self.fakeVal.format(lep)
-                    #if self.shift=='fakeUp': fake += 'Up'
-                    #if self.shift=='fakeDown': fake += 'Down'
-                    #fakeEff = getattr(row,fake)
-
-                    weight *= fakeEff/(1-fakeEff)
-
-        return weight
+            for name, (fakeNum, fakeDenom) in fakes.iteritems():
+                if not fakeNum: fakeNum = 'HppMedium'
+                if not fakeDenom: fakeDenom = 'HppLoose{0}'.format('New' if self.new else '')
+                fakeWeight = weight
+                for l,lep in enumerate(self.leps):
+                    if not passID[l]:
+                        # recalculate
+                        dm = None if chan[l]!='taus' else getattr(row,'{0}_decayMode'.format(lep))
+                        fakeEff = self.getFakeRate(chanMap[chan[l]], pts[l], etas[l], fakeNum, fakeDenom, dm=dm)[0]
+
+                        # read from tree
+                        #fake = self.fakeVal.format(lep)
+                        #if self.shift=='fakeUp': fake += 'Up'
+                        #if self.shift=='fakeDown': fake += 'Down'
+                        #fakeEff = getattr(row,fake)
+
+                        fakeWeight *= fakeEff/(1-fakeEff)
+                weights[name] = fakeWeight
+
+        return weights
 
     def perRowAction(self,row):
         isData = row.isData
@@ -215,8 +229,9 @@ class Hpp4lSkimmer(NtupleSkimmer):
         if not keep: return
 
         # define weights
-        w = self.getWeight(row)
-        wf = self.getWeight(row,doFake=True)
+        weights = self.getWeights(row,{'fake': (None,None)})
+        w = weights['']
+        wf = weights['fake']
 
         # setup channels
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
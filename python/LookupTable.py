@@ -0,0 +1,51 @@
+import logging
+from bisect import bisect_right
+
+import numpy as np
+
+class LookupTable(object):
+    '''
+    Bin contents and errors of a 1D or 2D histogram, copied once into python/numpy arrays.
+    Bins are found as in TH1::FindBin: 0 is the underflow and nbins+1 the overflow.
+    '''
+
+    def __init__(self,hist):
+        self.name = hist.GetName()
+        self.xedges = self.__edges(hist.GetXaxis())
+        self.yedges = self.__edges(hist.GetYaxis()) if hist.GetDimension()>1 else []
+        nx = len(self.xedges)+1
+        ny = len(self.yedges)+1
+        if self.yedges:
+            self.values = [[hist.GetBinContent(bx,by) for by in range(ny)] for bx in range(nx)]
+            self.errors = [[hist.GetBinError(bx,by) for by in range(ny)] for bx in range(nx)]
+        else:
+            self.values = [[hist.GetBinContent(bx)] for bx in range(nx)]
+            self.errors = [[hist.GetBinError(bx)] for bx in range(nx)]
+        self.valueArray = np.array(self.values)
+        self.errorArray = np.array(self.errors)
+
+    def __edges(self,axis):
+        return [axis.GetBinLowEdge(b) for b in range(1,axis.GetNbins()+2)]
+
+    def lookup(self,x,y=None):
+        '''Value and error of the bin containing (x,y)'''
+        bx = bisect_right(self.xedges,x)
+        by = bisect_right(self.yedges,y) if self.yedges else 0
+        return self.values[bx][by], self.errors[bx][by]
+
+    def lookupArrays(self,x,y=None):
+        '''Values and errors of the bins containing arrays of (x,y)'''
+        bx = np.searchsorted(self.xedges,x,side='right')
+        by = np.searchsorted(self.yedges,y,side='right') if self.yedges else np.zeros_like(bx)
+        return self.valueArray[bx,by], self.errorArray[bx,by]
+
+def makeLookupTables(hists):
+    '''Convert a dictionary of histograms to lookup tables, missing histograms are kept as None'''
+    tables = {}
+    for key, hist in hists.iteritems():
+        if hist:
+            tables[key] = LookupTable(hist)
+        else:
+            logging.debug('Missing histogram for lookup table {0}'.format(key))
+            tables[key] = None
+    return tables
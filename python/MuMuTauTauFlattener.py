@@ -15,6 +15,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 from NtupleFlattener import NtupleFlattener
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.LookupTable import makeLookupTables
 from DevTools.Analyzer.utilities import deltaR, deltaPhi
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -305,6 +306,11 @@ class MuMuTauTauFlattener(NtupleFlattener):
         self.tracking_pog_scales['TrackingEta']    = self.__parseAsymmErrors(rootfile.Get('ratio_eff_eta3_dr030e030_corr'))
         rootfile.Close()
 
+        # looked up for every lepton of every event, avoid going through ROOT
+        self.faketables = dict([(lep,makeLookupTables(self.fakehists[lep])) for lep in self.fakehists])
+        self.efftables = dict([(lep,makeLookupTables(self.effhists[lep])) for lep in self.effhists])
+        self.muon_scale_tables = makeLookupTables(self.muon_scales)
+
     def __parseAsymmErrors(self,graph):
         vals = []
         x,y = ROOT.Double(0), ROOT.Double(0)
@@ -325,26 +331,18 @@ class MuMuTauTauFlattener(NtupleFlattener):
         key = self.fakekey.format(num=num,denom=denom)
         if lep=='taus' and dm in [0,1,10] and self.doDM:
             key += 'DM{}'.format(dm)
-        hist = self.fakehists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return self.faketables[lep][key].lookup(pt,abs(eta))
 
     def getEfficiency(self,lep,pt,eta,num,denom,dm=None):
         key = self.effkey.format(num=num,denom=denom)
-        hist = self.effhists[lep][key]
         if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return self.efftables[lep][key].lookup(pt,abs(eta))
 
     def getMuonScaleFactor(self,id,pt,eta):
         if pt>200: pt = 199
         if pt<10: pt = 11
-        hist = self.muon_scales[id]
-        b = hist.FindBin(pt,eta)
-        val = hist.GetBinContent(b)
-        err = hist.GetBinError(b)
-        return val, err
+        return self.muon_scale_tables[id].lookup(pt,eta)
         
     def getTrackingScaleFactor(self,eta):
         etaName = 'TrackingEta'
@@ -357,8 +355,14 @@ class MuMuTauTauFlattener(NtupleFlattener):
         return valEta, errEta
 
     def getWeight(self,row,doFake=False,fakeNum=None,fakeDenom=None,fakeLeps=[]):
-        if not fakeNum: fakeNum = 'HaaTight'
-        if not fakeDenom: fakeDenom = 'HaaLoose'
+        if not doFake: return self.getWeights(row)['']
+        return self.getWeights(row,{'fake': (fakeNum,fakeDenom,fakeLeps)})['fake']
+
+    def getWeights(self,row,fakes={}):
+        '''
+        Get the event weight ('') and the datadriven weight for each (fakeNum, fakeDenom, fakeLeps) in fakes,
+        the per event weights are only computed once.
+        '''
         if row.isData:
             weight = 1.
         else:
@@ -404,27 +408,33 @@ class MuMuTauTauFlattener(NtupleFlattener):
             # scale to lumi/xsec
             weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
+        weights = {'': weight}
         # fake scales
-        if doFake:
+        if fakes:
             if not row.isData: weight *= -1
-            for l in fakeLeps:
-                n = fakeNum[l] if isinstance(fakeNum,dict) else fakeNum
-                d = fakeDenom[l] if isinstance(fakeDenom,dict) else fakeDenom
-                coll = 'taus' if l in ['ath'] else 'muons'
-                if coll=='taus' and self.doDM:
-                    fake = self.getFakeRate(coll, getattr(row,'{}_pt'.format(l)), getattr(row,'{}_eta'.format(l)), n, d, dm=getattr(row,'{}_decayMode'.format(l)))
-                else:
-                    fake = self.getFakeRate(coll, getattr(row,'{}_pt'.format(l)), getattr(row,'{}_eta'.format(l)), n, d)
-                fakeEff = fake[0]
-                if self.shift=='fakeUp': fakeEff = fake[0]+fake[1]
-                if self.shift=='fakeDown': fakeEff = fake[0]-fake[1]
-                if fakeEff>0 and fakeEff<1:
-                    weight *= fakeEff/(1-fakeEff)
-                else:
-                    logging.warning('invalid fake eff = {} for {} {} {}'.format(fakeeff,l,n,d))
-
-
-        return weight
+            kinematics = {}
+            for name, (fakeNum, fakeDenom, fakeLeps) in fakes.iteritems():
+                if not fakeNum: fakeNum = 'HaaTight'
+                if not fakeDenom: fakeDenom = 'HaaLoose'
+                fakeWeight = weight
+                for l in fakeLeps:
+                    n = fakeNum[l] if isinstance(fakeNum,dict) else fakeNum
+                    d = fakeDenom[l] if isinstance(fakeDenom,dict) else fakeDenom
+                    coll = 'taus' if l in ['ath'] else 'muons'
+                    if l not in kinematics:
+                        kinematics[l] = (getattr(row,'{}_pt'.format(l)), getattr(row,'{}_eta'.format(l)), getattr(row,'{}_decayMode'.format(l)) if coll=='taus' and self.doDM else None)
+                    pt, eta, dm = kinematics[l]
+                    fake = self.getFakeRate(coll, pt, eta, n, d, dm=dm)
+                    fakeEff = fake[0]
+                    if self.shift=='fakeUp': fakeEff = fake[0]+fake[1]
+                    if self.shift=='fakeDown': fakeEff = fake[0]-fake[1]
+                    if fakeEff>0 and fakeEff<1:
+                        fakeWeight *= fakeEff/(1-fakeEff)
+                    else:
+                        logging.warning('invalid fake eff = {} for {} {} {}'.format(fakeEff,l,n,d))
+                weights[name] = fakeWeight
+
+        return weights
 
     def getMatrix(self,row,fakeNum=None,fakeDenom=None,leps=[]):
         if not fakeNum: fakeNum = 'HaaTight'
@@ -502,19 +512,28 @@ class MuMuTauTauFlattener(NtupleFlattener):
 
 
         # define weights
-        w = self.getWeight(row)
-        wb = self.getWeight(row,doFake=True,fakeLeps=['ath']) # region B ath
-        wc = self.getWeight(row,doFake=True,fakeLeps=['am2']) # region C am2
-        wd = self.getWeight(row,doFake=True,fakeLeps=['am2','ath']) # region D ath, am2
+        fakes = {
+            'b': (None,None,['ath']),       # region B ath
+            'c': (None,None,['am2']),       # region C am2
+            'd': (None,None,['am2','ath']), # region D ath, am2
+        }
+        for newloose in self.newloose:
+            fakes[('b',newloose)] = (None,'HaaLoose{:.1f}'.format(newloose),['ath']) # region B ath
+            fakes[('d',newloose)] = (None,{'ath':'HaaLoose{:.1f}'.format(newloose),'am2':'HaaLoose'},['am2','ath']) # region d am2, ath
+        weights = self.getWeights(row,fakes)
+        w = weights['']
+        wb = weights['b']
+        wc = weights['c']
+        wd = weights['d']
         mat_bd, p_bd, f_bd = self.getMatrix(row,leps=['am2']) # region A/B from C/D matrix
 
         wbs = {}
         wcs = {}
         wds = {}
         for newloose in self.newloose:
-            wbs[newloose] = self.getWeight(row,doFake=True,fakeDenom='HaaLoose{:.1f}'.format(newloose),fakeLeps=['ath']) # region B ath
-            wcs[newloose] = self.getWeight(row,doFake=True,fakeLeps=['am2']) # region c am2
-            wds[newloose] = self.getWeight(row,doFake=True,fakeDenom={'ath':'HaaLoose{:.1f}'.format(newloose),'am2':'HaaLoose'},fakeLeps=['am2','ath']) # region d am2, ath
+            wbs[newloose] = weights[('b',newloose)]
+            wcs[newloose] = wc # region c am2, does not depend on the tau denominator
+            wds[newloose] = weights[('d',newloose)]
             
 
         # figure out region
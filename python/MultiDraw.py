@@ -0,0 +1,177 @@
+import logging
+import os
+import sys
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+# compiled once per process, fills every histogram in a single loop over the tree
+multiDrawCode = '''
+#include <string>
+#include <vector>
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include "TEntryList.h"
+#include "TH1.h"
+#include "TH2.h"
+#include "TH3.h"
+
+namespace DevToolsMultiDraw {
+
+  // returns the number of entries processed, or -1 if a formula can not be evaluated
+  // or has more than one instance per entry (array or vector branches, left to TTree::Draw)
+  Long64_t fill(TTree* tree,
+                const std::vector<std::string>& expressions,
+                const std::vector<int>& selections,
+                const std::vector<int>& weights,
+                const std::vector<int>& xs,
+                const std::vector<int>& ys,
+                const std::vector<int>& zs,
+                const std::vector<TH1*>& hists) {
+    if (!tree || tree->GetEntries()==0) return 0;
+    if (tree->LoadTree(0)<0) return 0;
+    std::vector<TTreeFormula*> formulas;
+    bool good = true;
+    for (size_t i=0; i<expressions.size(); ++i) {
+      TTreeFormula* formula = new TTreeFormula(Form("multiDrawFormula%lu",i),expressions[i].c_str(),tree);
+      if (formula->GetNdim()==0 || formula->IsString() || formula->GetMultiplicity()!=0) good = false;
+      formulas.push_back(formula);
+    }
+    if (!good) {
+      for (size_t i=0; i<formulas.size(); ++i) delete formulas[i];
+      return -1;
+    }
+    std::vector<double> values(formulas.size(),0.);
+    std::vector<char> evaluated(formulas.size(),0);
+    TEntryList* entryList = tree->GetEntryList();
+    Long64_t nentries = entryList ? entryList->GetN() : tree->GetEntries();
+    int treeNumber = -1;
+    Long64_t processed = 0;
+    for (Long64_t i=0; i<nentries; ++i) {
+      Long64_t entry = entryList ? tree->GetEntryNumber(i) : i;
+      if (entry<0) break;
+      if (tree->LoadTree(entry)<0) break;
+      if (tree->GetTreeNumber()!=treeNumber) {
+        treeNumber = tree->GetTreeNumber();
+        for (size_t f=0; f<formulas.size(); ++f) formulas[f]->UpdateFormulaLeaves();
+      }
+      std::fill(evaluated.begin(),evaluated.end(),0);
+      for (size_t j=0; j<hists.size(); ++j) {
+        int indices[5] = {selections[j],weights[j],xs[j],ys[j],zs[j]};
+        double vals[5] = {0.,0.,0.,0.,0.};
+        bool pass = true;
+        for (int k=0; k<5; ++k) {
+          int index = indices[k];
+          if (index<0) continue;
+          if (!evaluated[index]) {
+            values[index] = formulas[index]->EvalInstance(0); // scalar formulas only
+            evaluated[index] = 1;
+          }
+          vals[k] = values[index];
+          // selection and weight of zero skip the entry, as in TTree::Draw
+          if (k<2 && vals[k]==0.) { pass = false; break; }
+        }
+        if (!pass) continue;
+        double w = vals[0]*vals[1];
+        if (zs[j]>=0) ((TH3*)hists[j])->Fill(vals[2],vals[3],vals[4],w);
+        else if (ys[j]>=0) ((TH2*)hists[j])->Fill(vals[2],vals[3],w);
+        else hists[j]->Fill(vals[2],w);
+      }
+      processed += 1;
+    }
+    for (size_t i=0; i<formulas.size(); ++i) delete formulas[i];
+    return processed;
+  }
+
+}
+'''
+
+declared = False
+
+def declareMultiDraw():
+    '''Compile the multidraw loop'''
+    global declared
+    if declared: return
+    ROOT.gInterpreter.Declare(multiDrawCode)
+    declared = True
+
+def normalizeExpression(expression):
+    '''Remove whitespace outside of quoted strings, so the same cut written differently is evaluated once'''
+    parts = []
+    quote = ''
+    for c in str(expression):
+        if quote:
+            if c==quote: quote = ''
+        elif c in '"\'':
+            quote = c
+        elif c.isspace():
+            continue
+        parts += [c]
+    return ''.join(parts)
+
+class MultiDraw(object):
+    '''Fill many histograms in a single pass over a tree'''
+
+    def __init__(self,tree):
+        self.tree = tree
+        self.expressions = []
+        self.expressionMap = {}
+        self.jobs = []
+
+    def __expression(self,expression):
+        '''Index of an expression, identical cut strings are evaluated once per entry'''
+        if not expression: return -1
+        key = normalizeExpression(expression)
+        if key not in self.expressionMap:
+            self.expressionMap[key] = len(self.expressions)
+            self.expressions += [key]
+        return self.expressionMap[key]
+
+    def add(self,hist,selection,scalefactor,xVariable,yVariable='',zVariable=''):
+        '''Add a histogram to be filled with weight scalefactor*(selection)'''
+        hist.Sumw2()
+        self.jobs += [{
+            'hist'       : hist,
+            'selection'  : selection or '1',
+            'scalefactor': scalefactor or '1',
+            'variables'  : [x for x in [xVariable,yVariable,zVariable] if x],
+        }]
+
+    def __project(self):
+        '''Fallback to a TTree::Project per histogram'''
+        for job in self.jobs:
+            hist = job['hist']
+            hist.Reset()
+            varexp = ':'.join(reversed(job['variables']))
+            self.tree.Project(hist.GetName(),varexp,'{0}*({1})'.format(job['scalefactor'],job['selection']))
+
+    def fill(self):
+        '''Fill all the histograms'''
+        if not self.jobs: return 0
+        declareMultiDraw()
+        expressions = ROOT.std.vector('string')()
+        selections = ROOT.std.vector('int')()
+        weights = ROOT.std.vector('int')()
+        xs = ROOT.std.vector('int')()
+        ys = ROOT.std.vector('int')()
+        zs = ROOT.std.vector('int')()
+        hists = ROOT.std.vector('TH1*')()
+        for job in self.jobs:
+            variables = job['variables']+['','']
+            selections.push_back(self.__expression(job['selection']))
+            weights.push_back(self.__expression(job['scalefactor']))
+            xs.push_back(self.__expression(variables[0]))
+            ys.push_back(self.__expression(variables[1]))
+            zs.push_back(self.__expression(variables[2]))
+            hists.push_back(job['hist'])
+        for expression in self.expressions:
+            expressions.push_back(expression)
+        logging.debug('MultiDraw: {0} histograms from {1} expressions'.format(len(self.jobs),len(self.expressions)))
+        processed = ROOT.DevToolsMultiDraw.fill(self.tree,expressions,selections,weights,xs,ys,zs,hists)
+        if processed<0:
+            logging.warning('MultiDraw: expressions can not be compiled or use arrays, falling back to TTree::Project')
+            self.__project()
+        return processed
@@ -7,6 +7,7 @@ import pickle
 import time
 from array import array
 import numbers
+from collections import OrderedDict
 
 sys.argv.append('-b')
 import ROOT
@@ -16,7 +17,15 @@ ROOT.gROOT.SetBatch(ROOT.kTRUE)
 ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 
 from DevTools.Plotter.xsec import getXsec
-from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getNewFlatHistograms
+from DevTools.Plotter.utilities import getLumi, isData, shiftAffects, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getNtupleIndexFile, getNewFlatHistograms
+from DevTools.Plotter.ColumnReader import ColumnReader, hasColumnar, groupColumn
+from DevTools.Plotter.NtupleIndex import loadNtupleIndex
+from DevTools.Plotter.HistStore import HistStore
+from DevTools.Plotter.BranchRow import BranchRow
+from DevTools.Plotter.parallelUtilities import mapWorkers, splitFiles
+
+if hasColumnar:
+    import numpy as np
 
 try:
     from progressbar import ProgressBar, ETA, Percentage, Bar, SimpleProgress
@@ -29,6 +38,9 @@ CMSSW_BASE = os.environ['CMSSW_BASE']
 class NtupleFlattener(object):
     '''Loop over tree and store weights'''
 
+    # shifts that only change the event weight, a flattener that can compute them lists them here
+    weightShiftNames = []
+
     def __init__(self,analysis,sample,**kwargs):
         # default to access via sample/analysis
         self.analysis = analysis
@@ -39,9 +51,32 @@ class NtupleFlattener(object):
         # backup passing custom parameters
         self.ntupleDirectory = kwargs.pop('ntupleDirectory','{0}/{1}'.format(getNtupleDirectory(self.analysis,shift=self.shift),self.sample))
         self.inputFileList = kwargs.pop('inputFileList','')
+        customOutput = 'outputFile' in kwargs
         self.outputFile = kwargs.pop('outputFile',getNewFlatHistograms(self.analysis,self.sample,shift=self.shift))
         if os.path.dirname(self.outputFile): python_mkdir(os.path.dirname(self.outputFile))
+        # weight shifts are filled in the same pass as the nominal and written to their usual outputs
+        weightShifts = kwargs.pop('weightShifts',[])
+        unsupported = [shift for shift in weightShifts if shift not in self.weightShiftNames]
+        if unsupported:
+            raise ValueError('{0} can not flatten {1} as weight shifts'.format(self.__class__.__name__,', '.join(unsupported)))
+        if weightShifts and self.shift:
+            raise ValueError('Weight shifts can only be flattened with the nominal')
+        # shifts that do not change the sample (e.g. weight shifts for data) are read from the nominal
+        weightShifts = [shift for shift in weightShifts if shiftAffects(self.sample,shift)]
+        self.shiftOutputFiles = OrderedDict()
+        for shift in weightShifts:
+            if customOutput:
+                self.shiftOutputFiles[shift] = '{0}_{1}.root'.format(self.outputFile[:-5] if self.outputFile.endswith('.root') else self.outputFile,shift)
+            else:
+                self.shiftOutputFiles[shift] = getNewFlatHistograms(self.analysis,self.sample,shift=shift)
+            if os.path.dirname(self.shiftOutputFiles[shift]): python_mkdir(os.path.dirname(self.shiftOutputFiles[shift]))
+        self.weightShifts = list(weightShifts)
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        self.indexFile = kwargs.pop('indexFile',getNtupleIndexFile(self.analysis,self.sample,shift=self.shift))
+        self.columnar = kwargs.pop('columnar',True)
+        self.branchRows = kwargs.pop('branchRows',True)
+        self.chunkSize = kwargs.pop('chunkSize',100000)
+        self.ncores = kwargs.pop('ncores',1)
         if hasProgress:
             self.pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' ',Percentage(),' ',Bar(),' ',ETA()]))
         else:
@@ -50,11 +85,15 @@ class NtupleFlattener(object):
         self.infile = 0
         self.tchain = 0
         self.initialized = False
-        self.hists = {}
+        self.sparseLimit = kwargs.pop('sparseLimit',64)
+        self.hists = HistStore(sparseLimit=self.sparseLimit)
+        self.templates = {}
         self.datasets = {}
+        self.shiftHists = {}
+        self.shiftDatasets = {}
+        self.fillPlans = {}
 
     def __initializeNtuple(self):
-        tchain = ROOT.TChain(self.treeName)
         if self.inputFileList: # reading from a passed list of inputfiles
             allFiles = []
             with open(self.inputFileList,'r') as f:
@@ -63,21 +102,56 @@ class NtupleFlattener(object):
         else: # reading from an input directory (all files in directory will be processed)
             allFiles = glob.glob('{0}/*.root'.format(self.ntupleDirectory))
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        index = loadNtupleIndex(self.indexFile,self.treeName)
+        index.update(allFiles)
+        summedWeights = index.getSummedWeights(allFiles)
+        tchain = index.makeChain(allFiles)
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
         self.files = allFiles
+        self.index = index
         self.initialized = True
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
+    def __newTemplate(self,hist):
+        '''Empty histogram with the binning of a histogram definition'''
+        xbins = self.histParams[hist].get('xBinning',[])
+        if 'yBinning' in self.histParams[hist]:
+            ybins = self.histParams[hist]['yBinning']
+            if isinstance(xbins,array) and isinstance(ybins,array): # variable width array
+                template = ROOT.TH2D(hist,hist,len(xbins)-1,xbins,len(ybins)-1,ybins)
+            elif len(xbins)==3 and len(ybins)==3 and all([isinstance(x,numbers.Number) for x in xbins]) and all([isinstance(x,numbers.Number) for x in ybins]): # n, low, high
+                template = ROOT.TH2D(hist,hist,xbins[0],xbins[1],xbins[2],ybins[0],ybins[1],ybins[2])
+            elif len(xbins)>0 and len(ybins)>0:
+                template = ROOT.TH2D(hist,hist,len(xbins),0,len(xbins),len(ybins),0,len(ybins))
+                for i,label in enumerate(xbins):
+                    template.GetXaxis().SetBinLabel(i+1,str(label))
+                for i,label in enumerate(ybins):
+                    template.GetYaxis().SetBinLabel(i+1,str(label))
+            else:
+                template = ROOT.TH2D()
+                template.SetName(hist)
+                template.SetTitle(hist)
+        else:
+            if isinstance(xbins,array): # variable width array
+                template = ROOT.TH1D(hist,hist,len(xbins)-1,xbins)
+            elif len(xbins)==3 and all([isinstance(x,numbers.Number) for x in xbins]): # n, low, high
+                template = ROOT.TH1D(hist,hist,xbins[0],xbins[1],xbins[2])
+            elif len(xbins)>0:
+                template = ROOT.TH1D(hist,hist,len(xbins),0,len(xbins))
+                for i,label in enumerate(xbins):
+                    template.GetXaxis().SetBinLabel(i+1,label)
+            else:
+                template = ROOT.TH1D()
+                template.SetName(hist)
+                template.SetTitle(hist)
+        template.SetDirectory(0)
+        template.Sumw2()
+        return template
+
     def __initializeHistograms(self):
         chans = ['all']
         genChans = ['all']
@@ -86,6 +160,8 @@ class NtupleFlattener(object):
         if not hasattr(self,'selections'): self.selections = ['default']
         if not hasattr(self,'selectionHists'): self.selectionHists = {}
         if not hasattr(self,'datasetParams'): self.datasetParams = {}
+        # histograms are only declared here, they are allocated when first filled
+        self.templates = dict([(hist,self.__newTemplate(hist)) for hist in self.histParams])
         for selection in self.selections:
             for hist in self.histParams:
                 if selection in self.selectionHists:
@@ -99,37 +175,7 @@ class NtupleFlattener(object):
                         histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
                         if genChan=='all': histName = '{0}/{1}/{2}'.format(selection,chan,hist)
                         if chan=='all': histName = '{0}/{1}'.format(selection,hist)
-                        xbins = self.histParams[hist].get('xBinning',[])
-                        if 'yBinning' in self.histParams[hist]:
-                            ybins = self.histParams[hist]['yBinning']
-                            if isinstance(xbins,array) and isinstance(ybins,array): # variable width array
-                                self.hists[histName] = ROOT.TH2D(histName,histName,len(xbins)-1,xbins,len(ybins)-1,ybins)
-                            elif len(xbins)==3 and len(ybins)==3 and all([isinstance(x,numbers.Number) for x in xbins]) and all([isinstance(x,numbers.Number) for x in ybins]): # n, low, high
-                                self.hists[histName] = ROOT.TH2D(histName,histName,xbins[0],xbins[1],xbins[2],ybins[0],ybins[1],ybins[2])
-                            elif len(xbins)>0 and len(ybins)>0:
-                                self.hists[histName] = ROOT.TH2D(histName,histName,len(xbins),0,len(xbins),len(ybins),0,len(ybins))
-                                for i,label in enumerate(xbins):
-                                    self.hists[histName].GetXaxis().SetBinLabel(i+1,str(label))
-                                for i,label in enumerate(ybins):
-                                    self.hists[histName].GetYaxis().SetBinLabel(i+1,str(label))
-                            else:
-                                self.hists[histName] = ROOT.TH2D()
-                                self.hists[histName].SetName(histName)
-                                self.hists[histName].SetTitle(histName)
-                        else:
-                            if isinstance(xbins,array): # variable width array
-                                self.hists[histName] = ROOT.TH1D(histName,histName,len(xbins)-1,xbins)
-                            elif len(xbins)==3 and all([isinstance(x,numbers.Number) for x in xbins]): # n, low, high
-                                self.hists[histName] = ROOT.TH1D(histName,histName,xbins[0],xbins[1],xbins[2])
-                            elif len(xbins)>0:
-                                self.hists[histName] = ROOT.TH1D(histName,histName,len(xbins),0,len(xbins))
-                                for i,label in enumerate(xbins):
-                                    self.hists[histName].GetXaxis().SetBinLabel(i+1,label)
-                            else:
-                                self.hists[histName] = ROOT.TH1D()
-                                self.hists[histName].SetName(histName)
-                                self.hists[histName].SetTitle(histName)
-                        self.hists[histName].Sumw2()
+                        self.hists.declare(histName,self.templates[hist])
             for hist in self.datasetParams:
                 if 'doGen' in self.datasetParams[hist] and self.datasetParams[hist]['doGen']:
                     thisGenChans = genChans
@@ -147,6 +193,14 @@ class NtupleFlattener(object):
                             self.datasets[histName] = ROOT.RooDataSet(histName,histName,ROOT.RooArgSet(x,y,w))#,w.GetName())
                         else:
                             self.datasets[histName] = ROOT.RooDataSet(histName,histName,ROOT.RooArgSet(x,w))#,w.GetName())
+        for shift in self.weightShifts:
+            self.shiftHists[shift] = self.hists.emptyClone()
+            self.shiftDatasets[shift] = dict([(histName,self.datasets[histName].emptyClone()) for histName in self.datasets])
+        self.fillPlans = {}
+        for selection in self.selections:
+            for chan in chans:
+                for genChan in genChans:
+                    self.getFillPlan(selection,chan,genChan)
 
     def getTree(self):
         if not self.initialized: self.__initializeNtuple()
@@ -171,6 +225,57 @@ class NtupleFlattener(object):
         self.__initializeNtuple()
         self.totalEntries = self.sampleTree.GetEntries()
         self.__initializeHistograms()
+        if self.ncores>1 and len(self.files)>1:
+            self.__flattenParallel()
+        else:
+            self.__loop()
+        self.write()
+
+    def __flattenParallel(self):
+        '''Split the files over a pool of workers and merge their histograms.'''
+        groups = splitFiles(self.files,self.ncores,self.index.getEntries)
+        logging.info('Flattening {0} {1} on {2} cores'.format(self.analysis,self.sample,len(groups)))
+        partOutputs = mapWorkers(self,'flattenPart',groups)
+        for outputs in partOutputs:
+            for shift, partFile in outputs.iteritems():
+                hists = self.shiftHists[shift] if shift else self.hists
+                datasets = self.shiftDatasets[shift] if shift else self.datasets
+                tfile = ROOT.TFile.Open(partFile)
+                ROOT.gROOT.cd()
+                for h in hists:
+                    hist = tfile.Get(h)
+                    if hist: hists[h].Add(hist)
+                for h in datasets:
+                    dataset = tfile.Get(h)
+                    if dataset: datasets[h].append(dataset)
+                tfile.Close()
+                os.remove(partFile)
+
+    def flattenPart(self,i,files):
+        '''Worker: flatten a subset of the files into temporary output files, one per filled shift.'''
+        self.files = files
+        self.sampleTree = self.index.makeChain(files)
+        self.totalEntries = self.sampleTree.GetEntries()
+        self.pbar = None
+        self.__loop()
+        self.outputFile = '{0}.part{1}.root'.format(self.outputFile,i)
+        self.shiftOutputFiles = OrderedDict([(shift,'{0}.part{1}.root'.format(outputFile,i)) for shift,outputFile in self.shiftOutputFiles.iteritems()])
+        outputs = OrderedDict([('',self.outputFile)]+self.shiftOutputFiles.items())
+        for outputFile in outputs.values():
+            if os.path.exists(outputFile): os.remove(outputFile)
+        self.write()
+        return outputs
+
+    def getRows(self):
+        '''Rows of the current tree, read into buffers bound to the branches that are used'''
+        if self.branchRows: return BranchRow(self.sampleTree)
+        return self.sampleTree
+
+    def __loop(self):
+        '''Loop over the current tree, either row by row or in chunks of columns.'''
+        if self.useColumnar():
+            self.__flattenColumnar()
+            return
         total = 0
         start = time.time()
         new = start
@@ -178,14 +283,14 @@ class NtupleFlattener(object):
         if hasProgress and self.pbar:
             self.pbar.maxval = self.totalEntries
             self.pbar.start()
-            for row in self.sampleTree:
+            for row in self.getRows():
                 total += 1
                 self.pbar.update(total)
                 self.perRowAction(row)
             self.pbar.finish()
         else:
             logging.info('Flattening {0} {1}'.format(self.analysis,self.sample))
-            for row in self.sampleTree:
+            for row in self.getRows():
                 total += 1
                 if total==2: start = time.time() # just ignore first event for timing
                 if total % 1000 == 1:
@@ -197,21 +302,68 @@ class NtupleFlattener(object):
                     logging.info('{0}: Processing {1} event {2}/{3} - {4}:{5:02d}:{6:02d} remaining'.format(self.analysis,self.sample,total,self.totalEntries,hours,mins,secs))
                     self.flush()
                 self.perRowAction(row)
-        self.write()
+
+    def useColumnar(self):
+        '''Use the vectorized loop if the flattener declares its columns, datasets are only filled by the row loop'''
+        if not self.columnar or not hasattr(self,'columns'): return False
+        if getattr(self,'datasetParams',{}):
+            logging.info('{0} has datasets, using the row loop'.format(self.__class__.__name__))
+            return False
+        if getattr(self.perChunkAction,'__func__',None) is NtupleFlattener.perChunkAction.__func__: return False
+        if not hasColumnar:
+            logging.warning('numpy/root_numpy not available, falling back to the row loop')
+            return False
+        return True
+
+    def __flattenColumnar(self):
+        '''Vectorized access loop, the ntuple is read in chunks of numpy arrays.'''
+        total = 0
+        start = time.time()
+        reader = ColumnReader(self.files,self.treeName,self.columns,chunkSize=self.chunkSize)
+        if hasProgress and self.pbar:
+            self.pbar.maxval = self.totalEntries
+            self.pbar.start()
+        else:
+            logging.info('Flattening {0} {1} in chunks of {2}'.format(self.analysis,self.sample,self.chunkSize))
+        for chunk in reader:
+            self.perChunkAction(chunk)
+            total += len(chunk)
+            if hasProgress and self.pbar:
+                self.pbar.update(total)
+            else:
+                elapsed = time.time()-start
+                remaining = float(elapsed)/total * float(self.totalEntries) - float(elapsed)
+                mins, secs = divmod(int(remaining),60)
+                hours, mins = divmod(mins,60)
+                logging.info('{0}: Processing {1} event {2}/{3} - {4}:{5:02d}:{6:02d} remaining'.format(self.analysis,self.sample,total,self.totalEntries,hours,mins,secs))
+                self.flush()
+        if hasProgress and self.pbar:
+            self.pbar.finish()
 
     def write(self):
         '''
-        Write histograms to files
+        Write histograms to files, each weight shift to its own file
         '''
+        self.__writeFile(self.outputFile,self.hists,self.datasets)
+        for shift, outputFile in self.shiftOutputFiles.iteritems():
+            self.__writeFile(outputFile,self.shiftHists[shift],self.shiftDatasets[shift])
+
+    def __writeFile(self,outputFile,hists,datasets):
+        '''Write a set of histograms and datasets to a file'''
         total = 0
-        totalHists = len(self.hists)+len(self.datasets)
+        # histograms that were never filled are not written, readers use the template of the declared histograms
+        declared = sorted(hists)
+        hists = hists.getFilled()
+        for hist, template in self.templates.iteritems():
+            hists['templates/{0}'.format(hist)] = template
+        totalHists = len(hists)+len(datasets)
         if hasProgress and self.pbar:
             self.pbar.maxval = totalHists
             self.pbar.start()
         else:
-            logging.info('Writing histograms')
-        self.outfile = ROOT.TFile(self.outputFile,'update')
-        for h in sorted(self.hists):
+            logging.info('Writing histograms to {0}'.format(outputFile))
+        self.outfile = ROOT.TFile(outputFile,'recreate') # no histograms left from a previous run
+        for h in sorted(hists):
             total += 1
             if hasProgress and self.pbar:
                 self.pbar.update(total)
@@ -220,13 +372,13 @@ class NtupleFlattener(object):
             components = h.split('/')
             directory = '/'.join(components[:-1])
             histName = components[-1]
-            hist = self.hists[h]
+            hist = hists[h]
             hist.SetName(histName)
             hist.SetTitle(histName)
             if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-            self.outfile.cd('{0}:/{1}'.format(self.outputFile,directory))
+            self.outfile.cd('{0}:/{1}'.format(outputFile,directory))
             hist.Write('',ROOT.TObject.kOverwrite)
-        for h in sorted(self.datasets):
+        for h in sorted(datasets):
             total += 1
             if hasProgress and self.pbar:
                 self.pbar.update(total)
@@ -235,14 +387,16 @@ class NtupleFlattener(object):
             components = h.split('/')
             directory = '/'.join(components[:-1])
             histName = components[-1]
-            hist = self.datasets[h]
+            hist = datasets[h]
             hist.SetName(histName)
             hist.SetTitle(histName)
             if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-            self.outfile.cd('{0}:/{1}'.format(self.outputFile,directory))
+            self.outfile.cd('{0}:/{1}'.format(outputFile,directory))
             hist.Write('',ROOT.TObject.kOverwrite)
         if hasProgress and self.pbar:
             self.pbar.finish()
+        self.outfile.cd()
+        ROOT.TObjString('\n'.join(declared)).Write('declaredHistograms',ROOT.TObject.kOverwrite)
         self.outfile.Close()
 
 
@@ -252,61 +406,159 @@ class NtupleFlattener(object):
         '''
         return
 
-    def fill(self,row,selection,weight,chan='all',genChan='all'):
-        '''Fill a histogram'''
-        if weight!=weight:
-            logging.warning('{0} {1} {2} attempted to add NaN weight'.format(histName,chan,genChan))
+    def perChunkAction(self,chunk):
+        '''
+        Action to be performed on each chunk of columns. Override along with self.columns to use the vectorized loop.
+        '''
+        return
+
+    def getShiftTargets(self,weight):
+        '''
+        Histograms, datasets and weight for the nominal and each weight shift.
+        The weight is a number, the same for all shifts, or a dictionary of the weight of each shift ('' for the nominal).
+        '''
+        if not isinstance(weight,dict): weight = dict([(shift,weight) for shift in ['']+self.weightShifts])
+        targets = [(self.hists,self.datasets,weight[''])]
+        for shift in self.weightShifts:
+            targets += [(self.shiftHists[shift],self.shiftDatasets[shift],weight[shift])]
+        return targets
+
+    def __getFillNames(self,selection,chan,genChan,hist,store):
+        '''Names of the copies of a histogram filled for a selection, channel and gen channel'''
+        histNames = ['{0}/{1}'.format(selection,hist)]
+        if chan!='all': histNames += ['{0}/{1}/{2}'.format(selection,chan,hist)]
+        if genChan!='all':
+            histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
+            if histName in store: histNames += [histName]
+        return histNames
+
+    def getFillPlan(self,selection,chan='all',genChan='all'):
+        '''
+        What fill does for a selection, channel and gen channel, built once so the event loop does no name lookups.
+        Each entry holds the functions of a histogram (or dataset) definition and, for the nominal and
+        each weight shift in order, the histograms it fills.
+        '''
+        key = (selection,chan,genChan)
+        if key in self.fillPlans: return self.fillPlans[key]
+        histStores = [self.hists]+[self.shiftHists[shift] for shift in self.weightShifts]
+        datasetStores = [self.datasets]+[self.shiftDatasets[shift] for shift in self.weightShifts]
+        histPlan = []
         for hist in self.histParams:
             if selection in self.selectionHists:
                 if hist not in self.selectionHists[selection]: continue
-            if 'selection' in self.histParams:
-                if not self.histParams[hist]['selection'](row): continue
-            w = weight*self.histParams[hist]['mcscale'](row) if 'mcscale' in self.histParams[hist] and self.isData else weight
-            histName = '{0}/{1}'.format(selection,hist)
-            xval = self.histParams[hist]['x'](row)
-            if 'y' in self.histParams[hist]:
-                yval = self.histParams[hist]['y'](row)
-                self.hists[histName].Fill(xval,yval,w)
-                if chan!='all':
-                    histName = '{0}/{1}/{2}'.format(selection,chan,hist)
-                    self.hists[histName].Fill(xval,yval,w)
-                if genChan!='all':
-                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
-                    if histName in self.hists: self.hists[histName].Fill(xval,yval,w)
+            params = self.histParams[hist]
+            histNames = self.__getFillNames(selection,chan,genChan,hist,self.hists)
+            mcscale = params['mcscale'] if 'mcscale' in params and not self.isData else None
+            destinations = [[hists[histName] for histName in histNames] for hists in histStores]
+            histPlan += [(params.get('selection',None),mcscale,params['x'],params.get('y',None),destinations)]
+        datasetPlan = []
+        for hist in self.datasetParams:
+            params = self.datasetParams[hist]
+            histNames = self.__getFillNames(selection,chan,genChan,hist,self.datasets)
+            mcscale = params['mcscale'] if 'mcscale' in params and not self.isData else None
+            if 'y' in params:
+                argSet = ROOT.RooArgSet(params['xVar'],params['yVar'],params['wVar'])
             else:
-                self.hists[histName].Fill(xval,w)
-                if chan!='all':
-                    histName = '{0}/{1}/{2}'.format(selection,chan,hist)
-                    self.hists[histName].Fill(xval,w)
-                if genChan!='all':
-                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
-                    if histName in self.hists: self.hists[histName].Fill(xval,w)
+                argSet = ROOT.RooArgSet(params['xVar'],params['wVar'])
+            destinations = [[datasets[histName] for histName in histNames] for datasets in datasetStores]
+            datasetPlan += [(mcscale,params['x'],params['xVar'],params.get('y',None),params.get('yVar',None),params['wVar'],argSet,destinations)]
+        self.fillPlans[key] = (histPlan,datasetPlan)
+        return self.fillPlans[key]
 
-        for hist in self.datasetParams:
-            wval = weight*self.datasetParams[hist]['mcscale'](row) if 'mcscale' in self.datasetParams[hist] and self.isData else weight
-            w = self.datasetParams[hist]['wVar']
-            w.setVal(wval)
-            histName = '{0}/{1}'.format(selection,hist)
-            xval = self.datasetParams[hist]['x'](row)
-            x = self.datasetParams[hist]['xVar']
-            x.setVal(xval)
-            if 'y' in self.datasetParams[hist]:
-                yval = self.datasetParams[hist]['y'](row)
-                y = self.datasetParams[hist]['yVar']
-                y.setVal(yval)
-                self.datasets[histName].add(ROOT.RooArgSet(x,y,w))
-                if chan!='all':
-                    histName = '{0}/{1}/{2}'.format(selection,chan,hist)
-                    self.datasets[histName].add(ROOT.RooArgSet(x,y,w))
-                if genChan!='all':
-                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
-                    if histName in self.datasets: self.datasets[histName].add(ROOT.RooArgSet(x,y,w))
+    def fill(self,row,selection,weight,chan='all',genChan='all'):
+        '''
+        Fill a histogram. The weight is a number or, when flattening weight shifts,
+        a dictionary with the weight of each shift ('' for the nominal).
+        The histogram values are computed once and filled for every shift.
+        '''
+        plan = self.fillPlans.get((selection,chan,genChan),None)
+        if plan is None: plan = self.getFillPlan(selection,chan,genChan)
+        histPlan, datasetPlan = plan
+        if isinstance(weight,dict):
+            weights = [weight['']]+[weight[shift] for shift in self.weightShifts]
+        else:
+            weights = [weight]*(len(self.weightShifts)+1)
+        if any([w!=w for w in weights]):
+            logging.warning('{0} {1} {2} attempted to add NaN weight'.format(selection,chan,genChan))
+        for select, mcscale, xfunc, yfunc, destinations in histPlan:
+            if select and not select(row): continue
+            scale = mcscale(row) if mcscale else 1
+            xval = xfunc(row)
+            if yfunc:
+                yval = yfunc(row)
+                for w, hists in zip(weights,destinations):
+                    w = w*scale
+                    for hist in hists: hist.Fill(xval,yval,w)
             else:
-                self.datasets[histName].add(ROOT.RooArgSet(x,w))
-                if chan!='all':
-                    histName = '{0}/{1}/{2}'.format(selection,chan,hist)
-                    self.datasets[histName].add(ROOT.RooArgSet(x,w))
-                if genChan!='all':
-                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
-                    if histName in self.datasets: self.datasets[histName].add(ROOT.RooArgSet(x,w))
+                for w, hists in zip(weights,destinations):
+                    w = w*scale
+                    for hist in hists: hist.Fill(xval,w)
+
+        for mcscale, xfunc, xVar, yfunc, yVar, wVar, argSet, destinations in datasetPlan:
+            scale = mcscale(row) if mcscale else 1
+            xVar.setVal(xfunc(row))
+            if yfunc: yVar.setVal(yfunc(row))
+            for w, datasets in zip(weights,destinations):
+                wVar.setVal(w*scale)
+                for dataset in datasets: dataset.add(argSet)
 
+    def __column(self,vals,n):
+        '''Broadcast a scalar expression to the chunk'''
+        vals = np.asarray(vals)
+        return np.repeat(vals,n) if vals.ndim==0 else vals
+
+    def __fillN(self,hist,w,x,y=None):
+        '''Bulk fill a histogram from arrays'''
+        if len(x)==0: return
+        if x.dtype.kind in 'SUO' or (y is not None and y.dtype.kind in 'SUO'): # labeled axes
+            for i in range(len(x)):
+                if y is None:
+                    hist.Fill(x[i],w[i])
+                else:
+                    hist.Fill(x[i],y[i],w[i])
+            return
+        x = np.ascontiguousarray(x,dtype=np.float64)
+        w = np.ascontiguousarray(w,dtype=np.float64)
+        if y is None:
+            hist.FillN(len(x),x,w)
+        else:
+            y = np.ascontiguousarray(y,dtype=np.float64)
+            hist.FillN(len(x),x,y,w)
+
+    def fillArrays(self,chunk,selection,mask,weight,chan='all',genChan='all'):
+        '''
+        Fill histograms for all events of a chunk passing the mask.
+        Histograms are defined by the vector expressions 'vx', 'vy', 'vselection', and 'vmcscale' of histParams.
+        The channels can be a single name or an array with one name per event.
+        The weight can be a dictionary of the weight of each shift, as for fill.
+        '''
+        n = len(chunk)
+        mask = np.ones(n,dtype=bool) if mask is None else np.asarray(mask,dtype=bool)
+        shiftTargets = [(hists,self.__column(w,n).astype(np.float64)) for hists,datasets,w in self.getShiftTargets(weight)]
+        if not mask.any(): return
+        if any([np.isnan(w[mask]).any() for hists,w in shiftTargets]):
+            logging.warning('{0} {1} {2} attempted to add NaN weight'.format(selection,chan,genChan))
+        chanGroups = groupColumn(chan,n)
+        genChanGroups = groupColumn(genChan,n)
+        for hist in self.histParams:
+            if selection in self.selectionHists:
+                if hist not in self.selectionHists[selection]: continue
+            params = self.histParams[hist]
+            if 'vx' not in params:
+                logging.error('No vector expression for {0}'.format(hist))
+                continue
+            histMask = mask & np.asarray(params['vselection'](chunk),dtype=bool) if 'vselection' in params else mask
+            if not histMask.any(): continue
+            scale = params['vmcscale'](chunk) if 'vmcscale' in params and not self.isData else 1
+            xvals = self.__column(params['vx'](chunk),n)
+            yvals = self.__column(params['vy'](chunk),n) if 'vy' in params else None
+            targets = [('{0}/{1}'.format(selection,hist),histMask)]
+            for c,cMask in chanGroups:
+                if c!='all': targets += [('{0}/{1}/{2}'.format(selection,c,hist),histMask & cMask)]
+                for g,gMask in genChanGroups:
+                    if g!='all': targets += [('{0}/{1}/gen_{2}/{3}'.format(selection,c,g,hist),histMask & cMask & gMask)]
+            weights = [(hists,w*scale) for hists,w in shiftTargets]
+            for histName,m in targets:
+                if histName not in self.hists: continue
+                for hists,w in weights:
+                    self.__fillN(hists[histName],w[m],xvals[m],None if yvals is None else yvals[m])
@@ -0,0 +1,128 @@
+import logging
+import os
+import sys
+import json
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Plotter.utilities import python_mkdir
+
+# indices already loaded in this process
+loadedIndices = {}
+
+def loadNtupleIndex(indexFile,treeName):
+    '''Get the index for a sample, shared by all users in a process'''
+    key = (indexFile,treeName)
+    if key not in loadedIndices: loadedIndices[key] = NtupleIndex(indexFile,treeName)
+    return loadedIndices[key]
+
+class NtupleIndex(object):
+    '''Persistent index of the metadata of the ntuple files of a sample'''
+
+    def __init__(self,indexFile,treeName):
+        self.indexFile = indexFile
+        self.treeName = treeName
+        self.index = {}
+        self.uncached = {}
+        self.changed = False
+        self.__load()
+
+    def __load(self):
+        if not os.path.isfile(self.indexFile): return
+        try:
+            with open(self.indexFile,'r') as f:
+                self.index = json.load(f)
+        except:
+            logging.warning('Failed to read {0}, rebuilding index'.format(self.indexFile))
+            self.index = {}
+
+    def __stat(self,filename):
+        '''Size and modification time, None if the file can not be stat'ed (e.g. xrootd)'''
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return [st.st_size,int(st.st_mtime)]
+
+    def __readFile(self,filename):
+        '''Read the metadata from the ROOT file itself, None if the file can not be opened'''
+        meta = {'summedWeights': 0., 'entries': 0}
+        tfile = ROOT.TFile.Open(filename)
+        if not tfile or tfile.IsZombie():
+            logging.error('Failed to open {0}'.format(filename))
+            return None
+        hist = tfile.Get('summedWeights')
+        if hist: meta['summedWeights'] = hist.GetBinContent(1)
+        tree = tfile.Get(self.treeName)
+        if tree: meta['entries'] = int(tree.GetEntries())
+        tfile.Close()
+        return meta
+
+    def update(self,files):
+        '''Read the metadata of new or modified files'''
+        nread = 0
+        for filename in files:
+            stat = self.__stat(filename)
+            entry = self.index.get(filename)
+            if entry and stat and [entry['size'],entry['mtime']]==stat: continue
+            if filename in self.uncached: continue
+            meta = self.__readFile(filename)
+            nread += 1
+            if meta is None:
+                # not stored in the index, a failed read would be reused until the file changes
+                self.uncached[filename] = {'summedWeights': 0., 'entries': 0}
+            elif stat:
+                meta['size'], meta['mtime'] = stat
+                self.index[filename] = meta
+                self.changed = True
+            else:
+                self.uncached[filename] = meta
+        # drop files that were removed
+        fileSet = set(files)
+        for filename in self.index.keys():
+            if filename not in fileSet and not os.path.exists(filename):
+                self.index.pop(filename)
+                self.changed = True
+        if nread: logging.debug('Read metadata from {0} of {1} files for {2}'.format(nread,len(files),self.indexFile))
+        self.save()
+
+    def save(self):
+        '''Write the index if it changed'''
+        if not self.changed: return
+        if os.path.dirname(self.indexFile): python_mkdir(os.path.dirname(self.indexFile))
+        tmpFile = '{0}.{1}.tmp'.format(self.indexFile,os.getpid())
+        with open(tmpFile,'w') as f:
+            f.write(json.dumps(self.index, indent=4, sort_keys=True))
+        os.rename(tmpFile,self.indexFile)
+        self.changed = False
+
+    def getMeta(self,filename):
+        if filename in self.index: return self.index[filename]
+        if filename not in self.uncached: self.update([filename])
+        return self.index.get(filename,self.uncached.get(filename,{}))
+
+    def getSummedWeights(self,files):
+        return sum([self.getMeta(f).get('summedWeights',0.) for f in files])
+
+    def getEntries(self,filename):
+        return self.getMeta(filename).get('entries',0)
+
+    def makeChain(self,files):
+        '''Build a TChain without opening the files for their number of entries'''
+        tchain = ROOT.TChain(self.treeName)
+        for f in files:
+            entries = self.getEntries(f)
+            if entries>0:
+                tchain.Add(f,entries)
+            else:
+                tchain.Add(f)
+        return tchain
+
+    def getFingerprint(self,filename):
+        '''Cheap fingerprint of a file from its metadata'''
+        meta = self.getMeta(filename)
+        return '{0}:{1}:{2}:{3}'.format(meta.get('size',''),meta.get('mtime',''),meta.get('entries',0),meta.get('summedWeights',0.))
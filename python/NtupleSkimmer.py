@@ -3,9 +3,10 @@ import os
 import sys
 import glob
 import json
-import pickle
 import time
 
+import numpy as np
+
 sys.argv.append('-b')
 import ROOT
 sys.argv.pop()
@@ -14,8 +15,13 @@ ROOT.gROOT.SetBatch(ROOT.kTRUE)
 ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 
 from DevTools.Plotter.xsec import getXsec
-from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getSkimJson, getSkimPickle
+from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getNtupleIndexFile, getSkimJson, getSkimCountStore
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
+from DevTools.Plotter.ColumnReader import ColumnReader, hasColumnar, groupColumn
+from DevTools.Plotter.BranchRow import BranchRow
+from DevTools.Plotter.NtupleIndex import loadNtupleIndex
+from DevTools.Plotter.parallelUtilities import mapWorkers, splitFiles
+from DevTools.Plotter.CountStore import writeCountStore
 
 try:
     from progressbar import ProgressBar, ETA, Percentage, Bar, SimpleProgress
@@ -39,8 +45,14 @@ class NtupleSkimmer(object):
         self.inputFileList = kwargs.pop('inputFileList','')
         self.outputFile = kwargs.pop('outputFile','')
         self.json = kwargs.pop('json',getSkimJson(self.analysis,self.sample))
-        self.pickle = kwargs.pop('pickle',getSkimPickle(self.analysis,self.sample))
+        self.countStore = kwargs.pop('countStore',getSkimCountStore(self.analysis,self.sample))
+        self.dumpJson = kwargs.pop('dumpJson',False)
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        self.indexFile = kwargs.pop('indexFile',getNtupleIndexFile(self.analysis,self.sample,shift=self.shift))
+        self.columnar = kwargs.pop('columnar',True)
+        self.branchRows = kwargs.pop('branchRows',True)
+        self.chunkSize = kwargs.pop('chunkSize',100000)
+        self.ncores = kwargs.pop('ncores',1)
         if hasProgress:
             self.pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' events ',Percentage(),' ',Bar(),' ',ETA()]))
         else:
@@ -49,10 +61,18 @@ class NtupleSkimmer(object):
         self.infile = 0
         self.tchain = 0
         self.initialized = False
-        self.counts = {}
+        # counts are accumulated in arrays indexed by an id interned for each name
+        self.keyIds = {}
+        self.keyNames = []
+        self.incrementIds = {}
+        self.countVals = np.zeros(0,dtype=np.float64)
+        self.countEntries = np.zeros(0,dtype=np.float64)
+        self.countErr2 = np.zeros(0,dtype=np.float64)
+        self.pendingIds = []
+        self.pendingWeights = []
+        self.maxPending = kwargs.pop('maxPending',100000)
 
     def __initializeNtuple(self):
-        tchain = ROOT.TChain(self.treeName)
         if self.inputFileList: # reading from a passed list of inputfiles
             allFiles = []
             with open(self.inputFileList,'r') as f:
@@ -61,12 +81,10 @@ class NtupleSkimmer(object):
         else: # reading from an input directory (all files in directory will be processed)
             allFiles = glob.glob('{0}/*.root'.format(self.ntupleDirectory))
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        index = loadNtupleIndex(self.indexFile,self.treeName)
+        index.update(allFiles)
+        summedWeights = index.getSummedWeights(allFiles)
+        tchain = index.makeChain(allFiles)
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
@@ -74,6 +92,7 @@ class NtupleSkimmer(object):
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
         self.files = allFiles
+        self.index = index
         self.initialized = True
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
@@ -94,22 +113,23 @@ class NtupleSkimmer(object):
         sys.stderr.flush()
 
     def dump(self):
+        '''Write the counts to the count store, and to json for debugging if requested'''
         if self.outputFile:
             # hack to copy them to hdfs
             os.system('touch {0}'.format(self.outputFile))
             jfile = self.outputFile.replace('.root','.json.root')
-            pfile = self.outputFile.replace('.root','.pkl.root')
+            cfile = self.outputFile.replace('.root','.cnt.root')
         else:
             # local running
             jfile = self.json
-            pfile = self.pickle
-            python_mkdir(os.path.dirname(jfile))
-            python_mkdir(os.path.dirname(pfile))
-        with open(jfile,'w') as f:
-            f.write(json.dumps(self.counts, indent=4, sort_keys=True))
-        with open(pfile,'wb') as f:
-            pickle.dump(self.counts,f)
-
+            cfile = self.countStore
+            python_mkdir(os.path.dirname(cfile))
+            if self.dumpJson: python_mkdir(os.path.dirname(jfile))
+        counts = self.counts
+        writeCountStore(cfile,counts)
+        if self.dumpJson:
+            with open(jfile,'w') as f:
+                f.write(json.dumps(counts, indent=4, sort_keys=True))
 
     def skim(self):
         '''
@@ -117,6 +137,53 @@ class NtupleSkimmer(object):
         '''
         self.__initializeNtuple()
         self.totalEntries = self.sampleTree.GetEntries()
+        if self.ncores>1 and len(self.files)>1:
+            self.__skimParallel()
+        else:
+            self.__loop()
+        self.dump()
+
+    def __skimParallel(self):
+        '''Split the files over a pool of workers and merge their counts.'''
+        groups = splitFiles(self.files,self.ncores,self.index.getEntries)
+        logging.info('Skimming {0} {1} on {2} cores'.format(self.analysis,self.sample,len(groups)))
+        for names, vals, entries, err2, result in mapWorkers(self,'skimPart',groups):
+            self.addCounts(names,vals,entries,err2)
+            self.mergePartResult(result)
+
+    def skimPart(self,i,files):
+        '''Worker: skim a subset of the files and return the names and arrays of the counts.'''
+        self.files = files
+        self.sampleTree = self.index.makeChain(files)
+        self.totalEntries = self.sampleTree.GetEntries()
+        self.pbar = None
+        self.__loop()
+        self.__flushPending()
+        n = len(self.keyNames)
+        return self.keyNames, self.countVals[:n], self.countEntries[:n], self.countErr2[:n], self.getPartResult()
+
+    def getPartResult(self):
+        '''
+        Results of a worker besides the counts, passed to mergePartResult in the parent. Override.
+        '''
+        return None
+
+    def mergePartResult(self,result):
+        '''
+        Merge the results of a worker from getPartResult. Override.
+        '''
+        return
+
+    def getRows(self):
+        '''Rows of the current tree, read into buffers bound to the branches that are used'''
+        if self.branchRows: return BranchRow(self.sampleTree)
+        return self.sampleTree
+
+    def __loop(self):
+        '''Loop over the current tree, either row by row or in chunks of columns.'''
+        if self.useColumnar():
+            self.__skimColumnar()
+            return
         total = 0
         start = time.time()
         new = start
@@ -124,14 +191,14 @@ class NtupleSkimmer(object):
         if hasProgress and self.pbar:
             self.pbar.maxval = self.totalEntries
             self.pbar.start()
-            for row in self.sampleTree:
+            for row in self.getRows():
                 total += 1
                 self.pbar.update(total)
                 self.perRowAction(row)
             self.pbar.finish()
         else:
             logging.info('Skimming {0} {1}'.format(self.analysis,self.sample))
-            for row in self.sampleTree:
+            for row in self.getRows():
                 total += 1
                 if total==2: start = time.time() # just ignore first event for timing
                 if total % 1000 == 1:
@@ -143,7 +210,40 @@ class NtupleSkimmer(object):
                     logging.info('{0}: Processing event {1}/{2} - {3}:{4:02d}:{5:02d} remaining'.format(self.analysis,total,self.totalEntries,hours,mins,secs))
                     self.flush()
                 self.perRowAction(row)
-        self.dump()
+
+    def useColumnar(self):
+        '''Use the vectorized loop if the skimmer declares its columns'''
+        if not self.columnar or not hasattr(self,'columns'): return False
+        if getattr(self.perChunkAction,'__func__',None) is NtupleSkimmer.perChunkAction.__func__: return False
+        if not hasColumnar:
+            logging.warning('numpy/root_numpy not available, falling back to the row loop')
+            return False
+        return True
+
+    def __skimColumnar(self):
+        '''Vectorized access loop, the ntuple is read in chunks of numpy arrays.'''
+        total = 0
+        start = time.time()
+        reader = ColumnReader(self.files,self.treeName,self.columns,chunkSize=self.chunkSize)
+        if hasProgress and self.pbar:
+            self.pbar.maxval = self.totalEntries
+            self.pbar.start()
+        else:
+            logging.info('Skimming {0} {1} in chunks of {2}'.format(self.analysis,self.sample,self.chunkSize))
+        for chunk in reader:
+            self.perChunkAction(chunk)
+            total += len(chunk)
+            if hasProgress and self.pbar:
+                self.pbar.update(total)
+            else:
+                elapsed = time.time()-start
+                remaining = float(elapsed)/total * float(self.totalEntries) - float(elapsed)
+                mins, secs = divmod(int(remaining),60)
+                hours, mins = divmod(mins,60)
+                logging.info('{0}: Processing event {1}/{2} - {3}:{4:02d}:{5:02d} remaining'.format(self.analysis,total,self.totalEntries,hours,mins,secs))
+                self.flush()
+        if hasProgress and self.pbar:
+            self.pbar.finish()
 
     def perRowAction(self,row):
         '''
@@ -151,26 +251,119 @@ class NtupleSkimmer(object):
         '''
         return
 
+    def perChunkAction(self,chunk):
+        '''
+        Action to be performed on each chunk of columns. Override along with self.columns to use the vectorized loop.
+        '''
+        return
+
+    @property
+    def counts(self):
+        '''Dictionary of all counts, {name: {'val','count','err2'}}'''
+        self.__flushPending()
+        return dict([(name,{'val':float(self.countVals[i]),'count':int(self.countEntries[i]),'err2':float(self.countErr2[i]),}) for i,name in enumerate(self.keyNames)])
+
+    def __intern(self,name):
+        '''Id of a count, growing the accumulators for new names'''
+        i = self.keyIds.get(name)
+        if i is None:
+            i = len(self.keyNames)
+            self.keyIds[name] = i
+            self.keyNames += [name]
+            if i>=len(self.countVals):
+                size = max(2*len(self.countVals),1024)
+                for attr in ['countVals','countEntries','countErr2']:
+                    old = getattr(self,attr)
+                    new = np.zeros(size,dtype=np.float64)
+                    new[:len(old)] = old
+                    setattr(self,attr,new)
+        return i
+
+    def getKeyIds(self,cutName,chan,genChan='all'):
+        '''Ids of the counts incremented for a cut in a channel (and gen channel)'''
+        key = (cutName,chan,genChan)
+        ids = self.incrementIds.get(key)
+        if ids is None:
+            names = [cutName,'/'.join([cutName,chan])]
+            if genChan!='all': names += ['/'.join([cutName,chan,'gen_'+genChan])]
+            ids = tuple([self.__intern(name) for name in names])
+            self.incrementIds[key] = ids
+        return ids
+
     def increment(self,cutName,val,chan,genChan='all'):
         '''Increment all counts'''
         if val!=val:
             logging.warning('{0} {1} {2} attempted to add NaN'.format(cutName,chan,genChan))
-        if cutName not in self.counts:
-            self.counts[cutName] = {'val':0.,'count':0,'err2':0.,}
-        self.counts[cutName]['val'] += val
-        self.counts[cutName]['count'] += 1
-        self.counts[cutName]['err2'] += val**2
-        chanName = '/'.join([cutName,chan])
-        if chanName not in self.counts:
-            self.counts[chanName] = {'val':0.,'count':0,'err2':0.,}
-        self.counts[chanName]['val'] += val
-        self.counts[chanName]['count'] += 1
-        self.counts[chanName]['err2'] += val**2
-        if genChan!='all':
-            genName = '/'.join([cutName,chan,'gen_'+genChan])
-            if genName not in self.counts:
-                self.counts[genName] = {'val':0.,'count':0,'err2':0.,}
-            self.counts[genName]['val'] += val
-            self.counts[genName]['count'] += 1
-            self.counts[genName]['err2'] += val**2
+        ids = self.incrementIds.get((cutName,chan,genChan))
+        if ids is None: ids = self.getKeyIds(cutName,chan,genChan)
+        self.pendingIds.extend(ids)
+        self.pendingWeights.extend([val]*len(ids))
+        if len(self.pendingIds)>=self.maxPending: self.__flushPending()
+
+    def incrementBatch(self,keyIds,weights):
+        '''
+        Increment the counts for a batch of (key id, weight) pairs, with ids from getKeyIds.
+        Lists (e.g. all counts of an event) are buffered, arrays (e.g. of a chunk) are added directly.
+        '''
+        if isinstance(keyIds,list):
+            nan = [i for i,w in zip(keyIds,weights) if w!=w]
+            if nan: logging.warning('{0} attempted to add NaN'.format(' '.join(sorted(set([self.keyNames[i] for i in nan])))))
+            self.pendingIds.extend(keyIds)
+            self.pendingWeights.extend(weights)
+            if len(self.pendingIds)>=self.maxPending: self.__flushPending()
+            return
+        keyIds = np.asarray(keyIds,dtype=np.int64)
+        weights = np.asarray(weights,dtype=np.float64)
+        if np.isnan(weights).any():
+            names = set([self.keyNames[i] for i in keyIds[np.isnan(weights)]])
+            logging.warning('{0} attempted to add NaN'.format(' '.join(sorted(names))))
+        self.__accumulate(keyIds,weights)
 
+    def __accumulate(self,keyIds,weights):
+        if len(keyIds)==0: return
+        n = len(self.keyNames)
+        self.countVals[:n] += np.bincount(keyIds,weights=weights,minlength=n)
+        self.countEntries[:n] += np.bincount(keyIds,minlength=n)
+        self.countErr2[:n] += np.bincount(keyIds,weights=weights**2,minlength=n)
+
+    def __flushPending(self):
+        '''Move the buffered increments into the accumulators'''
+        if not self.pendingIds: return
+        self.__accumulate(np.array(self.pendingIds,dtype=np.int64),np.array(self.pendingWeights,dtype=np.float64))
+        self.pendingIds = []
+        self.pendingWeights = []
+
+    def addCounts(self,names,vals,entries,err2):
+        '''Add already summed counts, e.g. from a worker or a scan after the loop'''
+        if len(names)==0: return
+        ids = np.array([self.__intern(name) for name in names],dtype=np.int64)
+        np.add.at(self.countVals,ids,vals)
+        np.add.at(self.countEntries,ids,entries)
+        np.add.at(self.countErr2,ids,err2)
+
+    def __add(self,name,val,count,err2):
+        i = self.__intern(name)
+        self.countVals[i] += val
+        self.countEntries[i] += count
+        self.countErr2[i] += err2
+
+    def incrementArrays(self,cutName,mask,weight,chan,genChan='all'):
+        '''Increment all counts for the events of a chunk passing the mask'''
+        mask = np.asarray(mask,dtype=bool)
+        n = len(mask)
+        weight = np.asarray(weight,dtype=np.float64)
+        if weight.ndim==0: weight = np.repeat(weight,n)
+        if not mask.any(): return
+        if np.isnan(weight[mask]).any():
+            logging.warning('{0} {1} {2} attempted to add NaN'.format(cutName,chan,genChan))
+        w = weight[mask]
+        self.__add(cutName,float(w.sum()),int(mask.sum()),float((w**2).sum()))
+        for c,cMask in groupColumn(chan,n):
+            w = weight[mask & cMask]
+            if len(w)==0: continue
+            self.__add('/'.join([cutName,c]),float(w.sum()),len(w),float((w**2).sum()))
+            for g,gMask in groupColumn(genChan,n):
+                if g=='all': continue
+                w = weight[mask & cMask & gMask]
+                if len(w)==0: continue
+                self.__add('/'.join([cutName,c,'gen_'+g]),float(w.sum()),len(w),float((w**2).sum()))
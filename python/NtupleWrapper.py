@@ -4,6 +4,9 @@ import sys
 import glob
 import json
 import pickle
+from collections import OrderedDict
+
+import numpy as np
 
 sys.argv.append('-b')
 import ROOT
@@ -13,11 +16,38 @@ ROOT.gROOT.SetBatch(ROOT.kTRUE)
 ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 
 from DevTools.Plotter.xsec import getXsec
+from DevTools.Plotter.MultiDraw import MultiDraw
+from DevTools.Plotter.NtupleIndex import loadNtupleIndex
+from DevTools.Plotter.HistCache import getHistCache, getFileStamp
+from DevTools.Plotter.CountStore import CountStore
+from DevTools.Plotter.arrayUtilities import getContents, getSumw2
+from DevTools.Plotter.parallelUtilities import mapWorkers, splitFiles
 from DevTools.Plotter.utilities import *
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
 
 CMSSW_BASE = os.environ['CMSSW_BASE']
 
+# file handles shared by all wrappers in a process, least recently used are closed first
+openFiles = OrderedDict()
+maxOpenFiles = 500
+
+# handles inherited by a forked process, never closed there
+detachedFiles = []
+
+# only the process that owns the files writes to them, forked readers drop their writes
+writesAllowed = True
+
+def detachOpenFiles():
+    '''
+    Forget the file handles inherited from the parent after a fork, the descriptors share their offsets.
+    The handles are kept alive so they are not closed (and written) by the child, and the child
+    does not write to the files at all so that several processes never update the same file.
+    '''
+    global writesAllowed
+    detachedFiles.extend(openFiles.values())
+    openFiles.clear()
+    writesAllowed = False
+
 class NtupleWrapper(object):
     '''Wrapper for access to ntuples'''
 
@@ -36,6 +66,7 @@ class NtupleWrapper(object):
         if self.useProof: self.ntupleDirectory.replace('-merge','')
         self.inputFileList = kwargs.pop('inputFileList','')
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        self.indexFile = kwargs.pop('indexFile',getNtupleIndexFile(self.analysis,self.sample,shift=self.shift,version=self.version))
         #self.flat = kwargs.pop('flat','flat/{0}/{1}.root'.format(self.analysis,self.sample))
         flat = getNewFlatHistograms if self.new else getFlatHistograms
         proj = getNewProjectionHistograms if self.new else getProjectionHistograms
@@ -43,13 +74,24 @@ class NtupleWrapper(object):
         self.proj = kwargs.pop('proj',proj(self.analysis,self.sample,shift=self.shift,version=self.version))
         self.json = kwargs.pop('json',getSkimJson(self.analysis,self.sample,shift=self.shift,version=self.version))
         self.pickle = kwargs.pop('pickle',getSkimPickle(self.analysis,self.sample,shift=self.shift,version=self.version))
+        self.countStore = kwargs.pop('countStore',getSkimCountStore(self.analysis,self.sample,shift=self.shift,version=self.version))
+        self.partial = kwargs.pop('partial',getPartialHistograms(self.analysis,self.sample,shift=self.shift,version=self.version))
+        self.entryLists = kwargs.pop('entryLists',getEntryListFile(self.analysis,self.sample,shift=self.shift,version=self.version))
+        self.useEntryLists = kwargs.pop('useEntryLists',not self.useProof)
+        self.incremental = kwargs.pop('incremental',False)
+        self.maxPendingWrites = kwargs.pop('maxPendingWrites',1000)
+        self.ncores = kwargs.pop('ncores',1)
+        self.lazyProjections = kwargs.pop('lazyProjections',False)
+        self.persistProjections = kwargs.pop('persistProjections',False)
+        projectionCacheSize = kwargs.pop('projectionCacheSize',0) # MB, projections are cached in the shared histogram cache
+        if projectionCacheSize: getHistCache().setBudget(projectionCacheSize*1024*1024)
         self.skimInitialized = False
         # get stuff needed to flatten
         self.histParams = getHistParams(self.analysis,self.sample,shift=self.shift,version=self.version,**kwargs)
         self.selections = getHistSelections(self.analysis,self.sample,shift=self.shift,version=self.version,**kwargs)
         self.projections = getProjectionParams(self.analysis,self.sample,shift=self.shift,version=self.version,**kwargs)
-        self.infile = 0
-        self.outfile = 0
+        self.pendingWrites = {}
+        self.nPending = 0
         self.j = 0
         self.initialized = False
         self.temp = True
@@ -58,22 +100,94 @@ class NtupleWrapper(object):
         # verify output file directory exists
         os.system('mkdir -p {0}'.format(os.path.dirname(self.flat)))
         os.system('mkdir -p {0}'.format(os.path.dirname(self.proj)))
+        if self.incremental: os.system('mkdir -p {0}'.format(os.path.dirname(self.partial)))
+        if self.useEntryLists: os.system('mkdir -p {0}'.format(os.path.dirname(self.entryLists)))
         self.entryListMap = {}
+        self.declared = None
+
+    def __enter__(self):
+        return self
 
     def __exit__(self, type, value, traceback):
-        self.__finish()
+        self.close()
 
     def __del__(self):
-        self.__finish()
+        try:
+            self.close()
+        except:
+            pass
 
     def __finish(self):
-        if self.infile:
-            self.infile.Close()
-        if self.outfile:
-            self.outfile.Close()
+        if self.nPending>=self.maxPendingWrites: self.flush()
+
+    def __getFile(self,filename,mode='read'):
+        '''Get a cached file handle, reopened in update mode if we need to write.'''
+        tfile, fileMode = openFiles.pop(filename,(None,''))
+        if tfile and (mode=='read' or fileMode=='update'):
+            openFiles[filename] = (tfile,fileMode)
+            return tfile
+        if tfile: tfile.Close()
+        if mode=='read' and not os.path.isfile(filename): return None
+        while len(openFiles)>=maxOpenFiles:
+            oldname, (oldfile, oldmode) = openFiles.popitem(last=False)
+            oldfile.Close()
+        tfile = ROOT.TFile.Open(filename,mode)
+        ROOT.gROOT.cd() # dont let new objects end up in the file
+        if not tfile or tfile.IsZombie():
+            logging.error('Failed to open {0}'.format(filename))
+            return None
+        openFiles[filename] = (tfile,mode)
+        return tfile
+
+    def __getObject(self,filename,name):
+        '''Get an object from the pending writes or the file.'''
+        components = name.split('/')
+        key = ('/'.join(components[:-1]),components[-1])
+        if key in self.pendingWrites.get(filename,{}): return self.pendingWrites[filename][key]
+        tfile = self.__getFile(filename)
+        if not tfile: return None
+        return tfile.Get(name)
+
+    def __bufferWrite(self,filename,obj,directory=''):
+        '''Buffer an object to be written to a file'''
+        obj = obj.Clone(obj.GetName())
+        if hasattr(obj,'SetDirectory'): obj.SetDirectory(0)
+        if filename not in self.pendingWrites: self.pendingWrites[filename] = {}
+        key = (directory,obj.GetName())
+        if key not in self.pendingWrites[filename]: self.nPending += 1
+        self.pendingWrites[filename][key] = obj
+
+    def flush(self):
+        '''Commit all buffered writes.'''
+        if not writesAllowed and self.nPending:
+            logging.debug('Dropping {0} writes in a forked reader'.format(self.nPending))
+            self.pendingWrites = {}
+            self.nPending = 0
+            return
+        for filename in sorted(self.pendingWrites):
+            if not self.pendingWrites[filename]: continue
+            tfile = self.__getFile(filename,'update')
+            if not tfile: continue
+            for directory, name in sorted(self.pendingWrites[filename]):
+                obj = self.pendingWrites[filename][(directory,name)]
+                if directory and not tfile.GetDirectory(directory): tfile.mkdir(directory)
+                tfile.cd('{0}:/{1}'.format(filename,directory))
+                obj.Write('',ROOT.TObject.kOverwrite)
+            tfile.Flush()
+            logging.debug('Wrote {0} objects to {1}'.format(len(self.pendingWrites[filename]),filename))
+        self.pendingWrites = {}
+        self.nPending = 0
+        ROOT.gROOT.cd()
+
+    def close(self):
+        '''Commit buffered writes and close the files of this sample.'''
+        self.flush()
+        for filename in [self.flat,self.proj,self.entryLists,self.partial]:
+            tfile, mode = openFiles.pop(filename,(None,''))
+            if tfile: tfile.Close()
+        ROOT.gROOT.cd()
 
     def __initializeNtuple(self):
-        tchain = ROOT.TChain(self.treeName)
         if self.inputFileList: # reading from a passed list of inputfiles
             allFiles = []
             with open(self.inputFileList,'r') as f:
@@ -84,26 +198,23 @@ class NtupleWrapper(object):
         #elif os.path.isfile(self.ntuple): # reading a single root file
         #    allFiles = [self.ntuple]
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        index = loadNtupleIndex(self.indexFile,self.treeName)
+        index.update(allFiles)
+        summedWeights = index.getSummedWeights(allFiles)
+        tchain = index.makeChain(allFiles)
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
         if not self.xsec: logging.error('No xsec for sample {0}'.format(self.sample))
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
-        self.j += 1
-        #listname = 'selList{0}'.format(self.j)
-        #self.sampleTree.Draw('>>{0}'.format(listname),'1','entrylist')
-        #skim = ROOT.gDirectory.Get(listname)
-        #self.entryListMap['1'] = skim
         self.files = allFiles
+        self.index = index
+        # entry lists are only valid for the current set of files
+        self.entryListKey = 'f{0}'.format(hashString(*['{0}:{1}'.format(f,index.getFingerprint(f)) for f in sorted(self.files)]))
         self.initialized = True
-        if not self.temp: self.fileHash = hashFile(*self.files)
+        # fingerprint from the file metadata, rather than reading every byte
+        if not self.temp: self.fileHash = hashString(*[index.getFingerprint(f) for f in sorted(self.files)])
         if self.useProof: self.sampleTree.SetProof()
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
@@ -121,47 +232,34 @@ class NtupleWrapper(object):
 
     def __write(self,hist,directory=''):
         if self.temp: return
-        self.outfile = ROOT.TFile(self.flat,'update')
-        if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-        self.outfile.cd('{0}:/{1}'.format(self.flat,directory))
-        hist.Write('',ROOT.TObject.kOverwrite)
-        self.outfile.Close()
+        self.__bufferWrite(self.flat,hist,directory)
 
-    def __writeProjection(self,hist,directory=''):
-        if self.temp: return
-        self.outfile = ROOT.TFile(self.proj,'update')
-        if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-        self.outfile.cd('{0}:/{1}'.format(self.proj,directory))
-        hist.Write('',ROOT.TObject.kOverwrite)
-        self.outfile.Close()
+    def __isDeclared(self,variable):
+        '''Check if a histogram was declared by the flattener that wrote the flat file'''
+        if self.declared is None:
+            declared = self.__getObject(self.flat,'declaredHistograms')
+            self.declared = set(declared.GetString().Data().split('\n')) if declared else set()
+        return variable in self.declared
 
     def __read(self,variable):
         '''Read the histogram from file'''
         # attempt to read
-        if os.path.isfile(self.proj):
-            infile = ROOT.TFile(self.proj,'read')
-            hist = infile.Get(variable)
+        for filename in [self.proj,self.flat]:
+            hist = self.__getObject(filename,variable)
             if hist:
                 self.j += 1
                 hist = hist.Clone('h_{0}_{1}_{2}'.format(self.sample,variable.replace('/','_'),self.j))
                 if hist.InheritsFrom('RooDataSet'): return hist
                 hist.SetDirectory(0)
                 return hist
-        if os.path.isfile(self.flat):
-            infile = ROOT.TFile(self.flat,'read')
-            hist = infile.Get(variable)
-            if hist:
-                self.j += 1
-                hist = hist.Clone('h_{0}_{1}_{2}'.format(self.sample,variable.replace('/','_'),self.j))
-                hist.SetDirectory(0)
-                if hist.InheritsFrom('RooDataSet'): return hist
-                return hist
-            # attempt to project
-            #hist = self.__projectChannel(variable,temp=True)
-            #if hist:
-            #    hist = hist.Clone('h_{0}_{1}'.format(self.sample,variable.replace('/','_')))
-            #    hist.SetDirectory(0)
-            #    return hist
+        # histograms never filled are not written by the flattener, use an empty copy of the template
+        template = self.__getObject(self.flat,'templates/{0}'.format(variable.split('/')[-1])) if self.__isDeclared(variable) else None
+        if template and not template.InheritsFrom('RooDataSet'):
+            self.j += 1
+            hist = template.Clone('h_{0}_{1}_{2}'.format(self.sample,variable.replace('/','_'),self.j))
+            hist.Reset()
+            hist.SetDirectory(0)
+            return hist
         logging.debug('Histogram {0} not found for {1}'.format(variable,self.sample))
         return 0
 
@@ -169,57 +267,39 @@ class NtupleWrapper(object):
         'Check the hash for a sample'''
         if self.temp: return False
         if not self.initialized: self.__initializeNtuple()
-        self.outfile = ROOT.TFile(self.flat,'update')
         hashDirectory = 'hash/{0}'.format(directory)
-        hashObj = self.outfile.Get('{0}/{1}'.format(hashDirectory,name))
-        if not hashObj:
-            hashObj = ROOT.TNamed(name,'')
-        oldHash = hashObj.GetTitle()
+        hashObj = self.__getObject(self.flat,'{0}/{1}'.format(hashDirectory,name))
+        oldHash = hashObj.GetTitle() if hashObj else ''
         newHash = self.fileHash + hashString(*strings)
         if oldHash==newHash:
-            self.outfile.Close()
             return True
         else:
-            hashObj.SetTitle(newHash)
-            if not self.outfile.GetDirectory(hashDirectory): self.outfile.mkdir(hashDirectory)
-            self.outfile.cd('{0}:/{1}'.format(self.flat,hashDirectory))
-            hashObj.Write('',ROOT.TObject.kOverwrite)
-            self.outfile.Close()
+            self.__bufferWrite(self.flat,ROOT.TNamed(name,newHash),hashDirectory)
             return False
 
-    def __checkProjectionHash(self,name,directory,channel='',genchannel=''):
+    def __getFlatHash(self,name,directory):
+        '''Hash of a flat histogram, empty if it was not flattened with a hash.'''
+        hashObj = self.__getObject(self.flat,'hash/{0}/{1}'.format(directory,name))
+        return hashObj.GetTitle() if hashObj else ''
+
+    def __checkProjectionHash(self,name,directory,channel='',genchannel='',update=True):
         '''Check hash of projection from histogram.'''
-        return False
-        if self.temp: return False
-        self.infile = ROOT.TFile(self.flat,'read')
-        self.outfile = ROOT.TFile(self.proj,'update')
-        flatHashDirectory = 'hash/{0}'.format(directory)
+        newHash = self.__getFlatHash(name,directory)
+        if not newHash: return False
         projHashDirectory = 'hash/{0}'.format('/'.join([x for x in [directory,channel,genchannel] if x]))
-        flatHashObj = self.infile.Get('{0}/{1}'.format(flatHashDirectory,name))
-        projHashObj = self.outfile.Get('{0}/{1}'.format(projHashDirectory,name))
-        if not projHashObj:
-            projHashObj = ROOT.TNamed(name,'')
-        newHash = flatHashObj.GetTitle()
-        oldHash = projHashObj.GetTitle()
+        projHashObj = self.__getObject(self.proj,'{0}/{1}'.format(projHashDirectory,name))
+        oldHash = projHashObj.GetTitle() if projHashObj else ''
         if oldHash==newHash:
-            self.outfile.Close()
             return True
         else:
-            projHashObj.SetTitle(newHash)
-            if not self.outfile.GetDirectory(projHashDirectory): self.outfile.mkdir(projHashDirectory)
-            self.outfile.cd('{0}:/{1}'.format(self.proj,projHashDirectory))
-            projHashObj.Write('',ROOT.TObject.kOverwrite)
-            self.outfile.Close()
+            if update: self.__bufferWrite(self.proj,ROOT.TNamed(name,newHash),projHashDirectory)
             return False
 
-    def __flatten(self,directory,histName,selection,params,**kwargs):
-        '''Produce flat histograms for a given selection.'''
+    def __prepareFlatten(self,directory,histName,selection,params,**kwargs):
+        '''Build the full selection and scalefactor for a flat histogram, None if it is up to date.'''
         # only flatten specified hists
         allowed = kwargs.pop('hists',[])
-        if allowed and histName not in allowed: return False
-        # clear old
-        ROOT.gDirectory.Delete('h_*')
-        ROOT.gDirectory.Delete(histName)
+        if allowed and histName not in allowed: return None
         # selections
         mccut = kwargs.pop('mccut','')
         datacut = kwargs.pop('datacut','')
@@ -240,14 +320,25 @@ class NtupleWrapper(object):
         if 'datascale' in params and isData(self.sample): scalefactor += '*{0}'.format(params['datascale'])
         # check if we need to draw the hist, or if the one in the ntuple is the latest
         if 'zVariable' in params: # 3D
-             hashExists = self.__checkHash(histName,directory,strings=[params['zVariable'],params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']+params['zBinning']]),scalefactor,selection])
+             strings = [params['zVariable'],params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']+params['zBinning']]),scalefactor,selection]
         elif 'yVariable' in params: # 2D
-             hashExists = self.__checkHash(histName,directory,strings=[params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']]),scalefactor,selection])
+             strings = [params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']]),scalefactor,selection]
         else: # 1D
-             hashExists = self.__checkHash(histName,directory,strings=[params['xVariable'],', '.join([str(x) for x in params['xBinning']]),scalefactor,selection])
+             strings = [params['xVariable'],', '.join([str(x) for x in params['xBinning']]),scalefactor,selection]
+        hashExists = self.__checkHash(histName,directory,strings=strings)
         if hashExists:
             self.__finish()
-            return False
+            return None
+        return selection, scalefactor, hashString(*strings)
+
+    def __flatten(self,directory,histName,selection,params,**kwargs):
+        '''Produce flat histograms for a given selection.'''
+        # clear old
+        ROOT.gDirectory.Delete('h_*')
+        ROOT.gDirectory.Delete(histName)
+        prepared = self.__prepareFlatten(directory,histName,selection,params,**kwargs)
+        if not prepared: return False
+        selection, scalefactor, jobHash = prepared
         # get the histogram
         name = histName
         self.j += 1
@@ -264,36 +355,79 @@ class NtupleWrapper(object):
         self.__write(hist,directory=directory)
         return True
 
+    def __getLumiScale(self):
+        '''Scale to normalize MC to the integrated luminosity.'''
+        if not self.initialized: self.__initializeNtuple()
+        if isData(self.sample): return 1.
+        return float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+
+    def __getLumiScaleFactor(self,scalefactor):
+        '''Normalize MC to the integrated luminosity.'''
+        if isData(self.sample): return scalefactor
+        return '{0}*{1}'.format(scalefactor,self.__getLumiScale()) if self.sampleLumi else '0'
+
+    def __getEntryList(self,selection):
+        '''
+        Get the entries passing a selection, None if all entries pass.
+        Lists are stored per sample and set of files, and a new list starts from the
+        entries of the largest known list whose cuts are a subset of the selection.
+        '''
+        if not self.useEntryLists: return None
+        if not self.initialized: self.__initializeNtuple()
+        terms = tuple(splitSelection(selection))
+        if not terms: return None
+        if terms in self.entryListMap: return self.entryListMap[terms]
+        name = 'el_{0}'.format(hashString(*terms))
+        entryList = self.__getObject(self.entryLists,'{0}/{1}'.format(self.entryListKey,name))
+        if entryList:
+            self.j += 1
+            entryList = entryList.Clone('selList{0}'.format(self.j))
+            entryList.SetDirectory(0)
+        else:
+            parentTerms = ()
+            for cached in self.entryListMap:
+                if len(cached)>len(parentTerms) and set(cached)<set(terms): parentTerms = cached
+            parent = self.entryListMap[parentTerms] if parentTerms else None
+            remaining = [t for t in terms if t not in parentTerms]
+            cut = ' && '.join(['({0})'.format(t) for t in remaining])
+            logging.debug('Entry list {0} from {1} entries'.format(cut,parent.GetN() if parent else 'all'))
+            self.j += 1
+            listname = 'selList{0}'.format(self.j)
+            tree = self.sampleTree
+            if parent is not None: tree.SetEntryList(parent)
+            tree.Draw('>>{0}'.format(listname),cut,'entrylist')
+            if parent is not None: tree.SetEntryList(0)
+            entryList = ROOT.gDirectory.Get(listname)
+            if not entryList: return None
+            entryList.SetDirectory(0)
+            entryList.SetName(name)
+            self.__bufferWrite(self.entryLists,entryList,self.entryListKey)
+            self.__finish()
+        self.entryListMap[terms] = entryList
+        return entryList
+
+    def __draw(self,tree,drawString,selection,scalefactor):
+        '''Draw only the entries passing the selection, False if there are none'''
+        entryList = self.__getEntryList(selection)
+        if entryList is not None and entryList.GetN()==0: return False
+        selectionString = '{0}*({1})'.format(scalefactor,selection)
+        logging.debug('drawString: {0}'.format(drawString))
+        logging.debug('selectionString: {0}'.format(selectionString))
+        if entryList is not None: tree.SetEntryList(entryList)
+        tree.Draw(drawString,selectionString,'goff')
+        if entryList is not None: tree.SetEntryList(0)
+        return True
+
     def __getHist1D(self,histName,selection,scalefactor,xVariable,xBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__getLumiScaleFactor(scalefactor)
         binning = xBinning
         tree = self.sampleTree
         if not tree: 
             hist = ROOT.TH1D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH1D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH1D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
         drawString = '{0}>>{1}({2})'.format(xVariable,histName,', '.join([str(x) for x in binning]))
-        selectionString = '{0}*({1})'.format(scalefactor,selection)
-        #selectionString = '{0}*(1)'.format(scalefactor)
-        logging.debug('drawString: {0}'.format(drawString))
-        logging.debug('selectionString: {0}'.format(selectionString))
-        tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        self.__draw(tree,drawString,selection,scalefactor)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -305,34 +439,14 @@ class NtupleWrapper(object):
 
     def __getHist2D(self,histName,selection,scalefactor,xVariable,yVariable,xBinning,yBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__getLumiScaleFactor(scalefactor)
         binning = xBinning+yBinning
         tree = self.sampleTree
         if not tree:
             hist = ROOT.TH2D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH2D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH2D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
         drawString = '{0}:{1}>>{2}({3})'.format(yVariable,xVariable,histName,', '.join([str(x) for x in binning]))
-        selectionString = '{0}*({1})'.format(scalefactor,selection)
-        #selectionString = '{0}*(1)'.format(scalefactor)
-        logging.debug('drawString: {0}'.format(drawString))
-        logging.debug('selectionString: {0}'.format(selectionString))
-        tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        self.__draw(tree,drawString,selection,scalefactor)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -344,34 +458,14 @@ class NtupleWrapper(object):
 
     def __getHist3D(self,histName,selection,scalefactor,xVariable,yVariable,zVariable,xBinning,yBinning,zBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__getLumiScaleFactor(scalefactor)
         binning = xBinning+yBinning+zBinning
         tree = self.sampleTree
         if not tree:
             hist = ROOT.TH3D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH3D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH3D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
         drawString = '{0}:{1}:{2}>>{3}({4})'.format(zVariable,yVariable,xVariable,histName,', '.join([str(x) for x in binning]))
-        selectionString = '{0}*({1})'.format(scalefactor,selection)
-        #selectionString = '{0}*(1)'.format(scalefactor)
-        logging.debug('drawString: {0}'.format(drawString))
-        logging.debug('selectionString: {0}'.format(selectionString))
-        tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        self.__draw(tree,drawString,selection,scalefactor)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -381,161 +475,82 @@ class NtupleWrapper(object):
             hist = ROOT.TH3D(histName,histName,*binning)
         return hist
 
-    def __project(self,histName,directory,hist2d,direction,binLabels=[],binRange=[0,-1],temp=False):
-        '''Project a 2D histogram onto a 1D histogram.'''
-        hists = ROOT.TList()
-        if direction=='x':
-            binning = [
-                hist2d.GetXaxis().GetNbins(),
-                hist2d.GetXaxis().GetXmin(),
-                hist2d.GetXaxis().GetXmax(),
-            ]
-        else:
-            binning = [
-                hist2d.GetYaxis().GetNbins(),
-                hist2d.GetYaxis().GetXmin(),
-                hist2d.GetYaxis().GetXmax(),
-            ]
-        if binLabels:
-            for label in binLabels:
-                self.j += 1
-                name = 'h_{0}_{1}_{2}'.format(histName,label,self.j)
-                if direction=='x':
-                    binNum = hist2d.GetYaxis().FindBin(label)
-                    hist2d.ProjectionX(name,binNum,binNum,'e')
-                else:
-                    binNum = hist2d.GetXaxis().FindBin(label)
-                    hist2d.ProjectionY(name,binNum,binNum,'e')
-                if ROOT.gDirectory.Get(name):
-                    hist = ROOT.gDirectory.Get(name)
-                    if hist: hists.Add(hist)
-        else:
-            self.j += 1
-            name = 'h_{0}_{1}'.format(histName,self.j)
-            if direction=='x':
-                hist2d.ProjectionX(name,binRange[0],binRange[1],'e')
-            else:
-                hist2d.ProjectionY(name,binRange[0],binRange[1],'e')
-            if ROOT.gDirectory.Get(name):
-                hist = ROOT.gDirectory.Get(name)
-                hists.Add(hist)
-        if hists.IsEmpty():
-            hist = ROOT.TH1D(histName,histName,*binning)
-        else:
-            self.j += 1
-            hist = hists[0].Clone('h_temp_{0}_{1}'.format(histName,self.j))
-            hist.Reset()
-            hist.Merge(hists)
-            hist.SetName(histName)
-            hist.SetTitle(histName)
-        if not temp: self.__writeProjection(hist,directory=directory)
-        return hist
-
-    def __projectFrom3D(self,histName,directory,hist3d,direction,binLabels1=[],binLabels2=[],binRange1=[0,-1],binRange2=[0,-1],temp=False):
-        '''Project a 3D histogram onto a 1D histogram.'''
-        hists = ROOT.TList()
-        if direction=='x':
-            binning = [
-                hist3d.GetXaxis().GetNbins(),
-                hist3d.GetXaxis().GetXmin(),
-                hist3d.GetXaxis().GetXmax(),
-            ]
-        elif direction=='y':
-            binning = [
-                hist3d.GetYaxis().GetNbins(),
-                hist3d.GetYaxis().GetXmin(),
-                hist3d.GetYaxis().GetXmax(),
-            ]
-        else:
-            binning = [
-                hist3d.GetZaxis().GetNbins(),
-                hist3d.GetZaxis().GetXmin(),
-                hist3d.GetZaxis().GetXmax(),
-            ]
-        if binLabels1 and binLabels2:
-            for label1 in binLabels1:
-                for label2 in binLabels2:
-                    self.j += 1
-                    name = 'h_{0}_{1}_{2}_{3}'.format(histName,label1,label2,self.j)
-                    if direction=='x':
-                        binNum1 = hist3d.GetYaxis().FindBin(label1)
-                        binNum2 = hist3d.GetZaxis().FindBin(label2)
-                        hist3d.ProjectionX(name,binNum1,binNum1,binNum2,binNum2,'e')
-                    elif direction=='y':
-                        binNum1 = hist3d.GetXaxis().FindBin(label1)
-                        binNum2 = hist3d.GetZaxis().FindBin(label2)
-                        hist3d.ProjectionY(name,binNum1,binNum1,binNum2,binNum2,'e')
-                    else:
-                        binNum1 = hist3d.GetXaxis().FindBin(label1)
-                        binNum2 = hist3d.GetYaxis().FindBin(label2)
-                        hist3d.ProjectionZ(name,binNum1,binNum1,binNum2,binNum2,'e')
-                    if ROOT.gDirectory.Get(name):
-                        hist = ROOT.gDirectory.Get(name)
-                        if hist: hists.Add(hist)
-        elif binLabels1 and not binLabels2:
-            for label1 in binLabels1:
-                self.j += 1
-                name = 'h_{0}_{1}_{2}'.format(histName,label1,self.j)
-                if direction=='x':
-                    binNum1 = hist3d.GetYaxis().FindBin(label1)
-                    hist3d.ProjectionX(name,binNum1,binNum1,binRange2[0],binRange2[1],'e')
-                elif direction=='y':
-                    binNum1 = hist3d.GetXaxis().FindBin(label1)
-                    hist3d.ProjectionY(name,binNum1,binNum1,binRange2[0],binRange2[1],'e')
-                else:
-                    binNum1 = hist3d.GetXaxis().FindBin(label1)
-                    hist3d.ProjectionZ(name,binNum1,binNum1,binRange2[0],binRange2[1],'e')
-                if ROOT.gDirectory.Get(name):
-                    hist = ROOT.gDirectory.Get(name)
-                    if hist: hists.Add(hist)
-        elif not binLabels1 and binLabels2:
-            for label2 in binLabels2:
-                self.j += 1
-                name = 'h_{0}_{1}_{2}'.format(histName,label2,self.j)
-                if direction=='x':
-                    binNum2 = hist3d.GetZaxis().FindBin(label2)
-                    hist3d.ProjectionX(name,binRange1[0],bingRange1[1],binNum2,binNum2,'e')
-                elif direction=='y':
-                    binNum2 = hist3d.GetZaxis().FindBin(label2)
-                    hist3d.ProjectionY(name,binRange1[0],bingRange1[1],binNum2,binNum2,'e')
-                else:
-                    binNum2 = hist3d.GetYaxis().FindBin(label2)
-                    hist3d.ProjectionZ(name,binRange1[0],bingRange1[1],binNum2,binNum2,'e')
-                if ROOT.gDirectory.Get(name):
-                    hist = ROOT.gDirectory.Get(name)
-                    if hist: hists.Add(hist)
-        else:
-            self.j += 1
-            name = 'h_{0}_{1}'.format(histName,self.j)
-            if direction=='x':
-                hist3d.ProjectionX(name,binRange1[0],binRange1[1],binRange2[0],binRange2[1],'e')
-            elif direction=='y':
-                hist3d.ProjectionY(name,binRange1[0],binRange1[1],binRange2[0],binRange2[1],'e')
-            else:
-                hist3d.ProjectionZ(name,binRange1[0],binRange1[1],binRange2[0],binRange2[1],'e')
-            if ROOT.gDirectory.Get(name):
-                hist = ROOT.gDirectory.Get(name)
-                hists.Add(hist)
-        if hists.IsEmpty():
-            hist = ROOT.TH1D(histName,histName,*binning)
+    def __getLabelBins(self,axis,labels):
+        '''Bin numbers of the labels on an axis, all bins (including under/overflow) if there are no labels'''
+        if not labels: return slice(None)
+        binMap = {}
+        for b in range(1,axis.GetNbins()+1):
+            binMap[axis.GetBinLabel(b)] = b
+        missing = [label for label in labels if label not in binMap]
+        if missing: logging.debug('Labels {0} not found on axis of {1}'.format(missing,self.sample))
+        return np.array([binMap[label] for label in labels if label in binMap],dtype=np.int64)
+
+    def __newProjection(self,histName,axis):
+        '''Create an empty 1D histogram with the binning of an axis'''
+        self.j += 1
+        name = 'h_proj_{0}_{1}'.format(histName,self.j)
+        edges = axis.GetXbins()
+        if edges.GetSize():
+            hist = ROOT.TH1D(name,name,axis.GetNbins(),edges.GetArray())
         else:
-            self.j += 1
-            hist = hists[0].Clone('h_temp_{0}_{1}'.format(histName,self.j))
-            hist.Reset()
-            hist.Merge(hists)
-            hist.SetName(histName)
-            hist.SetTitle(histName)
-        if not temp: self.__writeProjection(hist,directory=directory)
+            hist = ROOT.TH1D(name,name,axis.GetNbins(),axis.GetXmin(),axis.GetXmax())
+        hist.SetDirectory(0)
+        hist.Sumw2()
+        hist.SetName(histName)
+        hist.SetTitle(histName)
         return hist
 
-    def __projectChannel(self,variable,temp=False):
-        '''Project down the 2D channels plot to the desired channels.'''
+    def __projectChannels(self,selectionName,histName,channels,temp=False):
+        '''
+        Project the 2D/3D histogram of a selection onto x for a list of (channel, genchannel).
+        The histogram is read once and each projection is a sum of its contents over the bins
+        of the channel labels on y (and genchannel labels on z). An empty channel or genchannel
+        keeps all bins of that axis. Returns a dictionary of the projections.
+        '''
+        histNd = self.__read('/'.join([selectionName,histName]))
+        if not histNd: return {}
+        is3D = histNd.InheritsFrom('TH3')
+        if not is3D and not histNd.InheritsFrom('TH2'): # its a 1d histogram
+            return dict([(key,histNd) for key in channels])
+        xaxis = histNd.GetXaxis()
+        yaxis = histNd.GetYaxis()
+        zaxis = histNd.GetZaxis()
+        shape = (zaxis.GetNbins()+2 if is3D else 1, yaxis.GetNbins()+2, xaxis.GetNbins()+2)
+        contents = getContents(histNd).astype(np.float64).reshape(shape)
+        sumw2 = getSumw2(histNd).reshape(shape)
+        # sum over the genchannel bins once, shared by all channels
+        zsums = {}
+        hists = {}
+        for channel, genchannel in channels:
+            if genchannel and not is3D: continue
+            if genchannel not in zsums:
+                zbins = self.__getLabelBins(zaxis,self.projections[genchannel]) if genchannel else slice(None)
+                zsums[genchannel] = (contents[zbins].sum(axis=0), sumw2[zbins].sum(axis=0))
+            zval, zerr2 = zsums[genchannel]
+            ybins = self.__getLabelBins(yaxis,self.projections[channel]) if channel else slice(None)
+            hist = self.__newProjection(histName,xaxis)
+            getContents(hist)[:] = zval[ybins].sum(axis=0)
+            getSumw2(hist)[:] = zerr2[ybins].sum(axis=0)
+            hist.ResetStats()
+            if not temp:
+                directory = '/'.join([x for x in [selectionName,channel,genchannel] if x])
+                self.__bufferWrite(self.proj,hist,directory)
+                self.__checkProjectionHash(histName,selectionName,channel=channel,genchannel=genchannel)
+            hists[(channel,genchannel)] = hist
+        return hists
+
+    def __parseProjection(self,variable):
+        '''Split a histogram path into selection, histogram, channel and genchannel.'''
         components = variable.split('/')
         histName = components[-1]
         if len(components)>2 and components[-2] in self.projections and components[-3] in self.projections: # explicit channel/genchannel
             selectionName = '/'.join(components[:-3])
             genchannel = components[-2]
             channel = components[-3]
+        elif len(components)>1 and components[-2] in self.projections and 'gen' in components[-2]: # explicit genchannel
+            selectionName = '/'.join(components[:-2])
+            genchannel = components[-2]
+            channel = ''
         elif len(components)>1 and components[-2] in self.projections: # explicit channel
             selectionName = '/'.join(components[:-2])
             genchannel = ''
@@ -544,46 +559,54 @@ class NtupleWrapper(object):
             selectionName = '/'.join(components[:-1])
             genchannel = ''
             channel = 'all'
+        return selectionName, histName, channel, genchannel
+
+    def __projectChannel(self,variable,temp=False):
+        '''Project down the 2D channels plot to the desired channels.'''
+        selectionName, histName, channel, genchannel = self.__parseProjection(variable)
         if histName not in self.histParams:
             logging.error('Unrecognized histogram {0}'.format(histName))
             return 0
         if selectionName not in self.selections:
             logging.error('Unrecognized selection {0}'.format(selectionName))
             return 0
-        # check if we need to project
-        #passHash = self.__checkProjectionHash(histName,selectionName,channel=channel,genchannel=genchannel)
-        #if passHash: return 0
-        # not project
-        histNameND = '/'.join([selectionName,histName])
-        histNd = self.__read(histNameND)
-        if histNd and histNd.InheritsFrom('TH3'):
-            if genchannel:
-                directory = '/'.join([selectionName,channel,genchannel])
-                hist = self.__projectFrom3D(histName,directory,histNd,'x',binLabels1=self.projections[channel],binLabels2=self.projections[genchannel],temp=temp)
-            else:
-                directory = '/'.join([selectionName,channel])
-                hist = self.__projectFrom3D(histName,directory,histNd,'x',binLabels1=self.projections[channel],temp=temp)
-        elif histNd and histNd.InheritsFrom('TH2'):
-            directory = '/'.join([selectionName,channel])
-            hist = self.__project(histName,directory,histNd,'x',binLabels=self.projections[channel],temp=temp)
-        elif histNd and histNd.InheritsFrom('TH1'): # its a 1d histogram
-            hist = histNd
-        else: # not a hist
-            hist = 0
-        return hist
+        hists = self.__projectChannels(selectionName,histName,[(channel,genchannel)],temp=temp or self.temp)
+        return hists.get((channel,genchannel),0)
+
+    def __getProjection(self,variable):
+        '''
+        Get a channel projection, projecting from the N-D histogram the first time it is requested.
+        Projections can be kept in the projection file, tied to the hash of the flat histogram so that
+        they are redone when it changes. In memory they are cached by the reader (the Plotter histogram cache).
+        '''
+        selectionName, histName, channel, genchannel = self.__parseProjection(variable)
+        if histName not in self.histParams or selectionName not in self.selections: return 0
+        flatHash = self.__getFlatHash(histName,selectionName)
+        if not flatHash: return 0
+        directory = '/'.join([x for x in [selectionName,channel,genchannel] if x])
+        if self.__checkProjectionHash(histName,selectionName,channel=channel,genchannel=genchannel,update=False):
+            hist = self.__read('/'.join([directory,histName]))
+            if hist: return hist
+        hists = self.__projectChannels(selectionName,histName,[(channel,genchannel)],temp=not self.persistProjections)
+        self.__finish()
+        return hists.get((channel,genchannel),0)
 
     def __readSkim(self,directory):
         '''Read a value from the skim file.'''
         if not self.skimInitialized:
-            with open(self.pickle,'rb') as f:
-                self.skim = pickle.load(f)
+            if os.path.isfile(self.countStore):
+                self.skim = CountStore(self.countStore)
+            else: # skims from before the count store
+                with open(self.pickle,'rb') as f:
+                    self.skim = pickle.load(f)
             self.skimInitialized = True
         components = directory.split('/')
         if components[-1] == 'all': components = components[:-1]
         # first try finding
         key = '/'.join(components)
-        if key in self.skim:
-            return self.skim[key]['val'], self.skim[key]['err2']**0.5
+        count = self.skim.get(key)
+        if count is not None:
+            return count['val'], count['err2']**0.5
         #logging.warning('Unrecognized selection {0}'.format(directory))
         return 0.,0.
 
@@ -593,7 +616,10 @@ class NtupleWrapper(object):
         return hist
 
     def getHist(self,variable):
-        '''Get a histogram'''
+        '''Get a histogram, with lazyProjections channels are projected on first use'''
+        if self.lazyProjections:
+            hist = self.__getProjection(variable)
+            if hist: return hist
         hist = self.__read(variable)
         if hist and hist.InheritsFrom('TH3'): # 3D, project down on x
             return self.__projectChannel(variable)
@@ -602,6 +628,18 @@ class NtupleWrapper(object):
         else:
             return hist
 
+    def getFingerprint(self,variable):
+        '''
+        Fingerprint of the input of a histogram, changing when it is flattened again.
+        The hash of the flat histogram if it has one, otherwise the modification times of the inputs.
+        '''
+        selectionName, histName, channel, genchannel = self.__parseProjection(variable)
+        flatHash = ''
+        if histName in self.histParams and selectionName in self.selections:
+            flatHash = self.__getFlatHash(histName,selectionName)
+        if flatHash: return [self.flat,variable,flatHash]
+        return [self.flat,variable,getFileStamp(self.flat,self.proj,self.countStore,self.indexFile)]
+
     def getDataset(self,variable,weight='w',selection='1',xRange=[],yRange=[]):
         '''Get a RooDataSet'''
         ds = self.__read(variable)
@@ -638,6 +676,40 @@ class NtupleWrapper(object):
         hist.SetTitle('count')
         return hist
 
+    def getTempCounts(self,cuts):
+        '''
+        Get the weighted counts and statistical errors for a list of (selection, scalefactor)
+        in a single pass over the ntuple.
+        '''
+        if not self.initialized: self.__initializeNtuple()
+        hists = []
+        for selection, scalefactor in cuts:
+            self.j += 1
+            tempname = 'count_{0}_{1}_{2}'.format(self.analysis,self.sample,self.j)
+            hists += [ROOT.TH1D(tempname,'count',1,0,2)]
+        if self.sampleTree and hists:
+            # only loop over the entries passing the cuts common to all selections
+            common = set.intersection(*[set(splitSelection(selection)) for selection, scalefactor in cuts])
+            entryList = self.__getEntryList(' && '.join(['({0})'.format(t) for t in sorted(common)])) if common else None
+            if entryList is not None and entryList.GetN()==0: return [(0.,0.) for hist in hists]
+            multiDraw = MultiDraw(self.sampleTree)
+            for hist, (selection, scalefactor) in zip(hists,cuts):
+                multiDraw.add(hist,selection,self.__getLumiScaleFactor(scalefactor),'1')
+            if entryList is not None: self.sampleTree.SetEntryList(entryList)
+            multiDraw.fill()
+            if entryList is not None: self.sampleTree.SetEntryList(0)
+        return [(hist.GetBinContent(1),hist.GetBinError(1)) for hist in hists]
+
+    def __projectAll(self,selectionName,histName):
+        '''Project a freshly flattened histogram into all channels and gen channels.'''
+        if len(self.projections.keys())<2: return # no channels to project
+        chans = [x for x in self.projections.keys() if 'gen' not in x]
+        genchans = [x for x in self.projections.keys() if 'gen' in x]
+        channels = [(chan,'') for chan in chans]
+        channels += [('',genchan) for genchan in genchans]
+        channels += [(chan,genchan) for chan in chans for genchan in genchans]
+        self.__projectChannels(selectionName,histName,channels)
+
     def flatten(self,histName,selectionName):
         '''Flatten a histogram'''
         self.temp = False
@@ -651,20 +723,175 @@ class NtupleWrapper(object):
         kwargs = self.selections[selectionName]['kwargs']
         updated = self.__flatten(selectionName,histName,selection,params,**kwargs)
         # project stuff
-        if updated and len(self.projections.keys())>1: # if it changed and there are channels to project
-            variable = '/'.join([selectionName,histName])
-            self.__projectChannel(variable)
-            chans = [x for x in self.projections.keys() if 'gen' not in x]
-            genchans = [x for x in self.projections.keys() if 'gen' in x]
-            genchans = [] # block genchans unless i really want it
-            for chan in chans:
-                variable = '/'.join([selectionName,chan,histName])
-                self.__projectChannel(variable)
-                for genchan in genchans:
-                    variable = '/'.join([selectionName,chan,genchan,histName])
-                    self.__projectChannel(variable)
-            for genchan in genchans:
-                variable = '/'.join([selectionName,genchan,histName])
-            self.__projectChannel(variable)
+        if updated and not self.lazyProjections: self.__projectAll(selectionName,histName)
+        self.__finish()
         self.temp = True
 
+    def __newHist(self,name,params):
+        '''Create an empty histogram with the binning of params'''
+        if 'zVariable' in params: # 3D
+            hist = ROOT.TH3D(name,name,*params['xBinning']+params['yBinning']+params['zBinning'])
+        elif 'yVariable' in params: # 2D
+            hist = ROOT.TH2D(name,name,*params['xBinning']+params['yBinning'])
+        else: # 1D
+            hist = ROOT.TH1D(name,name,*params['xBinning'])
+        hist.Sumw2()
+        return hist
+
+    def __addToMultiDraw(self,multiDraw,job,scalefactor):
+        '''Add a flatten job to a MultiDraw'''
+        params = job['params']
+        self.j += 1
+        hist = self.__newHist('h_{0}_{1}_{2}'.format(job['histName'],self.sample,self.j),params)
+        multiDraw.add(hist,job['selection'],scalefactor,params['xVariable'],params.get('yVariable',''),params.get('zVariable',''))
+        return hist
+
+    def __drawTask(self,t,tasks,jobs):
+        '''Fill the jobs of a task in one pass over its files'''
+        files, jobIndices, normalize = tasks[t]
+        multiDraw = MultiDraw(self.index.makeChain(files))
+        hists = {}
+        for j in jobIndices:
+            scalefactor = self.__getLumiScaleFactor(jobs[j]['scalefactor']) if normalize else jobs[j]['scalefactor']
+            hists[(t,j)] = self.__addToMultiDraw(multiDraw,jobs[j],scalefactor)
+        multiDraw.fill()
+        return hists
+
+    def drawTaskGroup(self,i,taskIndices):
+        '''Worker: run a group of draw tasks and store the histograms in a temporary file.'''
+        tasks, jobs = self.drawTasks
+        partFile = '{0}.part{1}.root'.format(self.flat,i)
+        tfile = ROOT.TFile(partFile,'recreate')
+        ROOT.gROOT.cd()
+        for t in taskIndices:
+            for key, hist in self.__drawTask(t,tasks,jobs).iteritems():
+                hist.SetName('h_{0}_{1}'.format(*key))
+                tfile.cd()
+                hist.Write()
+                ROOT.gROOT.cd()
+        tfile.Close()
+        return partFile
+
+    def __runDrawTasks(self,tasks,jobs):
+        '''Run a list of (files, jobIndices, normalize) draw tasks, on several cores if requested.'''
+        if self.ncores<2 or len(tasks)<2:
+            hists = {}
+            for t in range(len(tasks)):
+                hists.update(self.__drawTask(t,tasks,jobs))
+            return hists
+        groups = [range(len(tasks))[i::self.ncores] for i in range(min(self.ncores,len(tasks)))]
+        self.flush() # dont let the workers inherit pending writes
+        self.drawTasks = (tasks,jobs)
+        partFiles = mapWorkers(self,'drawTaskGroup',groups)
+        self.drawTasks = None
+        hists = {}
+        for taskIndices, partFile in zip(groups,partFiles):
+            tfile = ROOT.TFile.Open(partFile)
+            ROOT.gROOT.cd()
+            for t in taskIndices:
+                for j in tasks[t][1]:
+                    self.j += 1
+                    hist = tfile.Get('h_{0}_{1}'.format(t,j)).Clone('h_{0}_{1}_{2}'.format(jobs[j]['histName'],self.sample,self.j))
+                    hist.SetDirectory(0)
+                    hists[(t,j)] = hist
+            tfile.Close()
+            os.remove(partFile)
+        return hists
+
+    def __fillSinglePass(self,jobs):
+        '''Fill all jobs in one pass over the chain, split into one task per core'''
+        allJobs = range(len(jobs))
+        tasks = []
+        if self.ncores>1:
+            tasks = [(files,allJobs,True) for files in splitFiles(self.files,self.ncores,self.index.getEntries)]
+        if not tasks: # single core, or no files to split (filled empty)
+            tasks = [(self.files,allJobs,True)]
+        drawn = self.__runDrawTasks(tasks,jobs)
+        hists = []
+        for j in allJobs:
+            hist = drawn[(0,j)]
+            for t in range(1,len(tasks)):
+                hist.Add(drawn[(t,j)])
+            hists += [hist]
+        return hists
+
+    def __fillIncremental(self,jobs):
+        '''Fill per file partial histograms for new or modified files, then merge them'''
+        fileIds = {}
+        missing = {}
+        for f in self.files:
+            fileIds[f] = 'f{0}'.format(hashString(f)[:16])
+            fingerprint = self.index.getFingerprint(f)
+            for j,job in enumerate(jobs):
+                hashObj = self.__getObject(self.partial,'hash/{0}/{1}/{2}'.format(fileIds[f],job['selectionName'],job['histName']))
+                if hashObj and hashObj.GetTitle()==fingerprint+job['hash']: continue
+                if f not in missing: missing[f] = []
+                missing[f] += [j]
+        logging.info('Filling partial histograms for {0} of {1} files of {2}'.format(len(missing),len(self.files),self.sample))
+        # partials are not normalized, the luminosity changes with the file list
+        missingFiles = sorted(missing)
+        blockSize = 4*max(self.ncores,1)
+        for b in range(0,len(missingFiles),blockSize):
+            block = missingFiles[b:b+blockSize]
+            tasks = [([f],missing[f],False) for f in block]
+            drawn = self.__runDrawTasks(tasks,jobs)
+            for t,f in enumerate(block):
+                fingerprint = self.index.getFingerprint(f)
+                for j in missing[f]:
+                    hist = drawn[(t,j)]
+                    directory = '/'.join([fileIds[f],jobs[j]['selectionName']])
+                    hist.SetName(jobs[j]['histName'])
+                    self.__bufferWrite(self.partial,hist,directory)
+                    self.__bufferWrite(self.partial,ROOT.TNamed(jobs[j]['histName'],fingerprint+jobs[j]['hash']),'hash/{0}'.format(directory))
+            self.__finish()
+        # merge the partials of the current files
+        lumiScale = self.__getLumiScale()
+        hists = []
+        for job in jobs:
+            self.j += 1
+            hist = self.__newHist('h_{0}_{1}_{2}'.format(job['histName'],self.sample,self.j),job['params'])
+            for f in self.files:
+                partial = self.__getObject(self.partial,'{0}/{1}/{2}'.format(fileIds[f],job['selectionName'],job['histName']))
+                if partial: hist.Add(partial)
+            hist.Scale(lumiScale)
+            hists += [hist]
+        return hists
+
+    def flattenBatch(self,jobs):
+        '''Flatten a list of [histName,selectionName] in a single pass over the ntuple'''
+        if self.useProof:
+            for histName, selectionName in jobs:
+                self.flatten(histName,selectionName)
+            return
+        self.temp = False
+        if not self.initialized: self.__initializeNtuple()
+        ROOT.gDirectory.Delete('h_*')
+        toFill = []
+        for histName, selectionName in jobs:
+            if histName not in self.histParams:
+                logging.error('Unrecognized histogram {0}'.format(histName))
+                continue
+            params = self.histParams[histName]
+            if not params: continue
+            if selectionName not in self.selections:
+                logging.error('Unrecognized selection {0}'.format(selectionName))
+                continue
+            selection = self.selections[selectionName]['args'][0]
+            kwargs = self.selections[selectionName]['kwargs']
+            prepared = self.__prepareFlatten(selectionName,histName,selection,params,**kwargs)
+            if not prepared: continue
+            selection, scalefactor, jobHash = prepared
+            toFill += [{'histName': histName, 'selectionName': selectionName, 'params': params, 'selection': selection, 'scalefactor': scalefactor, 'hash': jobHash}]
+        logging.info('Filling {0} of {1} histograms for {2}'.format(len(toFill),len(jobs),self.sample))
+        if self.incremental:
+            hists = self.__fillIncremental(toFill)
+        else:
+            hists = self.__fillSinglePass(toFill)
+        for job, hist in zip(toFill,hists):
+            hist.SetTitle(job['histName'])
+            hist.SetName(job['histName'])
+            self.__write(hist,directory=job['selectionName'])
+            if not self.lazyProjections: self.__projectAll(job['selectionName'],job['histName'])
+            self.__finish()
+        self.flush()
+        self.temp = True
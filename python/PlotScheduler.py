@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import logging
+import multiprocessing
+
+from DevTools.Plotter.NtupleWrapper import detachOpenFiles
+
+class PlotScheduler(object):
+    '''
+    Render plots, optionally in forked processes with a bounded number running at once.
+
+    By default plots are made one after the other in the driver. With maxProcesses>1 each plot is
+    forked when it is submitted, so the worker sees the plotter exactly as it was configured at that
+    point of the driver. The histograms a plot reads are first read by the parent with prefetch
+    (e.g. Plotter.prefetch), so they are in the parent's cache and shared by all later plots instead
+    of being read again by each worker. A failing or crashing plot only loses itself.
+    '''
+
+    def __init__(self,maxProcesses=1,**kwargs):
+        self.maxProcesses = maxProcesses if maxProcesses else multiprocessing.cpu_count()
+        self.prefetch = kwargs.pop('prefetch',None)
+        self.summaryLength = kwargs.pop('summaryLength',10)
+        self.running = {}
+        self.timings = []
+        self.failures = []
+        self.start = time.time()
+
+    def submit(self,jobName,function,*args,**kwargs):
+        '''Run function(*args,**kwargs) in a new process, waiting for a free slot first.'''
+        if self.maxProcesses<2:
+            self.__runSerial(jobName,function,*args,**kwargs)
+            return
+        while len(self.running)>=self.maxProcesses: self.__reap()
+        if self.prefetch:
+            try:
+                self.prefetch(function,*args,**kwargs)
+            except:
+                logging.exception('Prefetch for {0} failed'.format(jobName))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid==0:
+            status = 1
+            try:
+                detachOpenFiles()
+                function(*args,**kwargs)
+                status = 0
+                self.__waitForChildren()
+            except:
+                logging.exception('Plot {0} failed'.format(jobName))
+            finally:
+                os._exit(status)
+        self.running[pid] = (jobName,time.time())
+
+    def __waitForChildren(self):
+        '''Wait for processes started by a plot (e.g. background writers) before the plot is done'''
+        while True:
+            try:
+                os.wait()
+            except OSError:
+                return
+
+    def __runSerial(self,jobName,function,*args,**kwargs):
+        start = time.time()
+        try:
+            function(*args,**kwargs)
+        except:
+            logging.exception('Plot {0} failed'.format(jobName))
+            self.failures += [jobName]
+        self.timings += [(time.time()-start,jobName)]
+
+    def __reap(self):
+        '''
+        Wait for one plot to finish. Only the plots are waited for, other children
+        (e.g. background writers of the plotter) are left to whoever started them.
+        '''
+        while True:
+            for pid in self.running.keys():
+                donePid, status = os.waitpid(pid,os.WNOHANG)
+                if donePid==pid: break
+            else:
+                time.sleep(0.01)
+                continue
+            break
+        jobName, start = self.running.pop(pid)
+        self.timings += [(time.time()-start,jobName)]
+        if status!=0:
+            if os.WIFSIGNALED(status): logging.error('Plot {0} killed by signal {1}'.format(jobName,os.WTERMSIG(status)))
+            self.failures += [jobName]
+
+    def finish(self):
+        '''Wait for all plots and summarize the time spent'''
+        while self.running: self.__reap()
+        self.logSummary()
+
+    def logSummary(self):
+        total = time.time()-self.start
+        cpu = sum([t for t,jobName in self.timings])
+        logging.info('Made {0} plots in {1:.1f} s ({2:.1f} s plot time on {3} processes)'.format(len(self.timings),total,cpu,self.maxProcesses))
+        for t,jobName in sorted(self.timings,reverse=True)[:self.summaryLength]:
+            logging.info('    {0:8.2f} s {1}'.format(t,jobName))
+        if self.failures:
+            logging.error('{0} plots failed:'.format(len(self.failures)))
+            for jobName in self.failures:
+                logging.error('    {0}'.format(jobName))
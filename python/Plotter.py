@@ -5,12 +5,17 @@ import math
 from array import array
 from collections import OrderedDict
 
+import numpy as np
+
 import ROOT
 ROOT.gROOT.SetBatch(ROOT.kTRUE)
 
 from DevTools.Plotter.PlotterBase import PlotterBase
 from DevTools.Plotter.NtupleWrapper import NtupleWrapper
-from DevTools.Plotter.utilities import getLumi, isData
+from DevTools.Plotter.HistCache import getHistCache, getFileStamp
+from DevTools.Plotter.arrayUtilities import getContents, getBins, getShiftErrors, addErrors, addRelativeError, clipNegative, getIntegralAndError, setContents
+from DevTools.Plotter.figureOfMerit import getBinArrays, sOverB, significance, efficiency, roc
+from DevTools.Plotter.utilities import getLumi, isData, shiftAffects
 from DevTools.Plotter.style import getStyle
 from DevTools.Utilities.utilities import *
 import DevTools.Plotter.CMS_lumi as CMS_lumi
@@ -43,6 +48,9 @@ class Plotter(PlotterBase):
         '''Initialize the plotter'''
         super(Plotter, self).__init__(analysis,**kwargs)
         self.new = kwargs.pop('new',False)
+        self.histCache = getHistCache()
+        histCacheSize = kwargs.pop('histCacheSize',0) # MB
+        if histCacheSize: self.histCache.setBudget(histCacheSize*1024*1024)
 
         # empty initialization
         self.histDict = {}
@@ -57,6 +65,7 @@ class Plotter(PlotterBase):
         self.sampleSelection = {}
         self.uncertainties = {}
         self.shifts = []
+        self.shiftContents = {}
         self.j = 0
 
     #def __exit__(self, type, value, traceback):
@@ -67,7 +76,9 @@ class Plotter(PlotterBase):
 
     def finish(self):
         '''Cleanup stuff'''
+        super(Plotter, self).finish()
         logging.info('Finished plotting')
+        self.histCache.logStats()
         #self.saveFile.Close()
 
     def _openFile(self,sampleName,**kwargs):
@@ -82,7 +93,10 @@ class Plotter(PlotterBase):
                     if s+d not in self.shiftFiles: self.shiftFiles[s+d] = {}
                     if analysis not in self.shiftFiles[s+d]: self.shiftFiles[s+d][analysis] = {}
                     if sampleName not in self.shiftFiles[s+d][analysis]:
-                        self.shiftFiles[s+d][analysis][sampleName] =  NtupleWrapper(analysis,sampleName,new=self.new,shift=s+d,**kwargs)
+                        if shiftAffects(sampleName,s+d):
+                            self.shiftFiles[s+d][analysis][sampleName] =  NtupleWrapper(analysis,sampleName,new=self.new,shift=s+d,**kwargs)
+                        else: # the shift does not change this sample, use the nominal
+                            self.shiftFiles[s+d][analysis][sampleName] = self.sampleFiles[analysis][sampleName]
 
     def setSelectionMap(self,selMap):
         '''Set a map of per sample selections.'''
@@ -142,16 +156,74 @@ class Plotter(PlotterBase):
         self.signals = []
         self.histScales = {}
         self.sampleSelection = {}
+        self.shiftContents = {}
         #self.uncertainties = {}
 
+    def _getVariableNames(self,variables,histName):
+        '''All variables read for a histogram from a variable map, list or single variable'''
+        if isinstance(variables,basestring): return [variables]
+        if isinstance(variables,dict):
+            if histName in variables: return self._getVariableNames(variables[histName],histName)
+            variables = variables.values()
+        names = []
+        for variable in variables:
+            names += self._getVariableNames(variable,histName)
+        return names
+
+    def _getPlotInputs(self,variables):
+        '''Fingerprints of the histograms read for each sample and shift, and the sample composition'''
+        fingerprints = {}
+        for histName in self.histDict:
+            analysis = self.analysisDict[histName]
+            names = self._getVariableNames(variables,histName)
+            for sampleName in self.histDict[histName]:
+                ntuples = {'': self.sampleFiles[analysis][sampleName]}
+                for shift in [s+d for s in self.shifts for d in ['Up','Down']]:
+                    ntuple = self.shiftFiles.get(shift,{}).get(analysis,{}).get(sampleName,None)
+                    if ntuple: ntuples[shift] = ntuple
+                for shift, ntuple in ntuples.iteritems():
+                    key = '/'.join([x for x in [analysis,sampleName,shift] if x])
+                    fingerprints[key] = [ntuple.getFingerprint(name) for name in names]
+        return {
+            'variables'      : variables,
+            'fingerprints'   : fingerprints,
+            'histDict'       : self.histDict,
+            'stackOrder'     : self.stackOrder,
+            'histOrder'      : self.histOrder,
+            'signals'        : self.signals,
+            'histScales'     : self.histScales,
+            'styles'         : self.styles,
+            'sampleSelection': self.sampleSelection,
+            'uncertainties'  : self.uncertainties,
+            'shifts'         : self.shifts,
+        }
+
+    def prefetch(self,function,variables,*args,**kwargs):
+        '''
+        Read the histograms of a plot into the cache without plotting, e.g. in the parent of forked plots.
+        Only for the plots reading 1D histograms (plot, plotNormalized, plotCounts).
+        '''
+        if getattr(function,'__self__',None) is not self: return
+        if getattr(function,'__name__','') not in ['plot','plotNormalized','plotCounts']: return
+        for histName in self.histDict:
+            analysis = self.analysisDict[histName]
+            names = self._getVariableNames(variables,histName)
+            for sampleName in self.histDict[histName]:
+                shifts = ['']+[shift for shift in [s+d for s in self.shifts for d in ['Up','Down']] if sampleName in self.shiftFiles.get(shift,{}).get(analysis,{})]
+                for shift in shifts:
+                    for name in names:
+                        self._readSampleVariable(sampleName,name,analysis=analysis,shift=shift)
+
     def _readSampleVariable(self,sampleName,variable,**kwargs):
         '''Read the histogram from file'''
         analysis = kwargs.pop('analysis',self.analysis)
         shift = kwargs.pop('shift','')
         if shift:
-            hist = self.shiftFiles[shift][analysis][sampleName].getHist(variable)
+            ntuple = self.shiftFiles[shift][analysis][sampleName]
         else:
-            hist = self.sampleFiles[analysis][sampleName].getHist(variable)
+            ntuple = self.sampleFiles[analysis][sampleName]
+        key = (analysis,sampleName,ntuple.shift,variable,getFileStamp(ntuple.flat,ntuple.proj))
+        hist = self.histCache.get(key,lambda: ntuple.getHist(variable))
         logging.debug('Read {0} {1} {2}: {3}'.format(analysis, sampleName, variable, hist))
         if hist:
             self.j += 1
@@ -161,7 +233,9 @@ class Plotter(PlotterBase):
     def _readSampleVariable2D(self,sampleName,variable,**kwargs):
         '''Read the histogram from file'''
         analysis = kwargs.pop('analysis',self.analysis)
-        hist = self.sampleFiles[analysis][sampleName].getHist2D(variable)
+        ntuple = self.sampleFiles[analysis][sampleName]
+        key = (analysis,sampleName,'',variable,'2D',getFileStamp(ntuple.flat,ntuple.proj))
+        hist = self.histCache.get(key,lambda: ntuple.getHist2D(variable))
         logging.debug('Read {0} {1} {2}: {3}'.format(analysis, sampleName, variable, hist))
         if hist:
             self.j += 1
@@ -317,6 +391,20 @@ class Plotter(PlotterBase):
 
         return hist
 
+    def _getCacheKey(self,obj):
+        '''Hashable representation of plot arguments'''
+        if isinstance(obj,dict): return tuple(sorted([(k,self._getCacheKey(v)) for k,v in obj.iteritems()]))
+        if isinstance(obj,(list,tuple)): return tuple([self._getCacheKey(x) for x in obj])
+        return obj
+
+    def _getShiftContents(self,histName,variable,shift,**kwargs):
+        '''Contents of a shifted histogram, read once per histogram and variable'''
+        key = (histName,self._getCacheKey(variable),shift,self._getCacheKey(kwargs))
+        if key not in self.shiftContents:
+            hist = self._getShiftedHistogram(histName,variable,shift=shift,**kwargs)
+            self.shiftContents[key] = getContents(hist)[getBins(hist)].astype(float) if hist else None
+        return self.shiftContents[key]
+
     def _getHistogram(self,histName,variable,**kwargs):
         '''Get a styled histogram'''
         nofill = kwargs.pop('nofill',False)
@@ -325,32 +413,28 @@ class Plotter(PlotterBase):
 
         if not isinstance(hist,ROOT.TH1): return hist
 
+        bins = getBins(hist)
+
         # add shape uncertainties
-        for s in self.shifts:
-            histUp = self._getShiftedHistogram(histName,variable,shift=s+'Up',**kwargs)
-            histDown = self._getShiftedHistogram(histName,variable,shift=s+'Down',**kwargs)
-            for b in range(hist.GetNbinsX()):
-                bVal = hist.GetBinContent(b+1)
-                bErr = hist.GetBinError(b+1)
-                bUpVal = histUp.GetBinContent(b+1)
-                bDownVal = histUp.GetBinContent(b+1)
-                upRel = (bUpVal - bVal)/bVal if bVal else 0
-                downRel = (bDownVal - bVal)/bVal if bVal else 0
-                rel = (abs(upRel)+abs(downRel))/2
-                newErr = (bErr**2 + (bVal*rel)**2)**0.5
-                hist.SetBinError(b+1,newErr)
+        if self.shifts:
+            nominal = getContents(hist)[bins].astype(float)
+            ups, downs = [], []
+            for s in self.shifts:
+                up = self._getShiftContents(histName,variable,s+'Up',**kwargs)
+                down = self._getShiftContents(histName,variable,s+'Down',**kwargs)
+                if up is None or down is None or len(up)!=len(nominal) or len(down)!=len(nominal):
+                    logging.warning('{0}: Missing shift {1}'.format(histName,s))
+                    continue
+                ups += [up]
+                downs += [down]
+            addErrors(hist,getShiftErrors(nominal,ups,downs),bins)
 
         # add constant uncertainties
         if histName in self.uncertainties:
             unc2 = 0.
             for uncName,val in self.uncertainties[histName].iteritems():
                 unc2 += val**2
-            unc = unc2**0.5
-            for b in range(hist.GetNbinsX()):
-                bVal = hist.GetBinContent(b+1)
-                bErr = hist.GetBinError(b+1)
-                newErr = ((bVal*unc)**2 + bErr**2)**0.5
-                hist.SetBinError(b+1,newErr)
+            addRelativeError(hist,unc2**0.5,bins)
 
         # style it
         style = self.styles[histName]
@@ -365,10 +449,8 @@ class Plotter(PlotterBase):
             if 'fillcolor' in style: hist.SetFillColor(style['fillcolor'])
 
         # remove bins < 0
-        for b in range(hist.GetNbinsX()):
-            if hist.GetBinContent(b+1)<0.:
-                logging.debug('{0}: Zeroing negative bin {1}: {2}'.format(histName, b,hist.GetBinContent(b+1)))
-                hist.SetBinContent(b+1,0.)
+        negative = clipNegative(hist,bins)
+        if len(negative): logging.debug('{0}: Zeroed negative bins {1}'.format(histName,' '.join([str(b) for b in negative])))
 
         return hist
 
@@ -386,12 +468,9 @@ class Plotter(PlotterBase):
                hist.SetBinContent(b+1,0)
                hist.SetBinError(b+1,0)
             else:
-               integral = varHist.Integral()
-               err2 = 0.
-               for hb in range(varHist.GetNbinsX()):
-                   err2 += varHist.GetBinError(hb+1)**2
+               integral, err = getIntegralAndError(varHist)
                hist.SetBinContent(b+1,integral)
-               hist.SetBinError(b+1,err2**0.5)
+               hist.SetBinError(b+1,err)
         style = self.styles[histName]
         hist.SetTitle(style['name'])
         if 'linecolor' in style:
@@ -600,6 +679,7 @@ class Plotter(PlotterBase):
 
     def plot(self,variable,savename,**kwargs):
         '''Plot a variable and save'''
+        if self._isUpToDate(savename,variable,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Events')
         logy = kwargs.pop('logy',False)
@@ -616,6 +696,7 @@ class Plotter(PlotterBase):
         rangex = kwargs.pop('rangex',[])
         binlabels = kwargs.pop('binlabels',[])
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
         getHists = kwargs.pop('getHists',False)
         doGOF = kwargs.pop('doGOF',False)
 
@@ -826,7 +907,7 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
             logging.debug('Done')
             return 0
         else:
@@ -834,6 +915,7 @@ class Plotter(PlotterBase):
 
     def plotCounts(self,bins,labels,savename,**kwargs):
         '''Plot a histogram of counts for each bin and save'''
+        if self._isUpToDate(savename,bins,labels,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', '')
         yaxis = kwargs.pop('yaxis', 'Events')
         logy = kwargs.pop('logy',False)
@@ -848,6 +930,7 @@ class Plotter(PlotterBase):
         isprelim = kwargs.pop('preliminary',True)
         plotratio = kwargs.pop('plotratio',True)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         ROOT.gDirectory.Delete('h_*')
@@ -982,13 +1065,14 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
 
     def plotRatio(self,numerator,denominator,savename,**kwargs):
         '''Plot a ratio of two variables and save'''
+        if self._isUpToDate(savename,[numerator,denominator],**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Efficiency')
         logy = kwargs.pop('logy',False)
@@ -1002,6 +1086,7 @@ class Plotter(PlotterBase):
         subtractMap = kwargs.pop('subtractMap',{})
         getHists = kwargs.pop('getHists', False)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
         plotratio = kwargs.pop('plotratio',False)
 
         logging.info('Plotting {0}'.format(savename))
@@ -1112,12 +1197,13 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     def plotSOverB(self,variable,signals,backgrounds,savename,**kwargs):
         '''Plot ROC curve'''
+        if self._isUpToDate(savename,variable,signals,backgrounds,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Signal over background')
         logy = kwargs.pop('logy',False)
@@ -1129,6 +1215,7 @@ class Plotter(PlotterBase):
         numcol = kwargs.pop('numcol',1)
         legendpos = kwargs.pop('legendpos',34)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         canvas = ROOT.TCanvas(savename,savename,50,50,600,600)
@@ -1145,52 +1232,41 @@ class Plotter(PlotterBase):
         lowestMin = 999999.
         hists = OrderedDict()
 
-        for i,histNames in enumerate(zip(signals,backgrounds)):
-            signal, background = histNames
-            sig = self._getHistogram(signal,variable,nofill=True,**kwargs)
-            bg = self._getHistogram(background,variable,nofill=True,**kwargs)
+        # all thresholds of all signals at once
+        sigHists = [self._getHistogram(signal,variable,nofill=True,**kwargs) for signal in signals]
+        bgHists = dict([(background,self._getHistogram(background,variable,nofill=True,**kwargs)) for background in set(backgrounds)])
+        sigVals, sigErr2 = getBinArrays(sigHists)
+        bgVals, bgErr2 = getBinArrays([bgHists[background] for background in backgrounds])
+        sOverBVals, sOverBErrs = sOverB(sigVals,sigErr2,bgVals,bgErr2,invert=invert)
+
+        for i,(signal,sig) in enumerate(zip(signals,sigHists)):
             numBins = sig.GetNbinsX()
             self.j += 1
             name = 'h_sOverB_{0}'.format(self.j)
-            sOverB = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
-            thisMin = 999999.
-            for b in range(numBins):
-                blow = 1 if invert else b+1
-                bhigh = b+1 if invert else numBins
-                sigVal = 0
-                sigErr2 = 0
-                bgVal = 0
-                bgErr2 = 0
-                for j in range(blow,bhigh+1):
-                    sigVal += sig.GetBinContent(j)
-                    sigErr2 += sig.GetBinError(j)**2
-                    bgVal += bg.GetBinContent(j)
-                    bgErr2 += bg.GetBinError(j)**2
-                sOverBVal = divWithError((sigVal,sigErr2**0.5),(bgVal,bgErr2**0.5))
-                if sOverBVal>0: thisMin = min(thisMin,sOverBVal)
-                sOverB.SetBinContent(b+1,sOverBVal[0])
-                sOverB.SetBinError(b+1,sOverBVal[1])
-            lowestMin = min(lowestMin,thisMin)
-            sOverB.SetMinimum(lowestMin)
+            sOverBHist = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
+            setContents(sOverBHist,sOverBVals[i],sOverBErrs[i]**2)
+            positive = sOverBVals[i][sOverBVals[i]>0]
+            if len(positive): lowestMin = min(lowestMin,positive.min())
+            sOverBHist.SetMinimum(lowestMin)
             style = self.styles[signal]
-            sOverB.SetLineWidth(2)
-            sOverB.SetLineColor(style['linecolor'])
-            sOverB.SetMarkerColor(style['linecolor'])
-            sOverB.SetFillColor(0)
+            sOverBHist.SetLineWidth(2)
+            sOverBHist.SetLineColor(style['linecolor'])
+            sOverBHist.SetMarkerColor(style['linecolor'])
+            sOverBHist.SetFillColor(0)
             if i==0:
-                sOverB.Draw('e0')
-                sOverB.GetXaxis().SetTitle(xaxis)
-                sOverB.GetYaxis().SetTitle(yaxis)
-                sOverB.GetYaxis().SetTitleOffset(1.2)
-                #sOverB.SetMinimum(0.)
-                if ymax!=None: sOverB.SetMaximum(ymax)
-                if ymin!=None: sOverB.SetMinimum(ymin)
+                sOverBHist.Draw('e0')
+                sOverBHist.GetXaxis().SetTitle(xaxis)
+                sOverBHist.GetYaxis().SetTitle(yaxis)
+                sOverBHist.GetYaxis().SetTitleOffset(1.2)
+                #sOverBHist.SetMinimum(0.)
+                if ymax!=None: sOverBHist.SetMaximum(ymax)
+                if ymin!=None: sOverBHist.SetMinimum(ymin)
             else:
-                sOverB.Draw('e0 same')
-            sOverB.SetTitle(style['name'])
-            #highestMax = max(highestMax,sOverB.GetMaximum())
-            #if ymax==None: sOverB.SetMaximum(yscale*highestMax)
-            hists[signal] = sOverB
+                sOverBHist.Draw('e0 same')
+            sOverBHist.SetTitle(style['name'])
+            #highestMax = max(highestMax,sOverBHist.GetMaximum())
+            #if ymax==None: sOverBHist.SetMaximum(yscale*highestMax)
+            hists[signal] = sOverBHist
 
         legend = self._getLegend(hists=hists,numcol=numcol,position=legendpos)
         legend.Draw()
@@ -1199,23 +1275,27 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     def plotSignificance(self,variable,signals,backgrounds,savename,**kwargs):
         '''Plot ROC curve'''
+        if self._isUpToDate(savename,variable,signals,backgrounds,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Significance')
         logy = kwargs.pop('logy',False)
         logx = kwargs.pop('logx',False)
         invert = kwargs.pop('invert',False)
+        method = kwargs.pop('method','asimov')
+        bgUncertainty = kwargs.pop('bgUncertainty',None)
         yscale = kwargs.pop('yscale',5 if logy else 1.2)
         ymin = kwargs.pop('ymin',None)
         ymax = kwargs.pop('ymax',2)
         numcol = kwargs.pop('numcol',3)
         legendpos = kwargs.pop('legendpos',34)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         canvas = ROOT.TCanvas(savename,savename,50,50,600,600)
@@ -1232,52 +1312,38 @@ class Plotter(PlotterBase):
         lowestMin = 999999.
         hists = OrderedDict()
 
-        for i,histNames in enumerate(zip(signals,backgrounds)):
-            signal, background = histNames
-            sig = self._getHistogram(signal,variable,nofill=True,**kwargs)
-            bg = self._getHistogram(background,variable,nofill=True,**kwargs)
+        # all thresholds of all signals at once
+        sigHists = [self._getHistogram(signal,variable,nofill=True,**kwargs) for signal in signals]
+        bgHists = dict([(background,self._getHistogram(background,variable,nofill=True,**kwargs)) for background in set(backgrounds)])
+        sigVals, sigErr2 = getBinArrays(sigHists)
+        bgVals, bgErr2 = getBinArrays([bgHists[background] for background in backgrounds])
+        significanceVals = significance(sigVals,bgVals,bgErr2,invert=invert,method=method,bgUncertainty=bgUncertainty)
+
+        for i,(signal,sig) in enumerate(zip(signals,sigHists)):
             numBins = sig.GetNbinsX()
             self.j += 1
-            name = 'h_sOverB_{0}'.format(self.j)
-            significance = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
-            thisMin = 999999.
-            for b in range(numBins):
-                blow = 1 if invert else b+1
-                bhigh = b+1 if invert else numBins
-                sigVal = 0
-                sigErr2 = 0
-                bgVal = 0
-                bgErr2 = 0
-                for j in range(blow,bhigh+1):
-                    sigVal += sig.GetBinContent(j)
-                    sigErr2 += sig.GetBinError(j)**2
-                    bgVal += bg.GetBinContent(j)
-                    bgErr2 += bg.GetBinError(j)**2
-                sigErr = sigErr**0.5
-                bgErr = bgErr**0.5
-                #significanceVal = sigVal / (sigVal+bgVal) if sigVal+bgVal else 0.
-                significanceVal = asimovSignificance((sigVal,sigErr),(bgVal,bgErr))
-                if significanceVal>0: thisMin = min(thisMin,significanceVal)
-                significance.SetBinContent(b+1,significanceVal)
-                significance.SetBinError(b+1,0.)
-            lowestMin = min(lowestMin,thisMin)
-            significance.SetMinimum(lowestMin)
+            name = 'h_significance_{0}'.format(self.j)
+            significanceHist = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
+            setContents(significanceHist,significanceVals[i],np.zeros(numBins))
+            positive = significanceVals[i][significanceVals[i]>0]
+            if len(positive): lowestMin = min(lowestMin,positive.min())
+            significanceHist.SetMinimum(lowestMin)
             style = self.styles[signal]
-            significance.SetLineWidth(2)
-            significance.SetLineColor(style['linecolor'])
-            significance.SetMarkerColor(style['linecolor'])
-            significance.SetFillColor(0)
+            significanceHist.SetLineWidth(2)
+            significanceHist.SetLineColor(style['linecolor'])
+            significanceHist.SetMarkerColor(style['linecolor'])
+            significanceHist.SetFillColor(0)
             if i==0:
-                significance.Draw('e0')
-                significance.GetXaxis().SetTitle(xaxis)
-                significance.GetYaxis().SetTitle(yaxis)
-                significance.GetYaxis().SetTitleOffset(1.2)
-                if ymax!=None: significance.SetMaximum(ymax)
-                if ymin!=None: significance.SetMinimum(ymin)
+                significanceHist.Draw('e0')
+                significanceHist.GetXaxis().SetTitle(xaxis)
+                significanceHist.GetYaxis().SetTitle(yaxis)
+                significanceHist.GetYaxis().SetTitleOffset(1.2)
+                if ymax!=None: significanceHist.SetMaximum(ymax)
+                if ymin!=None: significanceHist.SetMinimum(ymin)
             else:
-                significance.Draw('e0 same')
-            significance.SetTitle(style['name'])
-            hists[signal] = significance
+                significanceHist.Draw('e0 same')
+            significanceHist.SetTitle(style['name'])
+            hists[signal] = significanceHist
 
         legend = self._getLegend(hists=hists,numcol=numcol,position=legendpos)
         legend.Draw()
@@ -1286,13 +1352,14 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
 
     def plotEfficiency(self,variable,savename,**kwargs):
         '''Plot ROC curve'''
+        if self._isUpToDate(savename,variable,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Efficiency')
         numcol = kwargs.pop('numcol',1)
@@ -1304,6 +1371,7 @@ class Plotter(PlotterBase):
         ymin = kwargs.pop('ymin',0)
         ymax = kwargs.pop('ymax',1.2)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         canvas = ROOT.TCanvas(savename,savename,50,50,600,600)
@@ -1313,16 +1381,13 @@ class Plotter(PlotterBase):
 
         hists = OrderedDict()
         histOrder = customOrder if customOrder else self.histOrder
-        for i,histName in enumerate(histOrder):
-            sig = self._getHistogram(histName,variable,nofill=True,**kwargs)
+        sigHists = [self._getHistogram(histName,variable,nofill=True,**kwargs) for histName in histOrder]
+        sigVals, sigErr2 = getBinArrays(sigHists)
+        sigEffs = efficiency(sigVals,invert=invert)
+        for i,(histName,sig) in enumerate(zip(histOrder,sigHists)):
             numBins = sig.GetNbinsX()
-            sigEff = [0]*numBins
-            sigVal = [0]*numBins
-            totSig = sig.Integral()
-            for b in range(numBins):
-                sigEff[b] = sig.Integral(1,b+1)/totSig if invert else sig.Integral(b+1,numBins)/totSig
-                sigVal[b] = sig.GetBinLowEdge(b+1)
-            eff = ROOT.TGraph(numBins,array('f',sigVal),array('f',sigEff))
+            sigVal = [sig.GetBinLowEdge(b+1) for b in range(numBins)]
+            eff = ROOT.TGraph(numBins,array('f',sigVal),array('f',sigEffs[i].tolist()))
             style = self.styles[histName]
             eff.SetLineWidth(2)
             eff.SetLineColor(style['linecolor'])
@@ -1347,12 +1412,13 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     def plotROC(self,signalVariable,backgroundVariable,savename,**kwargs):
         '''Plot ROC curve'''
+        if self._isUpToDate(savename,[signalVariable,backgroundVariable],**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Signal Efficiency')
         yaxis = kwargs.pop('yaxis', 'Background Rejection')
         numcol = kwargs.pop('numcol',1)
@@ -1367,6 +1433,7 @@ class Plotter(PlotterBase):
         ymin = kwargs.pop('ymin',0)
         ymax = kwargs.pop('ymax',1.2)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         canvas = ROOT.TCanvas(savename,savename,50,50,600,600)
@@ -1380,34 +1447,30 @@ class Plotter(PlotterBase):
         bgHists = bgOrder if sigOrder and bgOrder and len(sigOrder)==len(bgOrder) else histOrder
         wpStyles = [20,21,22,23,33,34,24,25,26,32,27,28]
         wpHists = []
-        for i,(sigName,bgName) in enumerate(zip(sigHists,bgHists)):
-            sig = self._getHistogram(sigName,signalVariable,nofill=True,**kwargs)
-            bg = self._getHistogram(bgName,backgroundVariable,nofill=True,**kwargs)
+        sigs = [self._getHistogram(sigName,signalVariable,nofill=True,**kwargs) for sigName in sigHists]
+        bgs = [self._getHistogram(bgName,backgroundVariable,nofill=True,**kwargs) for bgName in bgHists]
+        sigEffs, bgRejs = roc(getBinArrays(sigs)[0],getBinArrays(bgs)[0],invert=invert)
+        for i,(sigName,sig) in enumerate(zip(sigHists,sigs)):
             numBins = sig.GetNbinsX()
-            sigEff = [0]*numBins
-            bgEff = [0]*numBins
-            totSig = sig.Integral()
-            totBg = bg.Integral()
-            for b in range(numBins):
-                sigEff[b] = sig.Integral(1,b+1)/totSig if invert else sig.Integral(b+1,numBins)/totSig
-                bgEff[b] = (totBg-bg.Integral(1,b+1))/totBg if invert else (totBg-bg.Integral(b+1,numBins))/totBg
-            roc = ROOT.TGraph(numBins,array('f',sigEff),array('f',bgEff))
+            sigEff = sigEffs[i].tolist()
+            bgEff = bgRejs[i].tolist()
+            rocGraph = ROOT.TGraph(numBins,array('f',sigEff),array('f',bgEff))
             style = self.styles[sigName]
-            roc.SetLineWidth(2)
-            roc.SetLineColor(style['linecolor'])
-            roc.SetMarkerColor(style['linecolor'])
-            roc.SetFillColor(0)
+            rocGraph.SetLineWidth(2)
+            rocGraph.SetLineColor(style['linecolor'])
+            rocGraph.SetMarkerColor(style['linecolor'])
+            rocGraph.SetFillColor(0)
             if i==0:
-                roc.Draw('AL')
-                roc.GetXaxis().SetTitle(xaxis)
-                roc.GetYaxis().SetTitle(yaxis)
-                roc.GetYaxis().SetTitleOffset(1.2)
-                roc.SetMaximum(ymax)
-                roc.SetMinimum(ymin)
+                rocGraph.Draw('AL')
+                rocGraph.GetXaxis().SetTitle(xaxis)
+                rocGraph.GetYaxis().SetTitle(yaxis)
+                rocGraph.GetYaxis().SetTitleOffset(1.2)
+                rocGraph.SetMaximum(ymax)
+                rocGraph.SetMinimum(ymin)
             else:
-                roc.Draw('L same')
-            roc.SetTitle(style['name'])
-            hists[sigName] = roc
+                rocGraph.Draw('L same')
+            rocGraph.SetTitle(style['name'])
+            hists[sigName] = rocGraph
             # working points
             if sigName in workingPoints:
                 for w,wp in enumerate(sorted(workingPoints[sigName])):
@@ -1435,12 +1498,13 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     def plotNormalized(self,variable,savename,**kwargs):
         '''Plot a ratio of two variables and save'''
+        if self._isUpToDate(savename,variable,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Events')
         ymin = kwargs.pop('ymin',None)
@@ -1456,6 +1520,7 @@ class Plotter(PlotterBase):
         lumipos = kwargs.pop('lumipos',11)
         isprelim = kwargs.pop('preliminary',True)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
         # ratio plot
@@ -1571,13 +1636,14 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     #def plot2D(self,xVariable,yVariable,savename,**kwargs):
     def plot2D(self,plotname,savename,**kwargs):
         '''Plot a variable and save'''
+        if self._isUpToDate(savename,plotname,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Events')
         ymin = kwargs.pop('ymin',None)
@@ -1590,6 +1656,7 @@ class Plotter(PlotterBase):
         rangex = kwargs.pop('rangex',[])
         rangey = kwargs.pop('rangey',[])
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
         text = kwargs.pop('text',False)
 
         logging.info('Plotting {0}'.format(savename))
@@ -1626,11 +1693,12 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
     def plotEnvelope(self,variable,savename,xvalMap,envelopePoints,**kwargs):
+        if self._isUpToDate(savename,variable,xvalMap,envelopePoints,**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Variable')
         ymin = kwargs.pop('ymin',None)
@@ -1641,6 +1709,7 @@ class Plotter(PlotterBase):
         logy = kwargs.pop('logy',False)
         logx = kwargs.pop('logx',False)
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
         envelopeStyles = kwargs.pop('envelopeStyles',[])
         envelopeColors = kwargs.pop('envelopeColors',[])
         envelopeLabels = kwargs.pop('envelopeLabels',[])
@@ -1718,13 +1787,14 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
 
     def plotMCDataRatio(self,stackVariableMap,dataVariable,savename,**kwargs):
         '''Plot a ratio of MC stack to Data'''
+        if self._isUpToDate(savename,[stackVariableMap,dataVariable],**kwargs): return 0
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Events')
         logy = kwargs.pop('logy',False)
@@ -1740,6 +1810,7 @@ class Plotter(PlotterBase):
         rangex = kwargs.pop('rangex',[])
         binlabels = kwargs.pop('binlabels',[])
         save = kwargs.pop('save',True)
+        formats = kwargs.pop('formats',None)
 
         logging.info('Plotting {0}'.format(savename))
 
@@ -1829,7 +1900,7 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
             logging.debug('Done')
             return fitResults
         else:
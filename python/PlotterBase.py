@@ -5,6 +5,11 @@ import math
 from array import array
 from collections import OrderedDict
 import tempfile
+import json
+import hashlib
+import subprocess
+import multiprocessing
+from distutils.spawn import find_executable
 
 import ROOT
 
@@ -26,8 +31,30 @@ class PlotterBase(object):
         # plot directory
         self.analysis = analysis
         self.outputDirectory = kwargs.pop('outputDirectory','plots/{0}'.format(self.analysis))
+        # skip plots whose inputs did not change since they were last saved
+        self.memoize = kwargs.pop('memoize',False)
+        self.plotHashes = {}
+        # output formats, can be changed per plot with the formats argument
+        self.formats = kwargs.pop('formats',['pdf','root','png'])
+        # print the canvases in background processes while the next plot is made
+        self.asyncSave = kwargs.pop('asyncSave',False)
+        self.maxWriters = kwargs.pop('maxWriters',multiprocessing.cpu_count())
+        # make the png files from the pdf files in one go in finish, rather than printing them
+        self.pngFromPdf = kwargs.pop('pngFromPdf',False)
+        self.pngResolution = kwargs.pop('pngResolution',76) # dpi
+        self.writers = OrderedDict()
+        self.createdDirectories = set()
         # initialize stuff
 
+    def setFormats(self,*formats):
+        '''Set the output formats for the following plots'''
+        self.formats = list(formats)
+
+    def finish(self):
+        '''Wait for the plots being written and make the png files from pdf if requested'''
+        while self.writers: self._waitForWriter()
+        if self.pngFromPdf: self.convertPdfs()
+
     def _getLegend(self,**kwargs):
         '''Get the legend'''
         entryArgs = kwargs.pop('entries',[])
@@ -93,15 +120,125 @@ class PlotterBase(object):
             CMS_lumi.lumi_13TeV = "%0.1f pb^{-1}" % (float(getLumi))
         CMS_lumi.CMS_lumi(pad,period_int,position)
 
-    def _save(self, canvas, savename):
+    def _getPlotInputs(self,variables):
+        '''Fingerprint of everything the plotted variables are read from, overridden by the plotters'''
+        return variables
+
+    def _getPlotHash(self,savename,variables,*args,**kwargs):
+        '''Hash of the inputs and options of a plot'''
+        content = {
+            'savename' : savename,
+            'inputs'   : self._getPlotInputs(variables),
+            'args'     : args,
+            'kwargs'   : kwargs,
+        }
+        # objects without a json representation fall back to repr, which at worst forces a redraw
+        return hashlib.sha1(json.dumps(content,sort_keys=True,default=repr)).hexdigest()
+
+    def _getManifestName(self,savename):
+        return '{0}/manifest/{1}.json'.format(self.outputDirectory,savename)
+
+    def _isUpToDate(self,savename,variables,*args,**kwargs):
+        '''
+        Check if a plot was already saved from the same inputs and options.
+        Otherwise remember its hash, the manifest is written when the plot is saved.
+        '''
+        if not self.memoize or not kwargs.get('save',True) or kwargs.get('getHists',False): return False
+        plotHash = self._getPlotHash(savename,variables,*args,**kwargs)
+        self.plotHashes[savename] = plotHash
+        manifestName = self._getManifestName(savename)
+        if not os.path.exists(manifestName): return False
+        with open(manifestName,'r') as f:
+            try:
+                manifest = json.load(f)
+            except ValueError:
+                return False
+        if manifest.get('hash','')!=plotHash: return False
+        if not all([os.path.exists(name) for name in manifest.get('outputs',[])]): return False
+        logging.info('Skipping {0}, up to date'.format(savename))
+        self.plotHashes.pop(savename)
+        return True
+
+    def _writeManifest(self,savename,outputs,plotHash):
+        '''Record the hash of a saved plot next to its outputs'''
+        if not plotHash: return
+        manifestName = self._getManifestName(savename)
+        self._makeDirectory(os.path.dirname(manifestName))
+        with open(manifestName,'w') as f:
+            f.write(json.dumps({'hash': plotHash, 'outputs': outputs}, indent=4, sort_keys=True))
+
+    def _makeDirectory(self,directory):
+        '''Create an output directory, once per session'''
+        if directory in self.createdDirectories: return
+        python_mkdir(directory)
+        self.createdDirectories.add(directory)
+
+    def _print(self,canvas,savename,formats,outputs,plotHash):
+        for type, name in zip(formats,outputs):
+            if type=='png' and self.pngFromPdf and 'pdf' in formats: continue # made in finish
+            logging.debug('Writing {0}'.format(name))
+            canvas.Print(name)
+        self._writeManifest(savename,outputs,plotHash)
+
+    def _waitForWriter(self):
+        '''Wait for the oldest background writer'''
+        pid, savename = self.writers.popitem(last=False)
+        pid, status = os.waitpid(pid,0)
+        if status!=0: logging.error('Failed to save {0}'.format(savename))
+
+    def _save(self, canvas, savename, formats=None):
         '''Save the canvas in multiple formats.'''
         logging.debug('Saving {0}'.format(savename))
         canvas.SetName(savename)
-        for type in ['pdf','root','png']:
-            name = '{0}/{1}/{2}.{1}'.format(self.outputDirectory, type, savename)
-            python_mkdir(os.path.dirname(name))
-            logging.debug('Writing {0}'.format(name))
-            canvas.Print(name)
+        if formats is None: formats = self.formats
+        outputs = ['{0}/{1}/{2}.{1}'.format(self.outputDirectory, type, savename) for type in formats]
+        for name in outputs:
+            self._makeDirectory(os.path.dirname(name))
+        plotHash = self.plotHashes.pop(savename,'')
+        if not self.asyncSave:
+            self._print(canvas,savename,formats,outputs,plotHash)
+            return
+        # the forked writer has its own copy of the canvas, the plotter carries on with the next plot
+        while len(self.writers)>=self.maxWriters: self._waitForWriter()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid==0:
+            status = 1
+            try:
+                self._print(canvas,savename,formats,outputs,plotHash)
+                status = 0
+            except:
+                logging.exception('Failed to save {0}'.format(savename))
+            finally:
+                os._exit(status)
+        self.writers[pid] = savename
+
+    def convertPdfs(self):
+        '''Make the png of every pdf that does not have an up to date one'''
+        gs = find_executable('gs')
+        if not gs:
+            logging.error('Ghostscript not found, can not make png from pdf')
+            return
+        pdfDirectory = '{0}/pdf'.format(self.outputDirectory)
+        jobs = []
+        for root, dirs, files in os.walk(pdfDirectory):
+            for f in files:
+                if not f.endswith('.pdf'): continue
+                pdf = os.path.join(root,f)
+                png = '{0}/png/{1}.png'.format(self.outputDirectory,os.path.relpath(pdf,pdfDirectory)[:-4])
+                if os.path.exists(png) and os.path.getmtime(png)>=os.path.getmtime(pdf): continue
+                self._makeDirectory(os.path.dirname(png))
+                jobs += [[gs,'-q','-dSAFER','-dBATCH','-dNOPAUSE','-sDEVICE=png16m','-dTextAlphaBits=4','-dGraphicsAlphaBits=4',
+                          '-r{0}'.format(self.pngResolution),'-sOutputFile={0}'.format(png),pdf]]
+        logging.info('Converting {0} pdf to png'.format(len(jobs)))
+        running = []
+        for job in jobs:
+            if len(running)>=self.maxWriters:
+                running.pop(0).wait()
+            running += [subprocess.Popen(job)]
+        for p in running:
+            p.wait()
 
     def _saveTemp(self, canvas):
         '''Save the canvas in multiple formats.'''
@@ -0,0 +1,87 @@
+# numpy views of the bin contents and errors of ROOT histograms
+import numpy as np
+
+def _bufferView(buf,n,dtype):
+    '''Wrap a PyROOT buffer of length n in a numpy array without copying'''
+    try:
+        buf.SetSize(n)
+    except AttributeError:
+        buf.reshape((n,))
+    return np.frombuffer(buf,dtype=dtype,count=n)
+
+def _contentType(hist):
+    '''Type of the array holding the contents, TH1D etc. also inherit from TArrayD'''
+    for cls, dtype in [('TArrayD',np.float64),('TArrayF',np.float32),('TArrayI',np.int32),('TArrayS',np.int16),('TArrayC',np.int8)]:
+        if hist.InheritsFrom(cls): return dtype
+    return None
+
+def getContents(hist):
+    '''View of the contents of all cells (including under/overflow), a copy if the type is not known'''
+    n = hist.GetNcells()
+    dtype = _contentType(hist)
+    if dtype is not None: return _bufferView(hist.GetArray(),n,dtype)
+    return np.array([hist.GetBinContent(b) for b in range(n)])
+
+def getSumw2(hist):
+    '''View of the sum of weights squared of all cells, creating it if needed'''
+    if hist.GetSumw2N()==0: hist.Sumw2()
+    n = hist.GetNcells()
+    return _bufferView(hist.GetSumw2().GetArray(),n,np.float64)
+
+def getBins(hist):
+    '''Slice of the visible bins along x, as used for 1D plots'''
+    return slice(1,hist.GetNbinsX()+1)
+
+def getShiftErrors(nominal,ups,downs):
+    '''
+    Absolute error on each bin from up/down variations of the contents,
+    the average of the up and down differences, zero where the nominal is empty.
+    '''
+    err2 = np.zeros_like(nominal,dtype=np.float64)
+    filled = nominal!=0
+    for up, down in zip(ups,downs):
+        diff = (np.abs(up-nominal)+np.abs(down-nominal))/2
+        err2 += np.where(filled,diff,0.)**2
+    return err2
+
+def addErrors(hist,err2,bins=None):
+    '''Add err2 in quadrature to the errors of the bins'''
+    if bins is None: bins = getBins(hist)
+    sumw2 = getSumw2(hist)
+    sumw2[bins] += err2
+
+def addRelativeError(hist,rel,bins=None):
+    '''Add a constant relative error in quadrature to the bins'''
+    if bins is None: bins = getBins(hist)
+    contents = getContents(hist)
+    addErrors(hist,(contents[bins].astype(np.float64)*rel)**2,bins)
+
+def clipNegative(hist,bins=None):
+    '''Zero negative bins, returns the indices of the clipped bins'''
+    if bins is None: bins = getBins(hist)
+    contents = getContents(hist)
+    visible = contents[bins]
+    negative = np.flatnonzero(visible<0)
+    if len(negative):
+        visible[negative] = 0
+        # contents are a copy if the histogram type is not known
+        if _contentType(hist) is None:
+            for b in negative: hist.SetBinContent(int(b)+bins.start,0.)
+    return negative
+
+def getIntegralAndError(hist,bins=None):
+    '''Sum of the contents and errors of the bins'''
+    if bins is None: bins = getBins(hist)
+    contents = getContents(hist)
+    sumw2 = getSumw2(hist)
+    return float(np.sum(contents[bins])), float(np.sum(sumw2[bins]))**0.5
+
+def setContents(hist,vals,err2=None,bins=None):
+    '''Set the contents (and sum of weights squared) of the bins'''
+    if bins is None: bins = getBins(hist)
+    if _contentType(hist) is None:
+        for b,val in zip(range(bins.start,bins.stop),vals): hist.SetBinContent(b,val)
+    else:
+        getContents(hist)[bins] = vals
+    if err2 is not None:
+        getSumw2(hist)[bins] = err2
@@ -0,0 +1,93 @@
+# figures of merit for every threshold of a histogram at once, from cumulative sums of the bins
+import numpy as np
+
+from DevTools.Plotter.arrayUtilities import getContents, getSumw2, getBins
+
+def getBinArrays(hists):
+    '''Contents and sum of weights squared of the visible bins of histograms with the same binning, shape (nhists,nbins)'''
+    vals = np.array([getContents(hist)[getBins(hist)] for hist in hists],dtype=np.float64)
+    err2 = np.array([getSumw2(hist)[getBins(hist)] for hist in hists],dtype=np.float64)
+    return vals, err2
+
+def cumulative(vals,invert=False):
+    '''
+    Sum of the bins passing each threshold along the last axis:
+    the threshold bin and all above it, or all up to and including it if invert.
+    '''
+    vals = np.asarray(vals,dtype=np.float64)
+    if invert: return np.cumsum(vals,axis=-1)
+    return np.cumsum(vals[...,::-1],axis=-1)[...,::-1]
+
+def divide(num,numErr2,den,denErr2):
+    '''Ratio of uncorrelated values and its error, 0 where the denominator is 0'''
+    num = np.asarray(num,dtype=np.float64)
+    den = np.asarray(den,dtype=np.float64)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        ratio = np.where(den!=0,num/den,0.)
+        relErr2 = np.where(num!=0,numErr2/num**2,0.) + np.where(den!=0,denErr2/den**2,0.)
+    return ratio, np.abs(ratio)*np.sqrt(relErr2)
+
+def sOverB(sig,sigErr2,bg,bgErr2,invert=False):
+    '''Signal over background and its error for every threshold'''
+    return divide(cumulative(sig,invert),cumulative(sigErr2,invert),cumulative(bg,invert),cumulative(bgErr2,invert))
+
+def asimovSignificance(s,b,bErr=None):
+    '''
+    Median discovery significance of s signal over b background (Asimov),
+    with an absolute uncertainty bErr on the background if given. 0 where undefined.
+    '''
+    s = np.asarray(s,dtype=np.float64)
+    b = np.asarray(b,dtype=np.float64)
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+        z2 = 2*((s+b)*np.log(1+s/b)-s)
+        if bErr is not None:
+            sb2 = np.asarray(bErr,dtype=np.float64)**2
+            z2err = 2*((s+b)*np.log((s+b)*(b+sb2)/(b**2+(s+b)*sb2))-b**2/sb2*np.log(1+sb2*s/(b*(b+sb2))))
+            z2 = np.where(sb2>0,z2err,z2)
+        valid = (s>0) & (b>0) & np.isfinite(z2) & (z2>0)
+        return np.where(valid,np.sqrt(np.where(valid,z2,0.)),0.)
+
+def simpleSignificance(s,b,bErr=None):
+    '''s/sqrt(b+bErr^2), 0 where undefined'''
+    s = np.asarray(s,dtype=np.float64)
+    b = np.asarray(b,dtype=np.float64)
+    var = b if bErr is None else b+np.asarray(bErr,dtype=np.float64)**2
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.where(var>0,s/np.sqrt(np.abs(var)),0.)
+
+def sOverSqrtSPlusB(s,b,bErr=None):
+    '''s/sqrt(s+b+bErr^2), 0 where undefined'''
+    s = np.asarray(s,dtype=np.float64)
+    return simpleSignificance(s,s+np.asarray(b,dtype=np.float64),bErr)
+
+significanceMethods = {
+    'asimov'         : asimovSignificance,
+    'simple'         : simpleSignificance,
+    'sOverSqrtSPlusB': sOverSqrtSPlusB,
+}
+
+def significance(sig,bg,bgErr2=None,invert=False,method='asimov',bgUncertainty=None):
+    '''
+    Significance for every threshold. The background uncertainty is
+    None (no uncertainty), 'stat' (the statistical error of the background) or a relative uncertainty.
+    '''
+    s = cumulative(sig,invert)
+    b = cumulative(bg,invert)
+    if bgUncertainty is None:
+        bErr = None
+    elif bgUncertainty=='stat':
+        bErr = np.sqrt(cumulative(bgErr2,invert))
+    else:
+        bErr = bgUncertainty*b
+    return significanceMethods[method](s,b,bErr)
+
+def efficiency(vals,invert=False):
+    '''Fraction of the visible bins passing each threshold, 0 for empty histograms'''
+    vals = np.asarray(vals,dtype=np.float64)
+    total = vals.sum(axis=-1)[...,np.newaxis]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return np.where(total!=0,cumulative(vals,invert)/total,0.)
+
+def roc(sig,bg,invert=False):
+    '''Signal efficiency and background rejection for every threshold'''
+    return efficiency(sig,invert), 1.-efficiency(bg,invert)
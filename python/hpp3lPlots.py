@@ -6,6 +6,7 @@ from itertools import product, combinations_with_replacement
 import math
 
 from DevTools.Plotter.Plotter import Plotter
+from DevTools.Plotter.PlotScheduler import PlotScheduler
 from DevTools.Utilities.utilities import ZMASS
 from DevTools.Plotter.higgsUtilities import getChannels, getChannelLabels, getCategories, getCategoryLabels, getSubCategories, getSubCategoryLabels, getGenRecoChannelMap, getSigMap
 from copy import deepcopy
@@ -32,7 +33,8 @@ plotVariableLoose = False
 new = True
 doUncertainties = True
 
-hpp3lPlotter = Plotter('Hpp3l',new=True)
+hpp3lPlotter = Plotter('Hpp3l',new=True,memoize=True,pngFromPdf=True)
+scheduler = PlotScheduler(prefetch=hpp3lPlotter.prefetch)
 
 #########################
 ### Define categories ###
@@ -123,7 +125,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + chanLabels
     savename = '/'.join([x for x in [saveDir,'individualChannels'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,labelsOption='v')
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,labelsOption='v')
 
     # per category counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -138,7 +140,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + catLabels
     savename = '/'.join([x for x in [saveDir,'individualCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
 
     # per subcategory counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -151,7 +153,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + subCatLabels
     savename = '/'.join([x for x in [saveDir,'individualSubCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
 
 
 def round_base(x, base=10):
@@ -258,7 +260,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
     plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
     savename = '/'.join([x for x in [saveDir,plot] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plot(plotvars,savename,**kwargs)
+    scheduler.submit(savename,plotter.plot,plotvars,savename,**kwargs)
     for cat in cats:
         kwargs = deepcopy(thiskwargs)
         plotnames = []
@@ -274,7 +276,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
             kwargs['scalewidth'] = True
             if plot in ymin and kwargs.get('logy',False): kwargs['ymin'] = ymin[plot][cat]
             if plot in ymax and kwargs.get('logy',False): kwargs['ymax'] = ymax[plot][cat]
-        if doCat: plotter.plot(plotvars,savename,**kwargs)
+        if doCat: scheduler.submit(savename,plotter.plot,plotvars,savename,**kwargs)
 
 def plotChannels(plotter,plot,baseDir='default',saveDir='',datadriven=False,postfix='',**kwargs):
     for chan in chans:
@@ -282,7 +284,7 @@ def plotChannels(plotter,plot,baseDir='default',saveDir='',datadriven=False,post
         plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
         savename = '/'.join([x for x in [saveDir,'channels',chan,plot] if x])
         if postfix: savename += '_{0}'.format(postfix)
-        plotter.plot(plotvars,savename,**kwargs)
+        scheduler.submit(savename,plotter.plot,plotvars,savename,**kwargs)
 
 ########################
 ### plot definitions ###
@@ -664,13 +666,13 @@ if plotNormalization:
         savename = 'normalized/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in norm_cust: kwargs.update(norm_cust[plot])
-        hpp3lPlotter.plotNormalized(plotname,savename,**kwargs)
+        scheduler.submit(savename,hpp3lPlotter.plotNormalized,plotname,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'normalized/{0}/{1}'.format(cat,plot)
-            if doCat: hpp3lPlotter.plotNormalized(plotnames,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp3lPlotter.plotNormalized,plotnames,savename,**kwargs)
 
 ####################################
 ### Signal over background plots ###
@@ -692,13 +694,13 @@ if plotSOverB:
         savename = 'sOverB/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in sOverB_cust: kwargs.update(sOverB_cust[plot])
-        hpp3lPlotter.plotSOverB(plotname,sigOrder,bgOrder,savename,**kwargs)
+        scheduler.submit(savename,hpp3lPlotter.plotSOverB,plotname,sigOrder,bgOrder,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'sOverB/{0}/{1}'.format(cat,plot)
-            if doCat: hpp3lPlotter.plotSOverB(plotnames,sigOrder,bgOrder,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp3lPlotter.plotSOverB,plotnames,sigOrder,bgOrder,savename,**kwargs)
 
 ##########################
 ### Significance plots ###
@@ -720,13 +722,13 @@ if plotSignificance:
         savename = 'significance/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in significance_cust: kwargs.update(significance_cust[plot])
-        hpp3lPlotter.plotSignificance(plotname,sigOrder,bgOrder,savename,**kwargs)
+        scheduler.submit(savename,hpp3lPlotter.plotSignificance,plotname,sigOrder,bgOrder,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'significance/{0}/{1}'.format(cat,plot)
-            if doCat: hpp3lPlotter.plotSignificance(plotnames,sigOrder,bgOrder,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp3lPlotter.plotSignificance,plotnames,sigOrder,bgOrder,savename,**kwargs)
 
 ##############################
 ### all signal on one plot ###
@@ -768,7 +770,7 @@ if plotAllMasses:
         kwargs = deepcopy(envelope_cust[plot])
         selection = ' && '.join(['{0}_passMedium'.format(lep) for lep in ['hpp1','hpp2','hm1']])
         scalefactor = 'hpp1_mediumScale*hpp2_mediumScale*hm1_mediumScale*genWeight*pileupWeight*triggerEfficiency'
-        hpp3lPlotter.plotEnvelope(varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,selection=selection,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
+        scheduler.submit(savename,hpp3lPlotter.plotEnvelope,varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,selection=selection,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
 
         for nTau in range(3):
             genChans = []
@@ -785,7 +787,7 @@ if plotAllMasses:
             savename = 'signal/envelopes/{0}_{1}Taus'.format(plot,nTau)
 
             fitFunctions = [['pol1',200,1500]+fitvalues[plot][nTau]] if plot in fitvalues else []
-            hpp3lPlotter.plotEnvelope(varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,fitFunctions=fitFunctions,selection=fullCut,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
+            scheduler.submit(savename,hpp3lPlotter.plotEnvelope,varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,fitFunctions=fitFunctions,selection=fullCut,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
 
 
 if plotSignal:
@@ -817,7 +819,7 @@ if plotSignal:
         savename = 'signal/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in norm_cust: kwargs.update(norm_cust[plot])
-        hpp3lPlotter.plotNormalized(plotname,savename,**kwargs)
+        scheduler.submit(savename,hpp3lPlotter.plotNormalized,plotname,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
@@ -825,7 +827,7 @@ if plotSignal:
             savename = 'signal/{0}/{1}'.format(cat,plot)
             catkwargs = deepcopy(kwargs)
             if cat in catRebin and 'rebin' in catkwargs and plot in ['hppMass']: catkwargs['rebin'] = catkwargs['rebin'] * catRebin[cat]
-            if doCat: hpp3lPlotter.plotNormalized(plotnames,savename,**catkwargs)
+            if doCat: scheduler.submit(savename,hpp3lPlotter.plotNormalized,plotnames,savename,**catkwargs)
 
     #for plot in eff_cust:
     #    kwargs = deepcopy(plots[plot])
@@ -891,6 +893,9 @@ if plotROC:
             if plotnames:
                 savename = 'signal/{0}/{1}_genMatched_roc'.format(higgsChan,plot)
                 wp = workingPoints[plot] if plot in workingPoints else {}
-                hpp3lPlotter.plotROC(plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
+                scheduler.submit(savename,hpp3lPlotter.plotROC,plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
                     
                                                                                                           
+
+scheduler.finish()
+hpp3lPlotter.finish()
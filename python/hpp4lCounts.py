@@ -209,6 +209,13 @@ for bp in ['ee100','em100','et100','mm100','mt100','tt100']:
     baseSelection += ' && {0}'.format(recoSelection)
     mcscalefactor = 'hpp1_mediumScale*hpp2_mediumScale*hmm1_mediumScale*hmm2_mediumScale*genWeight*pileupWeight*triggerEfficiency'
     
+    chanCuts = {}
+    for chan in sorted(chans):
+        if chan not in genRecoMap[genChanMap[bp]]: continue
+        recoCut = '(' + ' || '.join(['channel=="{0}"'.format(c) for c in chans[chan]]) + ')'
+        chanCuts[chan] = '{0} && {1}'.format(baseSelection,recoCut)
+    hpp4lCounter.prefetchCounts([baseSelection]+[chanCuts[chan] for chan in sorted(chanCuts)],mcscalefactor=mcscalefactor)
+
     hpp4lCounter.printHeader(bp)
     hpp4lCounter.printDivider()
     hpp4lCounter.printCounts('All','none',selection=baseSelection,mcscalefactor=mcscalefactor,doError=True)
@@ -217,8 +224,5 @@ for bp in ['ee100','em100','et100','mm100','mt100','tt100']:
     #        recoCut = '(' + ' || '.join(['channel=="{0}"'.format(c) for chan in subCatChannels[cat][subcat] for c in chans[chan]]) + ')'
     #        fullCut = '{0} && {1}'.format(baseSelection,recoCut)
     #        hpp4lCounter.printCounts(' - {0}-{1}'.format(cat,subcat),'none',selection=fullCut,mcscalefactor=mcscalefactor,doError=True)
-    for chan in sorted(chans):
-        if chan not in genRecoMap[genChanMap[bp]]: continue
-        recoCut = '(' + ' || '.join(['channel=="{0}"'.format(c) for c in chans[chan]]) + ')'
-        fullCut = '{0} && {1}'.format(baseSelection,recoCut)
-        hpp4lCounter.printCounts(' - {0}'.format(chan),'none',selection=fullCut,mcscalefactor=mcscalefactor,doError=True)
+    for chan in sorted(chanCuts):
+        hpp4lCounter.printCounts(' - {0}'.format(chan),'none',selection=chanCuts[chan],mcscalefactor=mcscalefactor,doError=True)
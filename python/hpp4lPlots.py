@@ -5,6 +5,7 @@ import logging
 from itertools import product, combinations_with_replacement
 
 from DevTools.Plotter.Plotter import Plotter
+from DevTools.Plotter.PlotScheduler import PlotScheduler
 from DevTools.Utilities.utilities import ZMASS, getCMSSWVersion
 from DevTools.Plotter.higgsUtilities import getChannels, getChannelLabels, getCategories, getCategoryLabels, getSubCategories, getSubCategoryLabels, getGenRecoChannelMap, getSigMap
 from copy import deepcopy
@@ -32,7 +33,8 @@ plotSig500 = True
 doUncertainties = True
 toPlot = []
 
-hpp4lPlotter = Plotter('Hpp4l',new=True)
+hpp4lPlotter = Plotter('Hpp4l',new=True,memoize=True,pngFromPdf=True)
+scheduler = PlotScheduler(prefetch=hpp4lPlotter.prefetch)
 
 #########################
 ### Define categories ###
@@ -122,7 +124,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + chanLabels
     savename = '/'.join([x for x in [saveDir,'individualChannels'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001,labelsOption='v')
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001,labelsOption='v')
     
     # per category counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -137,7 +139,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + catLabels
     savename = '/'.join([x for x in [saveDir,'individualCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
     
     # per subcategory counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -150,7 +152,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + subCatLabels
     savename = '/'.join([x for x in [saveDir,'individualSubCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
+    scheduler.submit(savename,plotter.plotCounts,countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
 
 import math
 
@@ -256,7 +258,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
     plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
     savename = '/'.join([x for x in [saveDir,plot] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plot(plotvars,savename,**kwargs)
+    scheduler.submit(savename,plotter.plot,plotvars,savename,**kwargs)
     for cat in cats:
         plotnames = []
         for subcat in subCatChannels[cat]:
@@ -271,7 +273,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
             kwargs['scalewidth'] = True
             if plot in ymax: kwargs['ymax'] = ymax[plot].get(cat,None)
             if plot in ymin and kwargs.get('logy',False): kwargs['ymin'] = ymin[plot][cat]
-        if doCat: plotter.plot(plotvars,savename,**kwargs)
+        if doCat: scheduler.submit(savename,plotter.plot,plotvars,savename,**kwargs)
 
 
 ########################
@@ -709,13 +711,13 @@ if plotNormalization:
         savename = 'normalized/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in norm_cust: kwargs.update(norm_cust[plot])
-        hpp4lPlotter.plotNormalized(plotname,savename,**kwargs)
+        scheduler.submit(savename,hpp4lPlotter.plotNormalized,plotname,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'normalized/{0}/{1}'.format(cat,plot)
-            if doCat: hpp4lPlotter.plotNormalized(plotnames,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp4lPlotter.plotNormalized,plotnames,savename,**kwargs)
 
 if plotSOverB:
     hpp4lPlotter.clearHistograms()
@@ -734,13 +736,13 @@ if plotSOverB:
         savename = 'sOverB/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in sOverB_cust: kwargs.update(sOverB_cust[plot])
-        hpp4lPlotter.plotSOverB(plotname,sigOrder,bgOrder,savename,**kwargs)
+        scheduler.submit(savename,hpp4lPlotter.plotSOverB,plotname,sigOrder,bgOrder,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'sOverB/{0}/{1}'.format(cat,plot)
-            if doCat: hpp4lPlotter.plotSOverB(plotnames,sigOrder,bgOrder,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp4lPlotter.plotSOverB,plotnames,sigOrder,bgOrder,savename,**kwargs)
 
 if plotSignificance:
     hpp4lPlotter.clearHistograms()
@@ -759,13 +761,13 @@ if plotSignificance:
         savename = 'significance/{0}'.format(plot)
         kwargs = deepcopy(plots[plot])
         if plot in significance_cust: kwargs.update(significance_cust[plot])
-        hpp4lPlotter.plotSignificance(plotname,sigOrder,bgOrder,savename,**kwargs)
+        scheduler.submit(savename,hpp4lPlotter.plotSignificance,plotname,sigOrder,bgOrder,savename,**kwargs)
         for cat in cats:
             plotnames = []
             for subcat in subCatChannels[cat]:
                 plotnames += ['default/{0}/{1}'.format(chan,plot) for chan in subCatChannels[cat][subcat]]
             savename = 'significance/{0}/{1}'.format(cat,plot)
-            if doCat: hpp4lPlotter.plotSignificance(plotnames,sigOrder,bgOrder,savename,**kwargs)
+            if doCat: scheduler.submit(savename,hpp4lPlotter.plotSignificance,plotnames,sigOrder,bgOrder,savename,**kwargs)
 
 
 ##############################
@@ -808,7 +810,7 @@ if plotAllMasses:
         kwargs = deepcopy(envelope_cust[plot])
         selection = ' && '.join(['{0}_passMedium'.format(lep) for lep in ['hpp1','hpp2','hmm1','hmm2']])
         scalefactor = 'hpp1_mediumScale*hpp2_mediumScale*hmm1_mediumScale*hmm2_mediumScale*genWeight*pileupWeight*triggerEfficiency'
-        hpp4lPlotter.plotEnvelope(varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,selection=selection,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
+        scheduler.submit(savename,hpp4lPlotter.plotEnvelope,varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,selection=selection,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
 
         for nTau in range(3):
             genChans = []
@@ -824,7 +826,7 @@ if plotAllMasses:
             savename = 'signal/envelopes/{0}_{1}Taus'.format(plot,nTau)
             
             fitFunctions = [['pol1',200,1500]+fitvalues[plot][nTau]] if plot in fitvalues else []
-            hpp4lPlotter.plotEnvelope(varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,fitFunctions=fitFunctions,selection=fullCut,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
+            scheduler.submit(savename,hpp4lPlotter.plotEnvelope,varMap[plot],savename,xvals,envelopePoints,envelopeLabels=envelopeLabels,envelopeStyles=envelopeStyles,envelopeColors=envelopeColors,fitFunctions=fitFunctions,selection=fullCut,mcscalefactor=scalefactor,binning=varBinning[plot],**kwargs)
 
 
 
@@ -859,7 +861,7 @@ if plotSignal:
             savename = 'signal{0}/{1}'.format('-righthanded' if righthanded else '',plot)
             kwargs = deepcopy(plots[plot])
             if plot in norm_cust: kwargs.update(norm_cust[plot])
-            hpp4lPlotter.plotNormalized(plotname,savename,**kwargs)
+            scheduler.submit(savename,hpp4lPlotter.plotNormalized,plotname,savename,**kwargs)
             for cat in cats:
                 plotnames = []
                 for subcat in subCatChannels[cat]:
@@ -867,7 +869,7 @@ if plotSignal:
                 savename = 'signal{0}/{1}/{2}'.format('-righthanded' if righthanded else '',cat,plot)
                 catkwargs = deepcopy(kwargs)
                 if cat in catRebin and 'rebin' in catkwargs and plot in ['hppMass','hmmMass']: catkwargs['rebin'] = catkwargs['rebin'] * catRebin[cat]
-                if doCat: hpp4lPlotter.plotNormalized(plotnames,savename,**catkwargs)
+                if doCat: scheduler.submit(savename,hpp4lPlotter.plotNormalized,plotnames,savename,**catkwargs)
         #for plot in eff_cust:
         #    kwargs = deepcopy(plots[plot])
         #    if plot in norm_cust: kwargs.update(norm_cust[plot])
@@ -935,4 +937,7 @@ if plotROC:
             if plotnames:
                 savename = 'signal/{0}/{1}_genMatched_roc'.format(higgsChan,plot)
                 wp = workingPoints[plot] if plot in workingPoints else {}
-                hpp4lPlotter.plotROC(plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
+                scheduler.submit(savename,hpp4lPlotter.plotROC,plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
+
+scheduler.finish()
+hpp4lPlotter.finish()
@@ -5,6 +5,7 @@ import logging
 from itertools import product, combinations_with_replacement
 
 from DevTools.Plotter.Plotter import Plotter
+from DevTools.Plotter.PlotScheduler import PlotScheduler
 from DevTools.Utilities.utilities import ZMASS, getCMSSWVersion
 from DevTools.Plotter.haaUtils import *
 from copy import deepcopy
@@ -34,6 +35,7 @@ newloose = []
 toPlot = []
 
 plotter = Plotter('MuMuTauTau',new=True)
+scheduler = PlotScheduler(prefetch=plotter.prefetch)
 
 
 #########################
@@ -246,7 +248,7 @@ if doMC:
             kwargs = deepcopy(plots[plot])
             plotname = '{0}/{1}'.format(sel,plot)
             savename = '{0}/mc/{1}'.format(sel,plot)
-            plotter.plot(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
         
         if blind and 'regionD' not in sel and 'lowmass' not in sel and 'highmass' not in sel: plotter.addHistogram('data',sigMap['data'])
         
@@ -255,7 +257,7 @@ if doMC:
                 kwargs = deepcopy(special[s][plot])
                 plotname = '{0}/{1}'.format(sel,plot)
                 savename = '{0}/mc/{1}_{2}'.format(sel,plot,s)
-                plotter.plot(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
 
 #########################
 ### Signals on 1 plot ###
@@ -276,7 +278,7 @@ if doSignals:
                 if plot in plotsSignal: kwargs.update(deepcopy(plotsSignal[plot]))
                 plotname = '{0}/{1}'.format(sel,plot)
                 savename = '{0}/h{h}/{1}'.format(sel,plot,h=h)
-                plotter.plot(plotname,savename,plotratio=False,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,plotratio=False,**kwargs)
         
     
     for a in [5,19]:
@@ -293,7 +295,7 @@ if doSignals:
                 if plot in plotsSignal: kwargs.update(deepcopy(plotsSignal[plot]))
                 plotname = '{0}/{1}'.format(sel,plot)
                 savename = '{0}/a{a}/{1}'.format(sel,plot,a=a)
-                plotter.plot(plotname,savename,plotratio=False,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,plotratio=False,**kwargs)
     
 ##################
 ### Datadriven ###
@@ -341,7 +343,7 @@ if doDatadriven:
                     plotname = '{}'.format(plot)
                     savename = '{}region{}/datadriven_from{}/{}'.format(tag+'/' if tag else '',region,source,plot)
                     if looseMVA: savename = '{}region{}/datadriven_from{}{:.1f}/{}'.format(tag+'/' if tag else '',region,source,looseMVA,plot)
-                    plotter.plot(getDatadrivenPlot(plotname,region=region,source=source,looseMVA=looseMVA,tag=tag),savename,**kwargs)
+                    scheduler.submit(savename,plotter.plot,getDatadrivenPlot(plotname,region=region,source=source,looseMVA=looseMVA,tag=tag),savename,**kwargs)
 
                 if blind or ('lowmass' not in tag and 'highmass' not in tag): plotter.addHistogram('data',sigMap['data'])
                 
@@ -351,7 +353,7 @@ if doDatadriven:
                         plotname = '{}'.format(plot)
                         savename = '{}region{}/datadriven_from{}/{}_{}'.format(tag+'/' if tag else '',region,source,plot,s)
                         if looseMVA: savename = '{}region{}/datadriven_from{}{:.1f}/{}_{}'.format(tag+'/' if tag else '',region,source,looseMVA,plot,s)
-                        plotter.plot(getDatadrivenPlot(plotname,region=region,source=source,looseMVA=looseMVA,tag=tag),savename,doGOF=True,**kwargs)
+                        scheduler.submit(savename,plotter.plot,getDatadrivenPlot(plotname,region=region,source=source,looseMVA=looseMVA,tag=tag),savename,doGOF=True,**kwargs)
 
 
 def getMatrixDatadrivenPlot(*plots,**kwargs):
@@ -449,7 +451,7 @@ if doMatrix:
                     savename = '{}region{}/matrix/{}'.format(tag+'/' if tag else '',region,plot)
                     if doPrompt and not doFake: savename = '{}region{}/matrix_prompt/{}'.format(tag+'/' if tag else '',region,plot)
                     if not doPrompt and doFake: savename = '{}region{}/matrix_fake/{}'.format(tag+'/' if tag else '',region,plot)
-                    plotter.plot(getMatrixPlot(plotname,region=region,sources=sources,tag=tag,doPrompt=doPrompt,doFake=doFake),savename,**kwargs)
+                    scheduler.submit(savename,plotter.plot,getMatrixPlot(plotname,region=region,sources=sources,tag=tag,doPrompt=doPrompt,doFake=doFake),savename,**kwargs)
                 
                 if blind or ('lowmass' not in tag and 'highmass' not in tag): plotter.addHistogram('data',sigMap['data'])
                 
@@ -460,7 +462,7 @@ if doMatrix:
                         savename = '{}region{}/matrix/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
                         if doPrompt and not doFake: savename = '{}region{}/matrix_prompt/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
                         if not doPrompt and doFake: savename = '{}region{}/matrix_fake/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
-                        plotter.plot(getMatrixPlot(plotname,region=region,sources=sources,tag=tag,doPrompt=doPrompt,doFake=doFake),savename,doGOF=True,**kwargs)
+                        scheduler.submit(savename,plotter.plot,getMatrixPlot(plotname,region=region,sources=sources,tag=tag,doPrompt=doPrompt,doFake=doFake),savename,doGOF=True,**kwargs)
 
 
         for region, sources in [('B',['B','D']),('A',['A','C'])]:
@@ -482,7 +484,7 @@ if doMatrix:
                 kwargs = deepcopy(plots[plot])
                 plotname = '{}'.format(plot)
                 savename = '{}region{}/matrix_prediction/{}'.format(tag+'/' if tag else '',region,plot)
-                plotter.plot(getMatrixPredictionPlot(plotname,region=region,sources=sources,tag=tag),savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,getMatrixPredictionPlot(plotname,region=region,sources=sources,tag=tag),savename,**kwargs)
             
             if blind or ('lowmass' not in tag and 'highmass' not in tag): plotter.addHistogram('data',sigMap['data'])
             
@@ -491,7 +493,7 @@ if doMatrix:
                     kwargs = deepcopy(special[s][plot])
                     plotname = '{}'.format(plot)
                     savename = '{}region{}/matrix_prediction/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
-                    plotter.plot(getMatrixPredictionPlot(plotname,region=region,sources=sources,tag=tag),savename,doGOF=True,**kwargs)
+                    scheduler.submit(savename,plotter.plot,getMatrixPredictionPlot(plotname,region=region,sources=sources,tag=tag),savename,doGOF=True,**kwargs)
 
         for doPrompt, doFake in [(1,1),(1,0),(0,1)]:
 
@@ -520,7 +522,7 @@ if doMatrix:
                 savename = '{}region{}/matrixDatadriven/{}'.format(tag+'/' if tag else '',region,plot)
                 if doPrompt and not doFake: savename = '{}region{}/matrixDatadriven_prompt/{}'.format(tag+'/' if tag else '',region,plot)
                 if not doPrompt and doFake: savename = '{}region{}/matrixDatadriven_fake/{}'.format(tag+'/' if tag else '',region,plot)
-                plotter.plot(getMatrixDatadrivenPlot(plotname,region=region,sources=sources,fakeRegions=fakeRegion,fakeSources=fakeSources,tag=tag,doFake=doFake,doPrompt=doPrompt),savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,getMatrixDatadrivenPlot(plotname,region=region,sources=sources,fakeRegions=fakeRegion,fakeSources=fakeSources,tag=tag,doFake=doFake,doPrompt=doPrompt),savename,**kwargs)
             
             if blind or ('lowmass' not in tag and 'highmass' not in tag): plotter.addHistogram('data',sigMap['data'])
             
@@ -531,7 +533,7 @@ if doMatrix:
                     savename = '{}region{}/matrixDatadriven/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
                     if doPrompt and not doFake: savename = '{}region{}/matrixDatadriven_prompt/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
                     if not doPrompt and doFake: savename = '{}region{}/matrixDatadriven_fake/{}_{}'.format(tag+'/' if tag else '',region,plot,s)
-                    plotter.plot(getMatrixDatadrivenPlot(plotname,region=region,sources=sources,fakeRegions=fakeRegion,fakeSources=fakeSources,tag=tag,doFake=doFake,doPrompt=doPrompt),savename,doGOF=True,**kwargs)
+                    scheduler.submit(savename,plotter.plot,getMatrixDatadrivenPlot(plotname,region=region,sources=sources,fakeRegions=fakeRegion,fakeSources=fakeSources,tag=tag,doFake=doFake,doPrompt=doPrompt),savename,doGOF=True,**kwargs)
 
 
 if doNormalizations:
@@ -555,18 +557,18 @@ if doNormalizations:
             kwargs = deepcopy(plots[plot])
             plotname = {'region{}'.format(region): 'lowmass/region{}/{}'.format(region,plot) for region in regions}
             savename = 'lowmass/regions/{}'.format(plot)
-            plotter.plot(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
             savename = 'lowmass/regions_normalized/{}'.format(plot)
-            plotter.plotNormalized(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for s in special:
             for plot in special[s]:
                 kwargs = deepcopy(special[s][plot])
                 plotname = {'region{}'.format(region): 'lowmass/region{}/{}'.format(region,plot) for region in regions}
                 savename = 'lowmass/regions/{}_{}'.format(plot,s)
-                plotter.plot(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
                 savename = 'lowmass/regions_normalized/{}_{}'.format(plot,s)
-                plotter.plotNormalized(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for plot in plots:
             kwargs = deepcopy(plots[plot])
@@ -577,9 +579,9 @@ if doNormalizations:
                 'regionD': 'lowmass/regionD_fakeForA/{}'.format(plot),
             }
             savename = 'lowmass/regions_datadriven/{}'.format(plot)
-            plotter.plot(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
             savename = 'lowmass/regions_datadriven_normalized/{}'.format(plot)
-            plotter.plotNormalized(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for s in special:
             for plot in special[s]:
@@ -591,9 +593,9 @@ if doNormalizations:
                     'regionD': 'lowmass/regionD_fakeForA/{}'.format(plot),
                 }
                 savename = 'lowmass/regions_datadriven/{}_{}'.format(plot,s)
-                plotter.plot(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
                 savename = 'lowmass/regions_datadriven_normalized/{}_{}'.format(plot,s)
-                plotter.plotNormalized(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
                     
     
     if doHighmass:
@@ -616,18 +618,18 @@ if doNormalizations:
             kwargs = deepcopy(plots[plot])
             plotname = {'region{}'.format(region): 'highmass/region{}/{}'.format(region,plot) for region in regions}
             savename = 'highmass/regions/{}'.format(plot)
-            plotter.plot(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
             savename = 'highmass/regions_normalized/{}'.format(plot)
-            plotter.plotNormalized(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for s in special:
             for plot in special[s]:
                 kwargs = deepcopy(special[s][plot])
                 plotname = {'region{}'.format(region): 'highmass/region{}/{}'.format(region,plot) for region in regions}
                 savename = 'highmass/regions/{}_{}'.format(plot,s)
-                plotter.plot(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
                 savename = 'highmass/regions_normalized/{}_{}'.format(plot,s)
-                plotter.plotNormalized(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for plot in plots:
             kwargs = deepcopy(plots[plot])
@@ -638,9 +640,9 @@ if doNormalizations:
                 'regionD': 'highmass/regionD_fakeForA/{}'.format(plot),
             }
             savename = 'highmass/regions_datadriven/{}'.format(plot)
-            plotter.plot(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
             savename = 'highmass/regions_datadriven_normalized/{}'.format(plot)
-            plotter.plotNormalized(plotname,savename,**kwargs)
+            scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
     
         for s in special:
             for plot in special[s]:
@@ -652,9 +654,9 @@ if doNormalizations:
                     'regionD': 'highmass/regionD_fakeForA/{}'.format(plot),
                 }
                 savename = 'highmass/regions_datadriven/{}_{}'.format(plot,s)
-                plotter.plot(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plot,plotname,savename,**kwargs)
                 savename = 'highmass/regions_datadriven_normalized/{}_{}'.format(plot,s)
-                plotter.plotNormalized(plotname,savename,**kwargs)
+                scheduler.submit(savename,plotter.plotNormalized,plotname,savename,**kwargs)
                     
 
     
@@ -680,9 +682,6 @@ if do2D:
                 #    kwargs['rebiny'] = 10
                 plotname = '{0}/{1}'.format(sel,plot)
                 savename = '{0}/2D/{1}/{2}'.format(sel,sample,plot)
-                plotter.plot2D(plotname,savename,**kwargs)
-
-
-
-
+                scheduler.submit(savename,plotter.plot2D,plotname,savename,**kwargs)
 
+scheduler.finish()
@@ -0,0 +1,40 @@
+# utilities for processing a single sample on several cores
+import logging
+import multiprocessing
+
+# object whose method is run by the forked workers
+workerInstance = None
+
+def runWorker(args):
+    method, i, payload = args
+    try:
+        return getattr(workerInstance,method)(i,payload)
+    except:
+        logging.exception('Worker {0} failed in {1}'.format(i,method))
+        raise
+
+def mapWorkers(instance,method,payloads):
+    '''
+    Run instance.method(i,payload) for each payload in a pool of forked processes.
+    The workers inherit the full state of the instance, so nothing but the payload and the return value is pickled.
+    '''
+    global workerInstance
+    workerInstance = instance
+    pool = multiprocessing.Pool(len(payloads))
+    try:
+        return pool.map(runWorker,[(method,i,payload) for i,payload in enumerate(payloads)])
+    finally:
+        pool.close()
+        pool.join()
+        workerInstance = None
+
+def splitFiles(files,n,entries=None):
+    '''Split files into at most n groups with similar numbers of entries'''
+    if entries is None: entries = lambda f: 1
+    groups = [[] for i in range(n)]
+    totals = [0]*n
+    for f in sorted(files,key=lambda f: -entries(f)):
+        i = totals.index(min(totals))
+        groups[i] += [f]
+        totals[i] += max(entries(f),1)
+    return [sorted(group) for group in groups if group]
@@ -1,8 +1,10 @@
 # common utilities for plotting
+import logging
 import os
 import sys
 import hashlib
 import glob
+import fnmatch
 
 from DevTools.Utilities.utilities import python_mkdir, ZMASS, getCMSSWVersion
 from DevTools.Utilities.hdfsUtils import get_hdfs_root_files
@@ -33,6 +35,66 @@ def isData(sample):
     dataSamples = ['DoubleMuon','DoubleEG','MuonEG','SingleMuon','SingleElectron','Tau']
     return sample in dataSamples
 
+# which samples a shift changes (the Up/Down direction is dropped):
+#   'mc'  : weights and scale factors, or corrections only produced for simulation
+#   'all' : also data (e.g. the fake rates of the datadriven estimates)
+#   a list of sample name patterns (unix style wildcards) for shifts that only touch a few samples
+# shifts not listed change every sample
+shiftScopes = {
+    'lep'          : 'mc',
+    'trig'         : 'mc',
+    'pu'           : 'mc',
+    'btag'         : 'mc',
+    'fake'         : 'all',
+    'ElectronEn'   : 'mc',
+    'MuonEn'       : 'mc',
+    'TauEn'        : 'mc',
+    'JetEn'        : 'mc',
+    'JetRes'       : 'mc',
+    'UnclusteredEn': 'mc',
+}
+
+def getShiftScope(shift):
+    for d in ['Up','Down']:
+        if shift.endswith(d): shift = shift[:-len(d)]
+    return shiftScopes.get(shift,'all')
+
+def shiftAffects(sample,shift):
+    '''Test if a shift changes a sample, otherwise the shifted sample is the nominal'''
+    if not shift: return True
+    scope = getShiftScope(shift)
+    if scope=='all': return True
+    if scope=='mc': return not isData(sample)
+    return any([fnmatch.fnmatch(sample,pattern) for pattern in scope])
+
+def resolveShift(sample,shift):
+    '''The shift whose outputs a sample uses, '' (the nominal) for shifts that do not change it'''
+    return shift if shiftAffects(sample,shift) else ''
+
+def planShiftJobs(samples,shifts):
+    '''
+    Split the (sample, shift) combinations into the jobs to process and
+    the ones that are aliases of the nominal of the sample.
+    '''
+    jobs = []
+    aliases = []
+    for sample in samples:
+        for shift in shifts:
+            if shiftAffects(sample,shift):
+                jobs += [(sample,shift)]
+            else:
+                aliases += [(sample,shift)]
+    return jobs, aliases
+
+def getPlannedDirectories(directories,shift):
+    '''Drop the samples the shift does not change, they use the nominal outputs'''
+    if not shift: return directories
+    samples = [d.split('/')[-1][:-5] if d.endswith('.root') else d.split('/')[-1] for d in directories]
+    jobs, aliases = planShiftJobs(samples,[shift])
+    for sample, s in aliases:
+        logging.info('{0} is not changed by {1}, using the nominal'.format(sample,s))
+    return [d for d,sample in zip(directories,samples) if (sample,shift) in jobs]
+
 runMap = {
     'Run2016B': 5788.,
     'Run2016C': 2573.,
@@ -249,6 +311,7 @@ latestHistograms['80X']['MuMuTauTau'] = {
 }
 
 def getNewFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     flat = 'newflat/{0}/{1}.root'.format(analysis,sample)
     if shift in latestHistograms.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -258,6 +321,7 @@ def getNewFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
     return flat
 
 def getNewProjectionHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     flat = 'newflat/{0}/{1}.root'.format(analysis,sample)
     if shift in latestHistograms.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -267,6 +331,7 @@ def getNewProjectionHistograms(analysis,sample,version=getCMSSWVersion(),shift='
     return flat
         
 def getFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     flat = 'flat/{0}/{1}.root'.format(analysis,sample)
     if shift in latestHistograms.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -276,6 +341,7 @@ def getFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
     return flat
         
 def getProjectionHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     proj = 'projections/{0}/{1}.root'.format(analysis,sample)
     if shift in latestHistograms.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -284,6 +350,50 @@ def getProjectionHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
             if 'projection' in fname: proj = fname
     return proj
         
+def getPartialHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
+    if shift: return 'partials/{0}/{1}/{2}.root'.format(analysis,shift,sample)
+    return 'partials/{0}/{1}.root'.format(analysis,sample)
+
+def getEntryListFile(analysis,sample,version=getCMSSWVersion(),shift=''):
+    if shift: return 'entrylists/{0}/{1}/{2}.root'.format(analysis,shift,sample)
+    return 'entrylists/{0}/{1}.root'.format(analysis,sample)
+
+def _stripParentheses(cut):
+    '''Remove parentheses enclosing the full cut'''
+    while cut.startswith('(') and cut.endswith(')'):
+        depth = 0
+        for i,c in enumerate(cut):
+            if c=='(': depth += 1
+            if c==')': depth -= 1
+            if depth==0: break
+        if i!=len(cut)-1: break
+        cut = cut[1:-1]
+    return cut
+
+def splitSelection(selection):
+    '''
+    Split a cut string into its normalized top level && terms, sorted and without duplicates.
+    A cut with a top level || is kept as a single term.
+    '''
+    cut = _stripParentheses(''.join(str(selection).split()))
+    terms = []
+    depth = 0
+    start = 0
+    i = 0
+    while i<len(cut):
+        c = cut[i]
+        if c=='(': depth += 1
+        if c==')': depth -= 1
+        if depth==0 and cut[i:i+2]=='||': return [cut]
+        if depth==0 and cut[i:i+2]=='&&':
+            terms += [cut[start:i]]
+            start = i+2
+            i += 1
+        i += 1
+    terms += [cut[start:]]
+    if len(terms)>1: terms = sum([splitSelection(t) for t in terms],[])
+    return sorted(set([t for t in terms if t and t!='1']))
+
 latestSkims = {}
 latestSkims['80X'] = {}
 latestSkims['80X']['Hpp3l'] = {
@@ -384,6 +494,7 @@ latestSkims['80X']['Hpp4l'] = {
 }
 
 def getSkimJson(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     jfile = 'jsons/{0}/skims/{1}.json'.format(analysis,sample)
     if shift and shift in latestSkims.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -398,6 +509,7 @@ def getSkimJson(analysis,sample,version=getCMSSWVersion(),shift=''):
     return jfile
 
 def getSkimPickle(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
     pfile = 'pickles/{0}/skims/{1}.pkl'.format(analysis,sample)
     if shift and shift in latestSkims.get(version,{}).get(analysis,{}):
         baseDir = '/hdfs/store/user/dntaylor'
@@ -411,6 +523,23 @@ def getSkimPickle(analysis,sample,version=getCMSSWVersion(),shift=''):
     #    raise Exception('Unrecognized {0}'.format(':'.join([analysis,sample,version,shift])))
     return pfile
 
+def getSkimCountStore(analysis,sample,version=getCMSSWVersion(),shift=''):
+    shift = resolveShift(sample,shift)
+    cfile = 'counts/{0}/skims/{1}.cnt'.format(analysis,sample)
+    if shift and shift in latestSkims.get(version,{}).get(analysis,{}):
+        baseDir = '/hdfs/store/user/dntaylor'
+        cpath = os.path.join(baseDir,latestSkims[version][analysis][shift],sample)
+        fnames = glob.glob('{0}/*.root'.format(cpath))
+        if len(fnames)==0:
+            raise Exception('No such path {0}'.format(cpath))
+        for fname in fnames:
+            if 'cnt' in fname: cfile = fname
+    return cfile
+
+def getNtupleIndexFile(analysis,sample,version=getCMSSWVersion(),shift=''):
+    if shift: return 'indices/{0}/{1}/{2}.json'.format(analysis,shift,sample)
+    return 'indices/{0}/{1}.json'.format(analysis,sample)
+
 treeMap = {
     ''               : 'Tree',
     'Electron'       : 'ETree',
@@ -30,8 +30,10 @@ def main(argv=None):
 
     jdir = 'jsons/{0}/skims'.format(args.analysis)
     pdir = 'pickles/{0}/skims'.format(args.analysis)
+    cdir = 'counts/{0}/skims'.format(args.analysis)
     python_mkdir(jdir)
     python_mkdir(pdir)
+    python_mkdir(cdir)
 
 
     alldirs = sorted(glob.glob('{0}/*'.format(args.input)))
@@ -43,6 +45,7 @@ def main(argv=None):
         files = glob.glob('{0}/*.root'.format(directory))
         jsons = [x for x in files if '.json' in x]
         pickles = [x for x in files if '.pkl' in x]
+        stores = [x for x in files if '.cnt' in x]
         if jsons:
             jsonfile = '{0}/{1}.json'.format(jdir,destname)
             command = 'cp {0} {1}'.format(jsons[0],jsonfile)
@@ -51,6 +54,10 @@ def main(argv=None):
             pklfile = '{0}/{1}.pkl'.format(pdir,destname)
             command = 'cp {0} {1}'.format(pickles[0],pklfile)
             runCommand(command)
+        if stores:
+            cntfile = '{0}/{1}.cnt'.format(cdir,destname)
+            command = 'cp {0} {1}'.format(stores[0],cntfile)
+            runCommand(command)
 
 
 if __name__ == "__main__":
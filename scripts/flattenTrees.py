@@ -12,7 +12,7 @@ import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
-from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
+from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName, getPlannedDirectories
 from DevTools.Plotter.FlattenTree import FlattenTree
 
 try:
@@ -35,6 +35,10 @@ def flatten(analysis,sample,**kwargs):
     job = kwargs.pop('job',0)
     multi = kwargs.pop('multi',False)
     useProof = kwargs.pop('useProof',False)
+    batch = kwargs.pop('batch',True)
+    incremental = kwargs.pop('incremental',False)
+    ncores = kwargs.pop('ncores',1)
+    lazyProjections = kwargs.pop('lazyProjections',False)
     if hasProgress and multi:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' histograms ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
@@ -43,9 +47,9 @@ def flatten(analysis,sample,**kwargs):
     if outputFile:
         flat = outputFile
         proj = outputFile.replace('.root','_projection.root')
-        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,flat=flat,proj=proj,shift=shift,countOnly=countOnly,useProof=useProof)
+        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,flat=flat,proj=proj,shift=shift,countOnly=countOnly,useProof=useProof,incremental=incremental,ncores=ncores,lazyProjections=lazyProjections)
     else:
-        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,shift=shift,countOnly=countOnly,useProof=useProof)
+        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,shift=shift,countOnly=countOnly,useProof=useProof,incremental=incremental,ncores=ncores,lazyProjections=lazyProjections)
 
     for histName, params in histParams.iteritems():
         flattener.addHistogram(histName,**params)
@@ -53,7 +57,7 @@ def flatten(analysis,sample,**kwargs):
     for selName, sel in histSelections.iteritems():
         if sel: flattener.addSelection(selName,**sel['kwargs'])
 
-    flattener.flattenAll(progressbar=pbar,njobs=njobs,job=job,multi=multi)
+    flattener.flattenAll(progressbar=pbar,njobs=njobs,job=job,multi=multi,batch=batch)
 
 def getSampleDirectories(analysis,sampleList):
     source = getNtupleDirectory(analysis)
@@ -99,9 +103,12 @@ def parse_command_line(argv):
     parser.add_argument('--hists', nargs='+', type=str, default=['all'], help='Histograms to flatten.')
     parser.add_argument('--selections', nargs='+', type=str, default=['all'], help='Selections to flatten.')
     parser.add_argument('--channels', nargs='+', type=str, default=['all'], help='Channels to project.')
-    parser.add_argument('--skipProjection', action='store_true', help='Skip projecting')
+    parser.add_argument('--skipProjection', action='store_true', help='Skip projecting, channels are projected when first read')
+    parser.add_argument('--incremental', action='store_true', help='Cache per file partial histograms, only new or modified files are processed')
+    parser.add_argument('--noBatch', action='store_true', help='Draw each histogram in a separate pass over the ntuple')
     #parser.add_argument('--useProof', action='store_true', help='Use PROOF')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
+    parser.add_argument('-n','--ncores',type=int,default=1,help='Number of cores to use within a sample')
 
     return parser.parse_args(argv)
 
@@ -132,7 +139,7 @@ def main(argv=None):
                 job = int(jobparams[-1])
         grid = True
     else:
-        directories = getSampleDirectories(args.analysis,args.samples)
+        directories = getPlannedDirectories(getSampleDirectories(args.analysis,args.samples),args.shift)
         logging.info('Will flatten {0} samples'.format(len(directories)))
 
     if grid:
@@ -148,6 +155,8 @@ def main(argv=None):
                 countOnly=args.countOnly,
                 njobs=njobs,
                 job=job,
+                batch=not args.noBatch,
+                lazyProjections=args.skipProjection,
                 )
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
@@ -156,7 +165,7 @@ def main(argv=None):
             if sample.endswith('.root'): sample = sample[:-5]
             histParams = getSelectedHistParams(args.analysis,args.hists,sample,shift=args.shift,countOnly=args.countOnly)
             histSelections = getSelectedHistSelections(args.analysis,args.selections,sample,shift=args.shift,countOnly=args.countOnly)
-            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'histParams':histParams,'histSelections':histSelections,'shift':args.shift,'countOnly':args.countOnly,'multi':True,})
+            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'histParams':histParams,'histSelections':histSelections,'shift':args.shift,'countOnly':args.countOnly,'multi':True,'batch':not args.noBatch,'incremental':args.incremental,'ncores':args.ncores,'lazyProjections':args.skipProjection,})
         multi.retrieve()
     else:
         for directory in directories:
@@ -171,6 +180,10 @@ def main(argv=None):
                     shift=args.shift,
                     countOnly=args.countOnly,
                     multi=False,
+                    batch=not args.noBatch,
+                    incremental=args.incremental,
+                    ncores=args.ncores,
+                    lazyProjections=args.skipProjection,
                     #useProof=args.useProof,
                     )
 
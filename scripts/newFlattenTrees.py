@@ -11,7 +11,7 @@ from copy import deepcopy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
-from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
+from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName, getPlannedDirectories
 from DevTools.Plotter.WZFlattener import WZFlattener
 from DevTools.Plotter.Hpp3lFlattener import Hpp3lFlattener
 from DevTools.Plotter.Hpp4lFlattener import Hpp4lFlattener
@@ -44,15 +44,20 @@ def flatten(analysis,sample,**kwargs):
     njobs = kwargs.pop('njobs',1)
     job = kwargs.pop('job',0)
     multi = kwargs.pop('multi',False)
+    ncores = kwargs.pop('ncores',1)
+    weightShifts = kwargs.pop('weightShifts',False)
     if hasProgress:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
         pbar = None
 
+    # the weight only shifts are filled in the same pass as the nominal
+    shifts = flatteners[analysis].weightShiftNames if weightShifts and not shift else []
+
     if outputFile:
-        flattener = flatteners[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar)
+        flattener = flatteners[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar,ncores=ncores,weightShifts=shifts)
     else:
-        flattener = flatteners[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar)
+        flattener = flatteners[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar,ncores=ncores,weightShifts=shifts)
 
     flattener.flatten()
 
@@ -71,6 +76,8 @@ def parse_command_line(argv):
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
     parser.add_argument('--samples', nargs='+', type=str, default=['*'], help='Samples to flatten. Supports unix style wildcards.')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
+    parser.add_argument('-n','--ncores',type=int,default=1,help='Number of cores to use within a sample')
+    parser.add_argument('--weightShifts', action='store_true', help='Also flatten the weight only shifts of the analysis in the nominal pass')
 
     return parser.parse_args(argv)
 
@@ -100,7 +107,7 @@ def main(argv=None):
         print 'sample', sample
         grid = True
     else:
-        directories = getSampleDirectories(args.analysis,args.samples)
+        directories = getPlannedDirectories(getSampleDirectories(args.analysis,args.samples),args.shift)
         logging.info('Will flatten {0} samples'.format(len(directories)))
 
     if grid:
@@ -109,13 +116,15 @@ def main(argv=None):
                 #inputFileList=inputFileList,
                 outputFile=outputFile,
                 shift=args.shift,
+                ncores=args.ncores,
+                weightShifts=args.weightShifts,
                 )
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
         for directory in directories:
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
-            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,})
+            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,'ncores':args.ncores,'weightShifts':args.weightShifts,})
         multi.retrieve()
     else:
         for directory in directories:
@@ -125,6 +134,8 @@ def main(argv=None):
                     sample,
                     shift=args.shift,
                     multi=False,
+                    ncores=args.ncores,
+                    weightShifts=args.weightShifts,
                     )
 
     logging.info('Finished')
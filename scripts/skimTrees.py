@@ -11,7 +11,7 @@ from copy import deepcopy
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
-from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
+from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName, getPlannedDirectories
 from DevTools.Plotter.Hpp3lSkimmer import Hpp3lSkimmer
 from DevTools.Plotter.Hpp4lSkimmer import Hpp4lSkimmer
 from DevTools.Plotter.WZSkimmer import WZSkimmer
@@ -30,6 +30,8 @@ def skim(analysis,sample,**kwargs):
     outputFile = kwargs.pop('outputFile','')
     shift = kwargs.pop('shift','')
     multi = kwargs.pop('multi',False)
+    ncores = kwargs.pop('ncores',1)
+    dumpJson = kwargs.pop('dumpJson',False)
     if hasProgress and multi:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' events ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
@@ -45,9 +47,9 @@ def skim(analysis,sample,**kwargs):
         return
 
     if outputFile:
-        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar)
+        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar,ncores=ncores,dumpJson=dumpJson)
     else:
-        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar)
+        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar,ncores=ncores,dumpJson=dumpJson)
 
     skimmer.skim()
 
@@ -66,6 +68,8 @@ def parse_command_line(argv):
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
     parser.add_argument('--samples', nargs='+', type=str, default=['*'], help='Samples to flatten. Supports unix style wildcards.')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
+    parser.add_argument('-n','--ncores',type=int,default=1,help='Number of cores to use within a sample')
+    parser.add_argument('--dumpJson', action='store_true', help='Also write the counts to json for debugging')
 
     return parser.parse_args(argv)
 
@@ -89,7 +93,7 @@ def main(argv=None):
             sample = jobparams[-2]
         grid = True
     else:
-        directories = getSampleDirectories(args.analysis,args.samples)
+        directories = getPlannedDirectories(getSampleDirectories(args.analysis,args.samples),args.shift)
         logging.info('Will flatten {0} samples'.format(len(directories)))
 
     if grid:
@@ -97,13 +101,15 @@ def main(argv=None):
              sample,
              outputFile=outputFile,
              shift=args.shift,
+             ncores=args.ncores,
+             dumpJson=args.dumpJson,
              )
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
         for directory in directories:
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
-            multi.addJob(sample,skim,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,})
+            multi.addJob(sample,skim,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,'ncores':args.ncores,'dumpJson':args.dumpJson,})
         multi.retrieve()
     else:
         for directory in directories:
@@ -113,6 +119,8 @@ def main(argv=None):
                  sample,
                  shift=args.shift,
                  multi=False,
+                 ncores=args.ncores,
+                 dumpJson=args.dumpJson,
                  )
 
     logging.info('Finished')